@@ -46,6 +46,16 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    # orjson-backed JSON (drivo.renderers); falls back to the stdlib when orjson is missing
+    'DEFAULT_RENDERER_CLASSES': (
+        'drivo.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'drivo.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
 SIMPLE_JWT = {
@@ -135,21 +145,47 @@ DATE_FORMAT = 'Y-m-d'
 DATETIME_FORMAT = 'Y-m-d H:i:s'
 TIME_FORMAT = 'H:i:s'
 
-# Cache configuration
+# Cache configuration; InstrumentedCache wraps OPTIONS['BACKEND'] and counts
+# hits/misses/sets/bytes/latency per key namespace (cache-stats/, metrics/).
+# SizedLRUCache gives each key prefix its own LRU with a byte budget, so
+# per-worker cache memory is bounded by the sum of BUDGETS.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'drivo.cache_backends.InstrumentedCache',
         'LOCATION': 'unique-snowflake',
         'TIMEOUT': 300,  # 5 minutes default timeout
-    }
+        'OPTIONS': {
+            'BACKEND': 'drivo.cache_backends.SizedLRUCache',
+            'BUDGETS': {
+                'geocode_': 16 * 2 ** 20,
+                'fare_quote_': 4 * 2 ** 20,
+                'driver_profile_id_': 2 * 2 ** 20,
+                'location_trace_watermark_': 2 * 2 ** 20,
+                'other': 8 * 2 ** 20,
+            },
+            'COMPRESS_MIN_BYTES': 1024,  # zlib-compress larger values
+        },
+    },
+    # The default cache is per process. Locks and rate limits that must hold
+    # across workers and the run_dispatch process (drivo.cache_backends.shared_cache)
+    # live here; the table is created by migration drivo 0006 (createcachetable)
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'drivo_shared_cache',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,  # culling could drop locks that are still held
+        },
+    },
 }
 
 # For production, consider using Redis:
 # CACHES = {
 #     'default': {
-#         'BACKEND': 'django_redis.cache.RedisCache',
+#         'BACKEND': 'drivo.cache_backends.InstrumentedCache',
 #         'LOCATION': 'redis://127.0.0.1:6379/1',
 #         'OPTIONS': {
+#             'BACKEND': 'django_redis.cache.RedisCache',
 #             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
 #         },
 #         'KEY_PREFIX': 'drivo_',
@@ -158,4 +194,111 @@ CACHES = {
 # }
 
 # Custom settings for the application
-API_BASE_URL = os.getenv('API_BASE_URL', 'http://192.168.100.7:8000')
\ No newline at end of file
+API_BASE_URL = os.getenv('API_BASE_URL', 'http://192.168.100.7:8000')
+
+# Nearby driver search (drivo.geo grid index)
+DRIVER_INDEX_CELL_DEGREES = 0.02  # ~2.2 km cells
+DRIVER_INDEX_SYNC_SECONDS = 5  # pull positions written by other workers
+DRIVER_SEARCH_DEFAULT_RADIUS_KM = 5
+DRIVER_SEARCH_MAX_RADIUS_KM = 50
+DRIVER_SEARCH_MAX_RESULTS = 100
+DRIVER_STATUS_COUNTS_SECONDS = 30  # per-status driver counts reported by available-drivers/ are cached this long
+
+# Live driver locations (drivo.live_location write-behind store)
+LIVE_LOCATION_TTL_SECONDS = 300
+LIVE_LOCATION_FLUSH_SECONDS = 5
+LIVE_LOCATION_FLUSH_BATCH_SIZE = 500
+LOCATION_TRACE_MAX_POINTS = 1000  # per batched trace upload
+LOCATION_TRACE_MAX_CLOCK_SKEW_SECONDS = 60
+
+# Service-authenticated bulk location ingest (X-Ingest-Token header)
+LOCATION_INGEST_TOKENS = [t for t in os.getenv('LOCATION_INGEST_TOKENS', '').split(',') if t]
+LOCATION_INGEST_CHUNK_SIZE = 1000
+LOCATION_INGEST_MAX_RECORDS = 50000
+
+# Batch ride dispatch (python manage.py run_dispatch)
+DISPATCH_TICK_SECONDS = 2
+DISPATCH_MAX_PICKUP_KM = 10
+DISPATCH_MAX_RIDES_PER_TICK = 5000
+DISPATCH_CANDIDATES_PER_RIDE = 8
+DISPATCH_BLOCK_SIZE = 500
+DISPATCH_SCHEDULE_HORIZON_MINUTES = 15  # scheduled rides enter dispatch this early
+DISPATCH_SOLVER = 'auto'  # 'hungarian' needs scipy; falls back to greedy
+
+# Fare estimation (drivo.fares); amounts in PKR
+FARE_TARIFFS = {
+    'bike': {'base': 60, 'per_km': 25, 'minimum': 100},
+    'rickshaw': {'base': 80, 'per_km': 40, 'minimum': 150},
+    'car': {'base': 150, 'per_km': 60, 'minimum': 250},
+    'suv': {'base': 200, 'per_km': 80, 'minimum': 350},
+    'van': {'base': 250, 'per_km': 90, 'minimum': 400},
+    'truck': {'base': 500, 'per_km': 150, 'minimum': 800},
+}
+FARE_DEFAULT_VEHICLE = 'car'  # tariff for unknown vehicle types
+FARE_FUEL_MULTIPLIERS = {
+    'petrol': 1.0,
+    'diesel': 0.95,
+    'cng': 0.85,
+    'electric': 0.8,
+    'hybrid': 0.9,
+}
+FARE_ROUND_TRIP_MULTIPLIER = 1.8
+FARE_ROAD_DISTANCE_FACTOR = 1.3  # straight-line km -> estimated road km
+FARE_CURRENCY = 'PKR'
+FARE_QUOTE_MAX_TRIPS = 20  # pickup/dropoff pairs per quote request
+FARE_QUOTE_CACHE_SECONDS = 60
+FARE_QUOTE_COORDINATE_PLACES = 4  # ~11 m; quotes are cached per rounded pair
+
+# Distance/ETA matrices (drivo.matrix); keys are lower-case DriverProfile.city,
+# peak_hours are local hours in TIME_ZONE
+MATRIX_CHUNK_CELLS = 2000000  # matrix entries computed per chunk (~16 MB)
+ETA_SPEED_PROFILES = {
+    'default': {'speed_kmh': 25, 'road_factor': 1.3},
+    'lahore': {'speed_kmh': 28, 'peak_speed_kmh': 16, 'peak_hours': [8, 9, 17, 18, 19], 'road_factor': 1.3},
+    'karachi': {'speed_kmh': 26, 'peak_speed_kmh': 14, 'peak_hours': [8, 9, 18, 19, 20], 'road_factor': 1.35},
+    'islamabad': {'speed_kmh': 35, 'peak_speed_kmh': 22, 'peak_hours': [8, 9, 17, 18], 'road_factor': 1.25},
+    'rawalpindi': {'speed_kmh': 24, 'peak_speed_kmh': 15, 'peak_hours': [8, 9, 17, 18], 'road_factor': 1.3},
+}
+
+# Local gazetteer consulted by GeocodeView before Nominatim (drivo.gazetteer)
+GAZETTEER_PATH = BASE_DIR / 'drivo' / 'data' / 'places.csv'
+REVERSE_GEOCODE_MAX_KM = 5  # nearest known place must be this close
+REVERSE_GEOCODE_MAX_POINTS = 500  # per batched reverse-geocode request
+
+# Place autocomplete (drivo.autocomplete), ranked by ride popularity
+AUTOCOMPLETE_MAX_RESULTS = 10
+AUTOCOMPLETE_REFRESH_SECONDS = 600  # how often ride popularity is recounted
+AUTOCOMPLETE_POPULARITY_LOCATIONS = 5000  # most frequent ride location strings matched
+
+# Geocoding (drivo.geocoding); concurrent misses for a query share one upstream call
+GEOCODE_SINGLE_FLIGHT_LOCK_SECONDS = 10  # cross-worker lock held while fetching
+GEOCODE_SINGLE_FLIGHT_WAIT_SECONDS = 10  # how long other requests wait for the result
+
+# Nominatim client (drivo.nominatim); the rate limit is shared by all workers
+NOMINATIM_URL = os.getenv('NOMINATIM_URL', 'https://nominatim.openstreetmap.org')
+NOMINATIM_RATE_PER_SECOND = 1.0  # Nominatim usage policy
+NOMINATIM_BURST = 1
+NOMINATIM_TIMEOUT_SECONDS = 5
+NOMINATIM_DEADLINE_SECONDS = 8  # max wait for a rate limit token plus the request
+NOMINATIM_MAX_QUEUE = 16  # callers allowed to wait for a token at once, per worker
+NOMINATIM_POOL_SIZE = 4
+NOMINATIM_BREAKER_FAILURES = 5
+NOMINATIM_BREAKER_RESET_SECONDS = 30
+
+# Two-tier geocode cache (drivo.geocode_cache): in-process LRU over the GeocodeCacheEntry table
+GEOCODE_CACHE_LRU_ENTRIES = 10000  # per worker
+GEOCODE_CACHE_LRU_BYTES = 32 * 2 ** 20  # per worker, pickled payload sizes
+GEOCODE_CACHE_STALE_SECONDS = 7 * 86400  # expired results are served this long while refreshing
+GEOCODE_CACHE_WARM_ENTRIES = 1000  # most requested entries loaded when a worker starts
+GEOCODE_CACHE_HIT_FLUSH_SECONDS = 60
+GEOCODE_REFRESH_WORKERS = 2  # background refresh threads per worker
+
+# Batch geocoding (POST geocode/batch/); misses share the Nominatim rate limit
+GEOCODE_BATCH_MAX_QUERIES = 1000
+GEOCODE_BATCH_WORKERS = 4  # concurrent upstream lookups per request, at most NOMINATIM_POOL_SIZE
+
+# Keyset pagination (drivo.pagination) for rides, payments and reviews; ?total=1 adds an approximate count
+APPROXIMATE_COUNT_TIMEOUT = 60  # seconds a fallback COUNT(*) is cached when table statistics are unavailable
+
+# Conditional GET (drivo.conditional) for polled profile, driver list and ride endpoints
+ETAG_VERSION_SECONDS = 600  # lifetime of the shared-cache token for user rows, which have no version column
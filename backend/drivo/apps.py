@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class DrivoConfig(AppConfig):
+    name = 'drivo'
+
+    def ready(self):
+        # Registers the post_save/post_delete receivers that expire ETags
+        from drivo import conditional  # noqa: F401
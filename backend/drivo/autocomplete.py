@@ -0,0 +1,144 @@
+"""
+Place-name autocomplete over the local gazetteer.
+
+Every gazetteer key, and every word-suffix of it ("allama iqbal town" is
+also reachable as "iqbal town" and "town"), goes into a sorted array. A
+prefix is a contiguous range of that array found with two bisects. Short
+prefixes match large ranges, so the top results for every prefix of up to
+`precompute_chars` characters are computed when the index is built.
+Longer prefixes have small ranges and are ranked on the fly.
+
+Results are ranked by popularity (how many rides name the place in
+pickup_location or dropoff_location), then by gazetteer importance.
+"""
+import bisect
+import heapq
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Count
+
+from drivo.cache_backends import shared_cache
+from drivo.gazetteer import get_gazetteer, normalize_name
+
+logger = logging.getLogger(__name__)
+
+POPULARITY_CACHE_KEY = 'autocomplete_place_popularity'
+
+# Sorts after every character normalize_name() can produce
+_RANGE_END = '\uffff'
+
+
+def compute_popularity(gazetteer, max_locations=5000):
+    """
+    Count rides per gazetteer place. Ride location strings are grouped in
+    the database and the max_locations most frequent ones are matched to
+    the most specific place they mention. Returns {place_id: rides}.
+    """
+    from drivo.models import Ride
+
+    popularity = Counter()
+    matched = {}
+    for field in ('pickup_location', 'dropoff_location'):
+        rows = Ride.objects.exclude(**{field: ''}).values_list(field).annotate(
+            rides=Count('id')
+        ).order_by('-rides')[:max_locations]
+        for text, rides in rows:
+            if text not in matched:
+                matched[text] = gazetteer.find_in_text(text)
+            place = matched[text]
+            if place is not None:
+                popularity[place.id] += rides
+    return dict(popularity)
+
+
+class AutocompleteIndex:
+    """Sorted-array prefix index over a gazetteer, ranked by popularity."""
+
+    def __init__(self, gazetteer, popularity=None, max_results=10, precompute_chars=3):
+        self.gazetteer = gazetteer
+        self.popularity = popularity or {}
+        self.max_results = max_results
+        self.precompute_chars = precompute_chars
+        self._score = [
+            (self.popularity.get(place.id, 0), place.importance) for place in gazetteer.places
+        ]
+
+        entries = set()
+        for key, ids in gazetteer.index_items():
+            words = key.split(' ')
+            for start in range(len(words)):
+                suffix = ' '.join(words[start:])
+                entries.update((suffix, place_id) for place_id in ids)
+        entries = sorted(entries)
+        self._keys = [key for key, _ in entries]
+        self._ids = [place_id for _, place_id in entries]
+
+        candidates = {}
+        for key, place_id in entries:
+            for length in range(1, min(len(key), precompute_chars) + 1):
+                candidates.setdefault(key[:length], set()).add(place_id)
+        self._top = {prefix: self._rank(ids, max_results) for prefix, ids in candidates.items()}
+
+    def _rank(self, ids, limit):
+        return heapq.nlargest(limit, ids, key=lambda place_id: (self._score[place_id], -place_id))
+
+    def complete(self, text, limit=None):
+        """Up to limit (place, rides) pairs for places with a name or word starting with text."""
+        limit = self.max_results if limit is None else min(limit, self.max_results)
+        key = normalize_name(text)
+        if not key or limit <= 0:
+            return []
+        if len(key) <= self.precompute_chars:
+            ids = self._top.get(key, ())[:limit]
+        else:
+            start = bisect.bisect_left(self._keys, key)
+            stop = bisect.bisect_left(self._keys, key + _RANGE_END, start)
+            ids = self._rank(set(self._ids[start:stop]), limit)
+        return [(self.gazetteer.places[i], self.popularity.get(i, 0)) for i in ids]
+
+
+_index = None
+_index_built_at = 0.0
+_index_lock = threading.Lock()
+
+
+def get_autocomplete_index():
+    """
+    The process-wide autocomplete index, rebuilt every
+    AUTOCOMPLETE_REFRESH_SECONDS. Popularity counts are shared between
+    workers through the shared cache, so usually only one worker per
+    refresh window runs the aggregate queries.
+    """
+    global _index, _index_built_at
+    refresh = getattr(settings, 'AUTOCOMPLETE_REFRESH_SECONDS', 600)
+    if _index is not None and time.monotonic() - _index_built_at < refresh:
+        return _index
+    if not _index_lock.acquire(blocking=_index is None):
+        # Another thread is rebuilding; serve the current index meanwhile
+        return _index
+    try:
+        if _index is None or time.monotonic() - _index_built_at >= refresh:
+            gazetteer = get_gazetteer()
+            popularity = shared_cache().get(POPULARITY_CACHE_KEY)
+            if popularity is None:
+                try:
+                    popularity = compute_popularity(
+                        gazetteer, getattr(settings, 'AUTOCOMPLETE_POPULARITY_LOCATIONS', 5000)
+                    )
+                except Exception:
+                    logger.exception("Could not compute place popularity; ranking by importance")
+                    popularity = {}
+                else:
+                    shared_cache().set(POPULARITY_CACHE_KEY, popularity, timeout=refresh)
+            _index = AutocompleteIndex(
+                gazetteer, popularity,
+                max_results=getattr(settings, 'AUTOCOMPLETE_MAX_RESULTS', 10),
+            )
+            _index_built_at = time.monotonic()
+        return _index
+    finally:
+        _index_lock.release()
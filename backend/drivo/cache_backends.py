@@ -0,0 +1,426 @@
+"""
+Cache backends.
+
+SizedLRUCache is a per-process memory cache that accounts for bytes. Each
+key namespace is its own LRU with a byte budget, so a few large geocode
+payloads can only evict other geocode payloads, and memory per worker is
+bounded by the sum of the budgets:
+
+    'OPTIONS': {
+        'BUDGETS': {'geocode_': 32 * 2**20, 'fare_quote_': 4 * 2**20, 'other': 16 * 2**20},
+        'COMPRESS_MIN_BYTES': 1024,  # zlib-compress larger values; None stores plain pickles
+    }
+
+Values are stored pickled, as LocMemCache stores them; sizes count the
+stored bytes plus a fixed per-entry overhead. A value larger than its
+namespace budget is not stored.
+
+InstrumentedCache wraps any configured backend and counts, per key
+namespace, hits, misses, sets, deletes, bytes written and get/set latency,
+so cache sizes can be chosen from real hit ratios:
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'drivo.cache_backends.InstrumentedCache',
+            'LOCATION': 'unique-snowflake',
+            'OPTIONS': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'NAMESPACES': ['geocode_', 'fare_quote_', ...],  # optional
+            },
+        }
+    }
+
+Every other setting is passed to the wrapped backend unchanged. A key's
+namespace is the longest configured prefix it starts with, or 'other'.
+Counters are kept per process and shared by instances with the same
+LOCATION. Wrapped backends that track evictions
+expose them as evictions() -> {namespace: count}.
+
+Both are per process. Locks, rate limits and anything else that
+coordinates workers or processes use shared_cache(), the 'shared' alias
+(a database cache by default).
+"""
+import pickle
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+DEFAULT_NAMESPACES = (
+    'approx_count_', 'autocomplete_', 'dispatch_', 'driver_profile_id_', 'driver_status_counts_',
+    'etag_', 'fare_quote_', 'geocode_', 'location_trace_watermark_', 'ratelimit_', 'singleflight_',
+)
+OTHER_NAMESPACE = 'other'
+
+SHARED_CACHE_ALIAS = 'shared'
+
+_MISSING = object()
+
+DEFAULT_BUDGETS = {
+    'geocode_': 32 * 2 ** 20,
+    'fare_quote_': 4 * 2 ** 20,
+    OTHER_NAMESPACE: 16 * 2 ** 20,
+}
+
+# Django creates a backend instance per thread; counters and stores are
+# shared by LOCATION, as LocMemCache shares its storage
+_shared_stats = {}
+_shared_stores = {}
+_shared_lock = threading.Lock()
+
+
+class NamespaceResolver:
+    """Maps a cache key to the longest configured prefix it starts with, named without the trailing separator."""
+
+    def __init__(self, prefixes=DEFAULT_NAMESPACES):
+        self.prefixes = sorted(prefixes, key=len, reverse=True)
+        self._names = {prefix: prefix.rstrip('_:') or prefix for prefix in self.prefixes}
+
+    def __call__(self, key):
+        key = str(key)
+        for prefix in self.prefixes:
+            if key.startswith(prefix):
+                return self._names[prefix]
+        return OTHER_NAMESPACE
+
+    def names(self):
+        return list(self._names.values()) + [OTHER_NAMESPACE]
+
+
+def value_size(value):
+    """Approximate stored size of a value: its pickled length, as most backends pickle values."""
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return 0
+
+
+class InstrumentedCache(BaseCache):
+    def __init__(self, location, params):
+        params = dict(params)
+        options = dict(params.get('OPTIONS') or {})
+        backend = options.pop('BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+        self.namespace = NamespaceResolver(options.pop('NAMESPACES', DEFAULT_NAMESPACES))
+        self.measure_bytes = options.pop('MEASURE_BYTES', True)
+        params['OPTIONS'] = options
+        super().__init__(params)
+        self.backend = import_string(backend)(location, params)
+        with _shared_lock:
+            self._stats, self._lock = _shared_stats.setdefault(location, (defaultdict(Counter), threading.Lock()))
+
+    def _record(self, key, **counts):
+        namespace = self.namespace(key)
+        with self._lock:
+            self._stats[namespace].update(counts)
+
+    def _record_latency(self, op, keys, elapsed_us):
+        """Split one call's latency evenly over its keys' namespaces."""
+        if not keys:
+            return
+        share = elapsed_us / len(keys)
+        by_namespace = Counter(self.namespace(key) for key in keys)
+        with self._lock:
+            for namespace, count in by_namespace.items():
+                stats = self._stats[namespace]
+                stats[f'{op}_calls'] += count
+                stats[f'{op}_us'] += share * count
+                stats[f'{op}_max_us'] = max(stats[f'{op}_max_us'], share)
+
+    def _record_set(self, key, value):
+        self._record(key, sets=1, bytes_written=value_size(value) if self.measure_bytes else 0)
+
+    # Reads
+
+    def get(self, key, default=None, version=None):
+        started = time.perf_counter()
+        value = self.backend.get(key, _MISSING, version=version)
+        self._record_latency('get', [key], (time.perf_counter() - started) * 1e6)
+        if value is _MISSING:
+            self._record(key, misses=1)
+            return default
+        self._record(key, hits=1)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        started = time.perf_counter()
+        found = self.backend.get_many(keys, version=version)
+        self._record_latency('get', keys, (time.perf_counter() - started) * 1e6)
+        for key in keys:
+            self._record(key, **({'hits': 1} if key in found else {'misses': 1}))
+        return found
+
+    def has_key(self, key, version=None):
+        return self.backend.has_key(key, version=version)
+
+    # Writes
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        started = time.perf_counter()
+        self.backend.set(key, value, timeout=timeout, version=version)
+        self._record_latency('set', [key], (time.perf_counter() - started) * 1e6)
+        self._record_set(key, value)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        started = time.perf_counter()
+        added = self.backend.add(key, value, timeout=timeout, version=version)
+        self._record_latency('set', [key], (time.perf_counter() - started) * 1e6)
+        if added:
+            self._record_set(key, value)
+        else:
+            self._record(key, add_conflicts=1)
+        return added
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        started = time.perf_counter()
+        failed = self.backend.set_many(data, timeout=timeout, version=version)
+        self._record_latency('set', list(data), (time.perf_counter() - started) * 1e6)
+        failed_keys = set(failed or ())
+        for key, value in data.items():
+            if key not in failed_keys:
+                self._record_set(key, value)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.backend.touch(key, timeout=timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.backend.incr(key, delta, version=version)
+        self._record(key, sets=1)
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        value = self.backend.decr(key, delta, version=version)
+        self._record(key, sets=1)
+        return value
+
+    def delete(self, key, version=None):
+        deleted = self.backend.delete(key, version=version)
+        self._record(key, deletes=1)
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.backend.delete_many(keys, version=version)
+        for key in keys:
+            self._record(key, deletes=1)
+
+    def clear(self):
+        self.backend.clear()
+
+    def close(self, **kwargs):
+        self.backend.close(**kwargs)
+
+    # Reporting
+
+    def stats(self):
+        """Per-namespace counters, hit ratio and mean/max latency in microseconds."""
+        with self._lock:
+            raw = {namespace: Counter(counts) for namespace, counts in self._stats.items()}
+        evictions = getattr(self.backend, 'evictions', None)
+        if callable(evictions):
+            for namespace, count in evictions().items():
+                raw.setdefault(namespace, Counter())['evictions'] = count
+        usage = self.backend.usage() if callable(getattr(self.backend, 'usage', None)) else {}
+        for namespace in usage:
+            raw.setdefault(namespace, Counter())
+
+        namespaces = {}
+        for namespace, counts in sorted(raw.items()):
+            lookups = counts['hits'] + counts['misses']
+            stats = {
+                'hits': counts['hits'],
+                'misses': counts['misses'],
+                'hit_ratio': round(counts['hits'] / lookups, 4) if lookups else None,
+                'sets': counts['sets'],
+                'add_conflicts': counts['add_conflicts'],
+                'deletes': counts['deletes'],
+                'evictions': counts['evictions'] if callable(evictions) else None,
+                'bytes_written': counts['bytes_written'],
+            }
+            for op in ('get', 'set'):
+                calls = counts[f'{op}_calls']
+                stats[f'{op}_latency_us'] = {
+                    'calls': calls,
+                    'total': round(counts[f'{op}_us'], 1),
+                    'mean': round(counts[f'{op}_us'] / calls, 1) if calls else None,
+                    'max': round(counts[f'{op}_max_us'], 1) if calls else None,
+                }
+            if namespace in usage:
+                stats.update(usage[namespace])
+            namespaces[namespace] = stats
+        return namespaces
+
+
+class _Store:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # namespace -> OrderedDict(key -> (blob, compressed, expires_at, size)), oldest first
+        self.entries = defaultdict(OrderedDict)
+        self.bytes = Counter()
+        self.evictions = Counter()
+        self.rejected = Counter()
+
+
+class SizedLRUCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+    # Rough cost of the key string, entry tuple and dict slot
+    ENTRY_OVERHEAD = 200
+
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get('OPTIONS') or {}
+        budgets = dict(options.get('BUDGETS') or DEFAULT_BUDGETS)
+        other_budget = budgets.pop(OTHER_NAMESPACE, DEFAULT_BUDGETS[OTHER_NAMESPACE])
+        self.namespace = NamespaceResolver(budgets)
+        self.budgets = {self.namespace(prefix): budget for prefix, budget in budgets.items()}
+        self.budgets[OTHER_NAMESPACE] = other_budget
+        self.compress_min_bytes = options.get('COMPRESS_MIN_BYTES')
+        self.compress_level = options.get('COMPRESS_LEVEL', 1)
+        with _shared_lock:
+            self._store = _shared_stores.setdefault(name, _Store())
+
+    def _dumps(self, value):
+        blob = pickle.dumps(value, self.pickle_protocol)
+        if self.compress_min_bytes is not None and len(blob) >= self.compress_min_bytes:
+            compressed = zlib.compress(blob, self.compress_level)
+            if len(compressed) < len(blob):
+                return compressed, True
+        return blob, False
+
+    @staticmethod
+    def _loads(blob, compressed):
+        return pickle.loads(zlib.decompress(blob) if compressed else blob)
+
+    def _live_entry(self, namespace, key):
+        """The unexpired entry for key, or None. Call with the store lock held."""
+        entry = self._store.entries[namespace].get(key)
+        if entry is not None and entry[2] is not None and entry[2] <= time.time():
+            self._remove(namespace, key)
+            return None
+        return entry
+
+    def _remove(self, namespace, key):
+        entry = self._store.entries[namespace].pop(key, None)
+        if entry is not None:
+            self._store.bytes[namespace] -= entry[3]
+        return entry is not None
+
+    def _set(self, namespace, key, blob, compressed, expires_at):
+        """Store an entry and evict least recently used ones over budget. Call with the store lock held."""
+        store = self._store
+        entries = store.entries[namespace]
+        self._remove(namespace, key)
+        size = len(blob) + len(key) + self.ENTRY_OVERHEAD
+        budget = self.budgets[namespace]
+        if size > budget:
+            store.rejected[namespace] += 1
+            return False
+        while entries and store.bytes[namespace] + size > budget:
+            _, evicted = entries.popitem(last=False)
+            store.bytes[namespace] -= evicted[3]
+            store.evictions[namespace] += 1
+        entries[key] = (blob, compressed, expires_at, size)
+        store.bytes[namespace] += size
+        return True
+
+    def get(self, key, default=None, version=None):
+        namespace = self.namespace(key)
+        key = self.make_and_validate_key(key, version=version)
+        with self._store.lock:
+            entry = self._live_entry(namespace, key)
+            if entry is None:
+                return default
+            self._store.entries[namespace].move_to_end(key)
+        return self._loads(entry[0], entry[1])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        namespace = self.namespace(key)
+        key = self.make_and_validate_key(key, version=version)
+        blob, compressed = self._dumps(value)
+        with self._store.lock:
+            self._set(namespace, key, blob, compressed, self.get_backend_timeout(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        namespace = self.namespace(key)
+        key = self.make_and_validate_key(key, version=version)
+        blob, compressed = self._dumps(value)
+        with self._store.lock:
+            if self._live_entry(namespace, key) is not None:
+                return False
+            return self._set(namespace, key, blob, compressed, self.get_backend_timeout(timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        namespace = self.namespace(key)
+        key = self.make_and_validate_key(key, version=version)
+        with self._store.lock:
+            entry = self._live_entry(namespace, key)
+            if entry is None:
+                return False
+            self._store.entries[namespace][key] = (entry[0], entry[1], self.get_backend_timeout(timeout), entry[3])
+            return True
+
+    def incr(self, key, delta=1, version=None):
+        namespace = self.namespace(key)
+        key = self.make_and_validate_key(key, version=version)
+        with self._store.lock:
+            entry = self._live_entry(namespace, key)
+            if entry is None:
+                raise ValueError("Key '%s' not found" % key)
+            new_value = self._loads(entry[0], entry[1]) + delta
+            blob, compressed = self._dumps(new_value)
+            self._set(namespace, key, blob, compressed, entry[2])
+        return new_value
+
+    def has_key(self, key, version=None):
+        namespace = self.namespace(key)
+        key = self.make_and_validate_key(key, version=version)
+        with self._store.lock:
+            return self._live_entry(namespace, key) is not None
+
+    def delete(self, key, version=None):
+        namespace = self.namespace(key)
+        key = self.make_and_validate_key(key, version=version)
+        with self._store.lock:
+            return self._remove(namespace, key)
+
+    def clear(self):
+        with self._store.lock:
+            self._store.entries.clear()
+            self._store.bytes.clear()
+
+    def evictions(self):
+        with self._store.lock:
+            return dict(self._store.evictions)
+
+    def usage(self):
+        """Per-namespace stored bytes, entries, budget and values rejected as larger than the budget."""
+        with self._store.lock:
+            return {
+                namespace: {
+                    'stored_bytes': self._store.bytes[namespace],
+                    'entries': len(self._store.entries.get(namespace, ())),
+                    'budget_bytes': budget,
+                    'rejected': self._store.rejected[namespace],
+                }
+                for namespace, budget in self.budgets.items()
+            }
+
+
+def cache_stats(alias='default'):
+    """InstrumentedCache.stats() for a configured cache, or None if it is not instrumented."""
+    backend = caches[alias]
+    return backend.stats() if isinstance(backend, InstrumentedCache) else None
+
+
+def shared_cache():
+    """
+    The cache every worker and process sees. Without a 'shared' alias this
+    is the default cache, which only coordinates the threads of a process.
+    """
+    return caches[SHARED_CACHE_ALIAS if SHARED_CACHE_ALIAS in settings.CACHES else DEFAULT_CACHE_ALIAS]
@@ -0,0 +1,107 @@
+"""
+Conditional GET (ETag / If-None-Match) for endpoints the app polls.
+
+A response's ETag hashes the state of the rows it is built from with the
+request path and Accept header. The state is read with one values_list()
+query, so a poll whose If-None-Match still matches gets 304 Not Modified
+without loading model instances or running the serializer.
+
+Because the state comes from the rows themselves, every write is seen by
+every worker: saves, QuerySet.update(), the live location flush,
+dispatch and the backfill commands alike. The driver feed hashes the
+profile columns of every matching driver, streamed in id order; position
+writes carry the ping time rather than the write time, so no single
+column (such as the newest last_location_update) can stand in for them.
+The feed nests each driver's user, which has no version column; edits to
+users are tracked by a token in the shared cache
+(drivo.cache_backends.shared_cache) that user saves drop once they commit.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.cache import get_conditional_response, patch_vary_headers
+
+from drivo.cache_backends import shared_cache
+from drivo.models import ClientProfile, DriverProfile, Ride, User
+
+USERS_VERSION_KEY = 'etag_version_users'
+
+# Columns no representation exposes; last_login changes on every sign-in
+IGNORED_FIELDS = ('password', 'last_login')
+
+
+def state_fields(model, prefix=''):
+    """values_list() paths of model's columns, under prefix (e.g. 'client__')."""
+    return [prefix + field.attname for field in model._meta.concrete_fields if field.name not in IGNORED_FIELDS]
+
+
+def row_state(queryset, fields):
+    """The values of fields in the first row of queryset, or None if it has none."""
+    return queryset.values_list(*fields).first()
+
+
+def user_state(user):
+    return tuple(getattr(user, field) for field in state_fields(User))
+
+
+def ride_state(pk):
+    """A ride's columns with its client's and driver's profile and user columns, in one query."""
+    return row_state(Ride.objects.filter(pk=pk), [
+        *state_fields(Ride),
+        *state_fields(ClientProfile, 'client__'), *state_fields(User, 'client__user__'),
+        *state_fields(DriverProfile, 'driver__'), *state_fields(User, 'driver__user__'),
+    ])
+
+
+def feed_state(queryset, chunk_size=2000):
+    """Digest of the profile columns of every row in a DriverProfile queryset, and the users version."""
+    digest = hashlib.sha1()
+    rows = queryset.order_by('id').values_list(*state_fields(DriverProfile))
+    for row in rows.iterator(chunk_size=chunk_size):
+        digest.update(repr(row).encode())
+    return digest.hexdigest(), users_version()
+
+
+def users_version():
+    """Current token for user rows, minting one if there is none."""
+    cache = shared_cache()
+    token = cache.get(USERS_VERSION_KEY)
+    if token is None:
+        token = uuid.uuid4().hex
+        # Another worker may have minted it first
+        if not cache.add(USERS_VERSION_KEY, token, getattr(settings, 'ETAG_VERSION_SECONDS', 600)):
+            token = cache.get(USERS_VERSION_KEY, token)
+    return token
+
+
+def etag_for(request, *state):
+    """Quoted ETag for a response to request built from state."""
+    parts = [request.get_full_path(), request.META.get('HTTP_ACCEPT', ''), repr(state)]
+    return '"%s"' % hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+
+def not_modified(request, etag):
+    """A 304 response if the request's If-None-Match matches etag, else None."""
+    if etag is None:
+        return None
+    response = get_conditional_response(request, etag=etag)
+    return set_etag(response, etag) if response is not None else None
+
+
+def set_etag(response, etag):
+    if etag is not None and response.status_code in (200, 304):
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept', 'Authorization'))
+    return response
+
+
+@receiver([post_save, post_delete], sender=User)
+def _user_changed(sender, instance, update_fields=None, **kwargs):
+    # Sign-ins only touch last_login, which no representation includes
+    if update_fields is not None and set(update_fields) <= set(IGNORED_FIELDS):
+        return
+    transaction.on_commit(lambda: shared_cache().delete(USERS_VERSION_KEY))
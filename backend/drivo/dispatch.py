@@ -0,0 +1,311 @@
+"""
+Batch ride dispatch.
+
+Each tick collects the open rides (status 'requested', no driver) and the
+idle available drivers, builds a pickup-distance cost matrix from live
+positions and solves the assignment for the whole batch at once, so a ride
+can be given a slightly farther driver when that frees the nearest one for
+a ride that has no other option.
+
+Rides are sorted spatially and solved in blocks; within a block each ride
+only considers its nearest idle drivers, which keeps the cost matrix small
+enough to solve every few seconds with thousands of open rides. scipy's
+linear_sum_assignment (Hungarian / Jonker-Volgenant) is used when scipy is
+installed; otherwise a greedy assignment is refined with local improvement
+passes.
+"""
+import datetime
+import logging
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from drivo.bulk import bulk_update_columns
+from drivo.cache_backends import shared_cache
+from drivo.geo import AVAILABLE_DRIVER_STATUSES, driver_index
+from drivo.matrix import nearest_k
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # scipy is optional
+    linear_sum_assignment = None
+
+logger = logging.getLogger(__name__)
+
+# Finite stand-in for "not allowed" so cost arithmetic never produces NaN
+UNREACHABLE = 1e9
+IMPROVEMENT_EPSILON = 1e-9
+
+DISPATCH_LOCK_KEY = 'dispatch_tick_lock'
+DISPATCH_LAST_TICK_KEY = 'dispatch_last_tick'
+DISPATCH_RECENT_TICKS_KEY = 'dispatch_recent_ticks'
+RECENT_TICKS_KEPT = 50
+
+
+def greedy_assignment(cost, candidates_per_row=8):
+    """
+    Assign rows to columns cheapest edge first, looking only at each row's
+    `candidates_per_row` cheapest columns, then give leftover rows any free
+    column. Returns an array mapping row -> column (-1 if unassigned).
+    """
+    n_rows, n_cols = cost.shape
+    row_to_col = np.full(n_rows, -1, dtype=np.int64)
+    if n_rows == 0 or n_cols == 0:
+        return row_to_col
+    k = min(candidates_per_row, n_cols)
+    candidates = np.argpartition(cost, k - 1, axis=1)[:, :k]
+    rows = np.repeat(np.arange(n_rows), k)
+    cols = candidates.ravel()
+    values = cost[rows, cols]
+    allowed = values < UNREACHABLE
+    order = np.argsort(values[allowed], kind='stable')
+    col_used = np.zeros(n_cols, dtype=bool)
+    for row, col in zip(rows[allowed][order].tolist(), cols[allowed][order].tolist()):
+        if row_to_col[row] == -1 and not col_used[col]:
+            row_to_col[row] = col
+            col_used[col] = True
+
+    for row in np.flatnonzero(row_to_col == -1):
+        free_cost = np.where(col_used, UNREACHABLE, cost[row])
+        col = int(np.argmin(free_cost))
+        if free_cost[col] < UNREACHABLE:
+            row_to_col[row] = col
+            col_used[col] = True
+    return row_to_col
+
+
+def improve_assignment(cost, row_to_col, max_passes=3):
+    """
+    Local search on an assignment: move a row to a cheaper free column, or
+    swap columns between two rows when that lowers their combined cost.
+    Modifies and returns row_to_col.
+    """
+    n_cols = cost.shape[1]
+    for _ in range(max_passes):
+        improved = False
+        assigned = np.flatnonzero(row_to_col >= 0)
+        col_used = np.zeros(n_cols, dtype=bool)
+        col_used[row_to_col[assigned]] = True
+        free_cols = np.flatnonzero(~col_used)
+
+        if free_cols.size:
+            for row in assigned:
+                current = cost[row, row_to_col[row]]
+                options = cost[row, free_cols]
+                best = int(np.argmin(options))
+                if options[best] < current - IMPROVEMENT_EPSILON:
+                    freed = row_to_col[row]
+                    row_to_col[row] = free_cols[best]
+                    free_cols[best] = freed
+                    improved = True
+
+        for row in assigned:
+            col = row_to_col[row]
+            other_cols = row_to_col[assigned]
+            gain = (cost[row, col] + cost[assigned, other_cols]
+                    - cost[row, other_cols] - cost[assigned, col])
+            best = int(np.argmax(gain))
+            if gain[best] > IMPROVEMENT_EPSILON:
+                other = assigned[best]
+                row_to_col[row], row_to_col[other] = row_to_col[other], row_to_col[row]
+                improved = True
+        if not improved:
+            break
+    return row_to_col
+
+
+def solve_assignment(cost, solver='auto'):
+    """
+    Minimum-cost assignment of rows (rides) to columns (drivers). Entries
+    >= UNREACHABLE are never assigned. Returns (rows, cols, solver_name).
+    """
+    if cost.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), 'none'
+    if solver in ('auto', 'hungarian') and linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(cost)
+        name = 'hungarian'
+    else:
+        row_to_col = improve_assignment(cost, greedy_assignment(cost))
+        rows = np.flatnonzero(row_to_col >= 0)
+        cols = row_to_col[rows]
+        name = 'greedy'
+    keep = cost[rows, cols] < UNREACHABLE
+    return rows[keep], cols[keep], name
+
+
+def _spread_bits(values):
+    values = values & 0xFFFF
+    values = (values | (values << 8)) & 0x00FF00FF
+    values = (values | (values << 4)) & 0x0F0F0F0F
+    values = (values | (values << 2)) & 0x33333333
+    return (values | (values << 1)) & 0x55555555
+
+
+def spatial_order(lats, lons, cell_deg=0.01):
+    """Indices ordering points along a Z-order curve over ~1 km cells, so consecutive runs are compact areas."""
+    rows = np.floor((np.asarray(lats) + 90.0) / cell_deg).astype(np.int64)
+    cols = np.floor((np.asarray(lons) + 180.0) / cell_deg).astype(np.int64)
+    return np.argsort(_spread_bits(rows) | (_spread_bits(cols) << 1), kind='stable')
+
+
+def assign_rides(ride_lats, ride_lons, driver_lats, driver_lons, max_km,
+                 candidates_per_ride=8, block_size=500, solver='auto'):
+    """
+    Assign rides to drivers minimising total pickup distance.
+
+    Rides are sorted by position and solved block_size at a time against the
+    drivers still free; each block is an exact (or greedy+improved)
+    assignment over every ride's candidates_per_ride nearest drivers.
+    Returns (ride_indices, driver_indices, distances_km, solver_name).
+    """
+    ride_lats = np.asarray(ride_lats, dtype=np.float64)
+    ride_lons = np.asarray(ride_lons, dtype=np.float64)
+    driver_lats = np.asarray(driver_lats, dtype=np.float64)
+    driver_lons = np.asarray(driver_lons, dtype=np.float64)
+    free = np.ones(len(driver_lats), dtype=bool)
+    order = spatial_order(ride_lats, ride_lons)
+    ride_out, driver_out, dist_out = [], [], []
+    solver_name = 'none'
+
+    for start in range(0, len(order), block_size):
+        if not free.any():
+            break
+        block = order[start:start + block_size]
+        free_idx = np.flatnonzero(free)
+        cand_cols, cand_dist = nearest_k(
+            ride_lats[block], ride_lons[block],
+            driver_lats[free_idx], driver_lons[free_idx],
+            candidates_per_ride, max_km,
+        )
+        # Compress to the drivers that are a candidate for some ride in the block
+        used = np.unique(cand_cols[cand_cols >= 0])
+        if used.size == 0:
+            continue
+        cost = np.full((len(block), used.size), UNREACHABLE)
+        rows, slots = np.nonzero(cand_cols >= 0)
+        cost[rows, np.searchsorted(used, cand_cols[rows, slots])] = cand_dist[rows, slots]
+
+        rows, cols, solver_name = solve_assignment(cost, solver)
+        drivers = free_idx[used[cols]]
+        free[drivers] = False
+        ride_out.append(block[rows])
+        driver_out.append(drivers)
+        dist_out.append(cost[rows, cols])
+
+    if not ride_out:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0), solver_name
+    return np.concatenate(ride_out), np.concatenate(driver_out), np.concatenate(dist_out), solver_name
+
+
+class DispatchEngine:
+    """
+    Runs dispatch ticks. Each tick returns (and logs and caches) a metrics
+    dict with counts, total pickup distance and per-phase timings in ms.
+    """
+
+    def __init__(self, max_pickup_km=None, max_rides=None, schedule_horizon_minutes=None, solver=None):
+        self.max_pickup_km = max_pickup_km or getattr(settings, 'DISPATCH_MAX_PICKUP_KM', 10)
+        self.max_rides = max_rides or getattr(settings, 'DISPATCH_MAX_RIDES_PER_TICK', 5000)
+        self.candidates_per_ride = getattr(settings, 'DISPATCH_CANDIDATES_PER_RIDE', 8)
+        self.block_size = getattr(settings, 'DISPATCH_BLOCK_SIZE', 500)
+        self.schedule_horizon = schedule_horizon_minutes or getattr(
+            settings, 'DISPATCH_SCHEDULE_HORIZON_MINUTES', 15
+        )
+        self.solver = solver or getattr(settings, 'DISPATCH_SOLVER', 'auto')
+
+    def _idle_drivers(self):
+        from drivo.models import Ride
+
+        driver_index.ensure_fresh()
+        keys, lats, lons = driver_index.snapshot(statuses=AVAILABLE_DRIVER_STATUSES)
+        busy = set(Ride.objects.filter(
+            status='accepted', driver__isnull=False
+        ).values_list('driver_id', flat=True))
+        idle = [i for i, key in enumerate(keys) if key not in busy]
+        return (
+            [keys[i] for i in idle],
+            np.array([lats[i] for i in idle], dtype=np.float64),
+            np.array([lons[i] for i in idle], dtype=np.float64),
+        )
+
+    def tick(self):
+        from drivo.models import Ride
+
+        started = time.perf_counter()
+        metrics = {
+            'started_at': timezone.now().isoformat(),
+            'rides': 0, 'drivers': 0, 'assigned': 0, 'unassigned': 0,
+            'total_pickup_km': 0.0, 'mean_pickup_km': None, 'solver': None,
+        }
+        timings = {}
+        # One dispatcher at a time across workers and processes; the lock
+        # expires on its own
+        cache = shared_cache()
+        if not cache.add(DISPATCH_LOCK_KEY, True, timeout=60):
+            metrics['skipped'] = 'another dispatcher is running'
+            return metrics
+
+        try:
+            with transaction.atomic():
+                horizon = timezone.now() + datetime.timedelta(minutes=self.schedule_horizon)
+                rides = list(
+                    Ride.objects.select_for_update(skip_locked=True).filter(
+                        Q(scheduled_datetime__isnull=True) | Q(scheduled_datetime__lte=horizon),
+                        status='requested',
+                        driver__isnull=True,
+                        pickup_latitude__isnull=False,
+                        pickup_longitude__isnull=False,
+                    ).order_by('created_at').values_list(
+                        'id', 'pickup_latitude', 'pickup_longitude'
+                    )[:self.max_rides]
+                )
+                driver_ids, driver_lats, driver_lons = self._idle_drivers()
+                metrics['rides'] = len(rides)
+                metrics['drivers'] = len(driver_ids)
+                timings['collect_ms'] = (time.perf_counter() - started) * 1000
+
+                phase = time.perf_counter()
+                ride_rows, driver_cols, pickup_km, metrics['solver'] = assign_rides(
+                    [float(r[1]) for r in rides], [float(r[2]) for r in rides],
+                    driver_lats, driver_lons, self.max_pickup_km,
+                    candidates_per_ride=self.candidates_per_ride,
+                    block_size=self.block_size, solver=self.solver,
+                )
+                timings['solve_ms'] = (time.perf_counter() - phase) * 1000
+
+                phase = time.perf_counter()
+                assignments = [
+                    (rides[row][0], driver_ids[col], 'accepted')
+                    for row, col in zip(ride_rows.tolist(), driver_cols.tolist())
+                ]
+                if assignments:
+                    bulk_update_columns(Ride, ('driver', 'status'), assignments)
+                timings['persist_ms'] = (time.perf_counter() - phase) * 1000
+        finally:
+            cache.delete(DISPATCH_LOCK_KEY)
+
+        metrics['assigned'] = len(ride_rows)
+        metrics['unassigned'] = metrics['rides'] - len(ride_rows)
+        metrics['total_pickup_km'] = round(float(pickup_km.sum()), 3)
+        if len(ride_rows):
+            metrics['mean_pickup_km'] = round(float(pickup_km.mean()), 3)
+        timings['total_ms'] = (time.perf_counter() - started) * 1000
+        metrics['timings'] = {name: round(value, 2) for name, value in timings.items()}
+        self._publish(metrics)
+        return metrics
+
+    def _publish(self, metrics):
+        logger.info(
+            "dispatch tick: %(assigned)d/%(rides)d rides assigned to %(drivers)d drivers",
+            metrics, extra={'dispatch_metrics': metrics}
+        )
+        # In the shared cache so web workers can read run_dispatch's ticks
+        cache = shared_cache()
+        recent = cache.get(DISPATCH_RECENT_TICKS_KEY) or []
+        recent = (recent + [metrics])[-RECENT_TICKS_KEPT:]
+        cache.set_many({DISPATCH_LAST_TICK_KEY: metrics, DISPATCH_RECENT_TICKS_KEY: recent}, timeout=3600)
@@ -0,0 +1,209 @@
+"""
+Ride fare estimation.
+
+Fares are priced from the straight-line pickup -> dropoff distance scaled
+by FARE_ROAD_DISTANCE_FACTOR, a per-vehicle tariff (base, per_km,
+minimum), a fuel multiplier and a round-trip multiplier. All tables come
+from settings.
+
+compute_fares() prices whole arrays of rides in one vectorized pass, so
+re-quotes and backfills over thousands of rides avoid a Python loop of
+Decimal arithmetic; estimate_fare() is the single-ride convenience.
+"""
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from drivo.geo import haversine_array
+
+DEFAULT_TARIFFS = {
+    'bike': {'base': 60, 'per_km': 25, 'minimum': 100},
+    'rickshaw': {'base': 80, 'per_km': 40, 'minimum': 150},
+    'car': {'base': 150, 'per_km': 60, 'minimum': 250},
+    'suv': {'base': 200, 'per_km': 80, 'minimum': 350},
+    'van': {'base': 250, 'per_km': 90, 'minimum': 400},
+    'truck': {'base': 500, 'per_km': 150, 'minimum': 800},
+}
+DEFAULT_FUEL_MULTIPLIERS = {
+    'petrol': 1.0,
+    'diesel': 0.95,
+    'cng': 0.85,
+    'electric': 0.8,
+    'hybrid': 0.9,
+}
+
+FARE_QUANTUM = Decimal('0.01')
+
+
+def _normalize(values, size):
+    if isinstance(values, str) or values is None:
+        values = [values] * size
+    return np.array([str(value or '').strip().lower() for value in values])
+
+
+def _lookup(keys, table, default):
+    """Map an array of string keys through table, vectorized over the distinct keys."""
+    distinct, inverse = np.unique(keys, return_inverse=True)
+    return np.array([table.get(key, default) for key in distinct], dtype=np.float64)[inverse]
+
+
+def get_tariffs():
+    return getattr(settings, 'FARE_TARIFFS', DEFAULT_TARIFFS)
+
+
+def compute_fares(pickup_lats, pickup_lons, dropoff_lats, dropoff_lons,
+                  vehicle_types='car', fuel_types='petrol', trip_types='one-way'):
+    """
+    Price many rides at once.
+
+    Coordinates are equal-length sequences (None/NaN for missing values);
+    vehicle_types, fuel_types and trip_types are sequences of the same
+    length or a single value for every ride. Unknown vehicle types use the
+    FARE_DEFAULT_VEHICLE tariff. Returns (fares, distances_km) as float
+    arrays; rides with missing coordinates get NaN for both.
+    """
+    pickup_lats = np.asarray(pickup_lats, dtype=np.float64)
+    size = pickup_lats.shape[0]
+    distance_km = haversine_array(
+        pickup_lats,
+        np.asarray(pickup_lons, dtype=np.float64),
+        np.asarray(dropoff_lats, dtype=np.float64),
+        np.asarray(dropoff_lons, dtype=np.float64),
+    ) * getattr(settings, 'FARE_ROAD_DISTANCE_FACTOR', 1.3)
+
+    tariffs = get_tariffs()
+    default = tariffs[getattr(settings, 'FARE_DEFAULT_VEHICLE', 'car')]
+    vehicles = _normalize(vehicle_types, size)
+    base = _lookup(vehicles, {k: t['base'] for k, t in tariffs.items()}, default['base'])
+    per_km = _lookup(vehicles, {k: t['per_km'] for k, t in tariffs.items()}, default['per_km'])
+    minimum = _lookup(vehicles, {k: t['minimum'] for k, t in tariffs.items()}, default['minimum'])
+
+    fuel = _lookup(
+        _normalize(fuel_types, size),
+        getattr(settings, 'FARE_FUEL_MULTIPLIERS', DEFAULT_FUEL_MULTIPLIERS),
+        1.0,
+    )
+    trip = np.where(
+        _normalize(trip_types, size) == 'round-trip',
+        getattr(settings, 'FARE_ROUND_TRIP_MULTIPLIER', 1.8),
+        1.0,
+    )
+
+    fares = np.maximum((base + per_km * distance_km) * fuel * trip, minimum)
+    return np.round(fares, 2), distance_km
+
+
+def to_decimal(value):
+    """Convert a computed fare to a Decimal for Ride.fare, or None if it is NaN."""
+    if value is None or np.isnan(value):
+        return None
+    return Decimal(repr(float(value))).quantize(FARE_QUANTUM)
+
+
+def estimate_fare(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon,
+                  vehicle_type='car', fuel_type='petrol', trip_type='one-way'):
+    """Fare for a single ride as a Decimal, or None if any coordinate is missing."""
+    coords = [pickup_lat, pickup_lon, dropoff_lat, dropoff_lon]
+    if any(value is None for value in coords):
+        return None
+    fares, _ = compute_fares(
+        *[[float(value)] for value in coords],
+        vehicle_types=[vehicle_type], fuel_types=[fuel_type], trip_types=[trip_type],
+    )
+    return to_decimal(fares[0])
+
+
+def _coordinate_column(rows, index):
+    return [np.nan if row[index] is None else float(row[index]) for row in rows]
+
+
+def price_ride_rows(rows):
+    """
+    Price rows of (pickup_lat, pickup_lon, dropoff_lat, dropoff_lon,
+    vehicle_type, fuel_type, trip_type) and return a list of Decimal fares
+    (None where coordinates are missing).
+    """
+    if not rows:
+        return []
+    fares, _ = compute_fares(
+        _coordinate_column(rows, 0), _coordinate_column(rows, 1),
+        _coordinate_column(rows, 2), _coordinate_column(rows, 3),
+        vehicle_types=[row[4] for row in rows],
+        fuel_types=[row[5] for row in rows],
+        trip_types=[row[6] for row in rows],
+    )
+    return [to_decimal(fare) for fare in fares]
+
+
+QUOTE_TRIP_TYPES = ('one-way', 'round-trip')
+
+
+def quote_options():
+    """The (vehicle_types, fuel_types, trip_types) axes of a quote matrix."""
+    fuels = getattr(settings, 'FARE_FUEL_MULTIPLIERS', DEFAULT_FUEL_MULTIPLIERS)
+    return tuple(get_tariffs()), tuple(fuels), QUOTE_TRIP_TYPES
+
+
+def quote_matrix(trips):
+    """
+    Price every vehicle x fuel x trip type combination for each
+    (pickup_lat, pickup_lon, dropoff_lat, dropoff_lon) in trips, in a
+    single compute_fares() call. Returns one
+    {'distance_km': ..., 'fares': {vehicle: {fuel: {trip_type: fare}}}}
+    per trip.
+    """
+    if not trips:
+        return []
+    vehicles, fuels, trip_types = quote_options()
+    combo_shape = (len(vehicles), len(fuels), len(trip_types))
+    combos = int(np.prod(combo_shape))
+    v_idx, f_idx, t_idx = (axis.ravel() for axis in np.indices(combo_shape))
+
+    coords = np.repeat(np.asarray(trips, dtype=np.float64), combos, axis=0)
+    fares, distance_km = compute_fares(
+        coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3],
+        vehicle_types=np.tile(np.array(vehicles)[v_idx], len(trips)),
+        fuel_types=np.tile(np.array(fuels)[f_idx], len(trips)),
+        trip_types=np.tile(np.array(trip_types)[t_idx], len(trips)),
+    )
+    fares = fares.reshape((len(trips),) + combo_shape).tolist()
+    distance_km = distance_km[::combos]
+
+    quotes = []
+    for trip_index, trip_fares in enumerate(fares):
+        quotes.append({
+            'distance_km': round(float(distance_km[trip_index]), 3),
+            'fares': {
+                vehicle: {
+                    fuel: dict(zip(trip_types, trip_fares[v][f]))
+                    for f, fuel in enumerate(fuels)
+                }
+                for v, vehicle in enumerate(vehicles)
+            },
+        })
+    return quotes
+
+
+def _quote_cache_key(trip):
+    return 'fare_quote_' + '_'.join(repr(value) for value in trip)
+
+
+def cached_quotes(trips, places=4, timeout=60):
+    """
+    quote_matrix() with a short-lived cache. Coordinates are rounded to
+    `places` decimals (4 places is ~11 m) before pricing, and that rounded
+    pair is the cache key, so repeated quotes for the same booking hit the
+    cache. Returns (quotes, cache_hits).
+    """
+    rounded = [tuple(round(float(value), places) for value in trip) for trip in trips]
+    keys = [_quote_cache_key(trip) for trip in rounded]
+    cached = cache.get_many(keys)
+    hits = sum(1 for key in keys if key in cached)
+    missing = list(dict.fromkeys(trip for trip, key in zip(rounded, keys) if key not in cached))
+    if missing:
+        fresh = {_quote_cache_key(trip): quote for trip, quote in zip(missing, quote_matrix(missing))}
+        cache.set_many(fresh, timeout=timeout)
+        cached.update(fresh)
+    return [cached[key] for key in keys], hits
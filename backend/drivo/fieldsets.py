@@ -0,0 +1,124 @@
+"""
+Sparse fieldsets for list and detail reads.
+
+?fields=id,status,fare limits a response to the named fields and
+?expand=client,driver nests the named relations; relations that are not
+expanded are rendered as primary keys. Without either parameter the full
+representation is returned. Columns behind fields that are not requested
+are deferred with only(), and relations that are not expanded are not
+joined.
+"""
+from rest_framework import permissions, serializers
+
+
+def _split(value):
+    return [name.strip() for name in value.split(',') if name.strip()] if value else []
+
+
+class SparseFieldsMixin:
+    """
+    ModelSerializer mixin taking fields= and expand= keyword arguments.
+
+    Meta.expandable maps each nested relation to the select_related path it
+    needs when expanded; Meta.field_sources maps fields that do not read a
+    column of the same name (e.g. dp_url) to the columns they read.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        self._sparse_fields = fields
+        self._expand = expand
+        super().__init__(*args, **kwargs)
+
+    @property
+    def is_sparse(self):
+        return self._sparse_fields is not None or self._expand is not None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self.is_sparse:
+            return fields
+        requested = set(self._sparse_fields or fields)
+        expand = set(self._expand or ())
+        expandable = getattr(self.Meta, 'expandable', {})
+        for name in list(fields):
+            if name not in requested:
+                del fields[name]
+            elif name in expandable and name not in expand:
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+        return fields
+
+    @classmethod
+    def check_fieldset(cls, fields, expand):
+        """Raise ValidationError for unknown field or relation names."""
+        known = cls.Meta.fields
+        expandable = getattr(cls.Meta, 'expandable', {})
+        errors = {}
+        unknown = [name for name in fields or () if name not in known]
+        if unknown:
+            errors['fields'] = [f"Unknown field(s): {', '.join(unknown)}. Valid options are: {', '.join(known)}"]
+        unknown = [name for name in expand or () if name not in expandable]
+        if unknown:
+            errors['expand'] = [
+                f"Cannot expand: {', '.join(unknown)}. Valid options are: {', '.join(expandable) or 'none'}"
+            ]
+        if errors:
+            raise serializers.ValidationError(errors)
+
+    def columns(self):
+        """Model columns read by the selected fields, for QuerySet.only()."""
+        model = self.Meta.model
+        concrete = {field.name for field in model._meta.concrete_fields}
+        sources = getattr(self.Meta, 'field_sources', {})
+        columns = {model._meta.pk.name}
+        for name, field in self.fields.items():
+            for source in sources.get(name, (field.source,)):
+                source = source.split('.')[0]
+                if source in concrete:
+                    columns.add(source)
+        return columns
+
+    def related_paths(self):
+        """select_related paths for the expanded relations."""
+        expandable = getattr(self.Meta, 'expandable', {})
+        return [expandable[name] for name in self.fields if name in expandable and name in (self._expand or ())]
+
+
+class SparseFieldsViewMixin:
+    """
+    View mixin applying ?fields= and ?expand= to get_serializer() and to the
+    queryset on safe (read) requests. Writes always use the full
+    representation and queryset.
+    """
+
+    def get_fieldset(self):
+        """(fields, expand) from the query string, or None when not requested."""
+        request = self.request
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return None
+        params = request.query_params
+        if 'fields' not in params and 'expand' not in params:
+            return None
+        fields, expand = _split(params.get('fields')) or None, _split(params.get('expand'))
+        self.get_serializer_class().check_fieldset(fields, expand)
+        return fields, expand
+
+    def get_serializer(self, *args, **kwargs):
+        fieldset = self.get_fieldset()
+        if fieldset is not None:
+            kwargs['fields'], kwargs['expand'] = fieldset
+        return super().get_serializer(*args, **kwargs)
+
+    def apply_fieldset(self, queryset, extra_columns=()):
+        """Defer the columns and drop the joins the requested fieldset does not use."""
+        fieldset = self.get_fieldset()
+        if fieldset is None:
+            return queryset
+        serializer = self.get_serializer_class()(fields=fieldset[0], expand=fieldset[1])
+        queryset = queryset.select_related(None)
+        related = serializer.related_paths()
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset.only(*serializer.columns(), *extra_columns)
+
+    def get_queryset(self):
+        return self.apply_fieldset(super().get_queryset())
@@ -0,0 +1,238 @@
+"""
+Local gazetteer of known places (cities, towns, areas and landmarks).
+
+Places are loaded from a CSV dataset (GAZETTEER_PATH, by default
+drivo/data/places.csv) into an in-memory index:
+
+* every name, alias and "<name> <city>" variant is normalized (case,
+  accents, punctuation and spacing folded) and hashed to the places it
+  names, most important first, for exact lookups;
+* the same keys are kept in a sorted list so prefix lookups are a bisect
+  plus a short scan;
+* coordinates are held in numpy arrays, and in a KD-tree over unit
+  vectors when scipy is installed, for reverse geocoding.
+
+Lookups return records in the same shape as Nominatim search results so
+GeocodeView can answer known places without a network hop.
+"""
+import bisect
+import csv
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import namedtuple
+
+import numpy as np
+from django.conf import settings
+
+from drivo.geo import EARTH_RADIUS_KM
+from drivo.matrix import nearest_k
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # scipy is optional; reverse lookups fall back to numpy
+    cKDTree = None
+
+DEFAULT_GAZETTEER_PATH = os.path.join(os.path.dirname(__file__), 'data', 'places.csv')
+
+Place = namedtuple('Place', 'id name kind city country lat lon importance')
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+
+def _unit_vectors(lats, lons):
+    """Points on the unit sphere; chord length between them grows with great-circle distance."""
+    phi = np.radians(lats)
+    lmb = np.radians(lons)
+    return np.column_stack((np.cos(phi) * np.cos(lmb), np.cos(phi) * np.sin(lmb), np.sin(phi)))
+
+
+def normalize_name(text):
+    """Fold a place name or query to its index key: 'Gulshan-e-Iqbal, Karachi' -> 'gulshan e iqbal karachi'."""
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return _NON_ALNUM.sub(' ', text.lower()).strip()
+
+
+class Gazetteer:
+    """
+    In-memory place index. aliases, if given, holds a tuple of alternative
+    names for each place in places.
+    """
+
+    def __init__(self, places, aliases=None):
+        self.places = list(places)
+        self.lats = np.array([place.lat for place in self.places], dtype=np.float64)
+        self.lons = np.array([place.lon for place in self.places], dtype=np.float64)
+        exact = {}
+        for place, place_aliases in zip(self.places, aliases or [()] * len(self.places)):
+            self._index_place(exact, place, place_aliases)
+        self._exact = {
+            key: tuple(sorted(ids, key=lambda i: -self.places[i].importance))
+            for key, ids in exact.items()
+        }
+        self._keys = sorted(self._exact)
+        self._country_suffixes = sorted(
+            {' ' + normalize_name(place.country) for place in self.places if place.country},
+            key=len, reverse=True,
+        )
+        self._max_key_words = max((key.count(' ') + 1 for key in self._keys), default=0)
+        self._tree = None
+        if cKDTree is not None and self.places:
+            self._tree = cKDTree(_unit_vectors(self.lats, self.lons))
+
+    def _index_place(self, exact, place, aliases):
+        names = [place.name] + [alias for alias in aliases if alias]
+        keys = set()
+        city_key = normalize_name(place.city) if place.city else ''
+        for name in names:
+            key = normalize_name(name)
+            if not key:
+                continue
+            keys.add(key)
+            if city_key and not key.endswith(city_key):
+                keys.add(f'{key} {city_key}')
+        for key in keys:
+            exact.setdefault(key, []).append(place.id)
+
+    @classmethod
+    def load(cls, path):
+        places = []
+        aliases = []
+        with open(path, newline='', encoding='utf-8') as handle:
+            for row in csv.DictReader(handle):
+                places.append(Place(
+                    id=len(places),
+                    name=row['name'].strip(),
+                    kind=row['kind'].strip(),
+                    city=row.get('city', '').strip(),
+                    country=row.get('country', '').strip(),
+                    lat=float(row['lat']),
+                    lon=float(row['lon']),
+                    importance=float(row.get('importance') or 0),
+                ))
+                aliases.append(tuple(a.strip() for a in (row.get('aliases') or '').split('|') if a.strip()))
+        return cls(places, aliases)
+
+    def __len__(self):
+        return len(self.places)
+
+    def index_items(self):
+        """(key, place_ids) pairs in key order, place ids most important first."""
+        return [(key, self._exact[key]) for key in self._keys]
+
+    def lookup(self, query, limit=1):
+        """Places whose name, alias or "<name> <city>" equals the normalized query, most important first."""
+        key = normalize_name(query)
+        ids = self._exact.get(key)
+        if not ids:
+            # "Lahore, Pakistan" -> "lahore"
+            for suffix in self._country_suffixes:
+                if key.endswith(suffix):
+                    ids = self._exact.get(key[:-len(suffix)].strip())
+                    break
+        return [self.places[i] for i in (ids or ())[:limit]]
+
+    def prefix(self, text, limit=10):
+        """Distinct places with a key starting with the normalized text, most important first."""
+        key = normalize_name(text)
+        if not key:
+            return []
+        seen = set()
+        start = bisect.bisect_left(self._keys, key)
+        for candidate in self._keys[start:]:
+            if not candidate.startswith(key):
+                break
+            seen.update(self._exact[candidate])
+        ranked = sorted(seen, key=lambda i: -self.places[i].importance)
+        return [self.places[i] for i in ranked[:limit]]
+
+    def find_in_text(self, text):
+        """
+        The most specific known place mentioned in free text, or None.
+        Areas and landmarks beat towns and cities, and a place in a city the
+        text also mentions beats a same-named place elsewhere, so
+        "DHA Phase 6, Karachi" resolves to DHA in Karachi.
+        """
+        words = normalize_name(text).split()
+        matches = []
+        for size in range(min(self._max_key_words, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                for place_id in self._exact.get(' '.join(words[start:start + size]), ()):
+                    matches.append((size, self.places[place_id]))
+        if not matches:
+            return None
+        mentioned_cities = {place.name for _, place in matches if place.kind == 'city'}
+
+        def rank(match):
+            size, place = match
+            return (
+                place.kind not in ('city', 'town'),
+                not place.city or place.city in mentioned_cities,
+                size,
+                place.importance,
+            )
+
+        return max(matches, key=rank)[1]
+
+    def nearest(self, lats, lons, max_km=None):
+        """
+        Nearest place to each point, for any number of points at once.
+        Returns (place_ids, distances_km) arrays; points with no place
+        within max_km get -1 / np.inf.
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        if not self.places:
+            return np.full(len(lats), -1, dtype=np.int64), np.full(len(lats), np.inf)
+        if self._tree is None:
+            ids, distances = nearest_k(lats, lons, self.lats, self.lons, 1, max_km)
+            return ids[:, 0], distances[:, 0]
+        upper = np.inf
+        if max_km is not None:
+            upper = 2 * math.sin(min(max_km / (2 * EARTH_RADIUS_KM), math.pi / 2)) + 1e-12
+        chord, ids = self._tree.query(_unit_vectors(lats, lons), k=1, distance_upper_bound=upper)
+        found = np.isfinite(chord)
+        distances = np.where(
+            found, 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.where(found, chord, 0) / 2, 0, 1)), np.inf
+        )
+        return np.where(found, ids, -1).astype(np.int64), distances
+
+    def reverse(self, lat, lon, max_km=None):
+        """(place, distance_km) for the place nearest to a point, or (None, None)."""
+        ids, distances = self.nearest([lat], [lon], max_km)
+        if ids[0] < 0:
+            return None, None
+        return self.places[ids[0]], float(distances[0])
+
+
+def display_name(place):
+    return ', '.join(part for part in (place.name, place.city, place.country) if part)
+
+
+def to_result(place):
+    """A Nominatim-style search result for a place."""
+    return {
+        'lat': str(place.lat),
+        'lon': str(place.lon),
+        'display_name': display_name(place),
+        'type': place.kind,
+        'importance': place.importance,
+        'source': 'gazetteer',
+    }
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer():
+    """The process-wide gazetteer, loaded on first use."""
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = Gazetteer.load(getattr(settings, 'GAZETTEER_PATH', DEFAULT_GAZETTEER_PATH))
+    return _gazetteer
@@ -0,0 +1,345 @@
+"""
+Geospatial helpers for live driver positions.
+
+The grid index keeps every located driver in a uniform lat/lon cell so
+"drivers near me" queries only look at the handful of cells around the
+search point instead of scanning the DriverProfile table.
+"""
+import datetime
+import heapq
+import math
+import re
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+# Driver statuses that count as "available" for search and dispatch
+AVAILABLE_DRIVER_STATUSES = ('available', 'online', 'active')
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres between two points."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_array(lat1, lon1, lat2, lon2):
+    """Element-wise great-circle distances in kilometres for equal-length arrays."""
+    phi1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    phi2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    dlmb = np.radians(np.asarray(lon2, dtype=np.float64) - np.asarray(lon1, dtype=np.float64))
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_matrix(lat1, lon1, lat2, lon2):
+    """
+    Pairwise great-circle distances in kilometres.
+    lat1/lon1 have shape (N,), lat2/lon2 shape (M,); returns an (N, M) array.
+    """
+    phi1 = np.radians(np.asarray(lat1, dtype=np.float64))[:, None]
+    phi2 = np.radians(np.asarray(lat2, dtype=np.float64))[None, :]
+    lmb1 = np.radians(np.asarray(lon1, dtype=np.float64))[:, None]
+    lmb2 = np.radians(np.asarray(lon2, dtype=np.float64))[None, :]
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin((lmb2 - lmb1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def parse_coordinates(lat, lon):
+    """
+    Convert raw latitude/longitude values to floats.
+    Returns (lat, lon) or None if either value is missing or out of range.
+    """
+    try:
+        lat = float(lat)
+        lon = float(lon)
+    except (TypeError, ValueError):
+        return None
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        return None
+    return lat, lon
+
+
+class GridIndex:
+    """
+    In-memory grid of points keyed by an integer (lat, lon) cell.
+
+    Each entry is stored as key -> (lat, lon, status, timestamp). Radius
+    queries visit only the cells overlapping the search circle, and
+    k-nearest queries expand ring by ring until the k-th hit is closer than
+    the unexplored area. A position older than the one already stored only
+    updates the status.
+    """
+
+    def __init__(self, cell_size_deg=0.02):
+        self.cell_size = float(cell_size_deg)
+        self._cells = {}
+        self._entries = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _cell(self, lat, lon):
+        return (int(math.floor(lat / self.cell_size)), int(math.floor(lon / self.cell_size)))
+
+    def update(self, key, lat, lon, status=None, timestamp=None):
+        lat = float(lat)
+        lon = float(lon)
+        cell = self._cell(lat, lon)
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None:
+                if status is None:
+                    status = previous[2]
+                if timestamp is not None and previous[3] is not None and timestamp < previous[3]:
+                    self._entries[key] = previous[:2] + (status, previous[3])
+                    return
+                old_cell = self._cell(previous[0], previous[1])
+                if old_cell != cell:
+                    self._discard_from_cell(old_cell, key)
+            self._entries[key] = (lat, lon, status, timestamp)
+            self._cells.setdefault(cell, set()).add(key)
+
+    def set_status(self, key, status):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], entry[1], status, entry[3])
+
+    def remove(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._discard_from_cell(self._cell(entry[0], entry[1]), key)
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+            self._entries.clear()
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def snapshot(self, statuses=None):
+        """Return (keys, lats, lons) lists for every entry matching statuses."""
+        keys, lats, lons = [], [], []
+        with self._lock:
+            for key, entry in self._entries.items():
+                if self._matches(entry, statuses):
+                    keys.append(key)
+                    lats.append(entry[0])
+                    lons.append(entry[1])
+        return keys, lats, lons
+
+    def _discard_from_cell(self, cell, key):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(key)
+            if not members:
+                del self._cells[cell]
+
+    def _cell_span(self, lat, radius_km):
+        """Number of cells to cover radius_km in each direction around lat."""
+        lat_span = radius_km / KM_PER_DEGREE_LAT
+        # Widest longitude span is at the edge of the circle closest to a pole
+        edge_lat = min(89.9, abs(lat) + lat_span)
+        lon_span = radius_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(edge_lat)), 1e-6))
+        return (int(math.ceil(lat_span / self.cell_size)),
+                int(math.ceil(min(lon_span, 180.0) / self.cell_size)))
+
+    def _ring_cells(self, center, ring):
+        ci, cj = center
+        if ring == 0:
+            yield center
+            return
+        for j in range(cj - ring, cj + ring + 1):
+            yield (ci - ring, j)
+            yield (ci + ring, j)
+        for i in range(ci - ring + 1, ci + ring):
+            yield (i, cj - ring)
+            yield (i, cj + ring)
+
+    def _matches(self, entry, statuses):
+        return statuses is None or entry[2] in statuses
+
+    def within(self, lat, lon, radius_km, statuses=None, limit=None):
+        """
+        Return [(distance_km, key, lat, lon), ...] for every entry within
+        radius_km of (lat, lon), closest first.
+        """
+        ci, cj = self._cell(lat, lon)
+        di, dj = self._cell_span(lat, radius_km)
+        hits = []
+        with self._lock:
+            if (2 * di + 1) * (2 * dj + 1) > len(self._cells):
+                # Search area covers more cells than are occupied
+                candidate_cells = [
+                    cell for cell in self._cells
+                    if abs(cell[0] - ci) <= di and abs(cell[1] - cj) <= dj
+                ]
+            else:
+                candidate_cells = [
+                    (i, j)
+                    for i in range(ci - di, ci + di + 1)
+                    for j in range(cj - dj, cj + dj + 1)
+                ]
+            for cell in candidate_cells:
+                members = self._cells.get(cell)
+                if not members:
+                    continue
+                for key in members:
+                    entry = self._entries[key]
+                    if not self._matches(entry, statuses):
+                        continue
+                    distance = haversine_km(lat, lon, entry[0], entry[1])
+                    if distance <= radius_km:
+                        hits.append((distance, key, entry[0], entry[1]))
+        if limit is not None:
+            return heapq.nsmallest(limit, hits)
+        hits.sort()
+        return hits
+
+    def nearest(self, lat, lon, k, max_radius_km, statuses=None):
+        """
+        Return up to k entries within max_radius_km, closest first, by
+        expanding rings of cells around (lat, lon).
+        """
+        if k <= 0:
+            return []
+        center = self._cell(lat, lon)
+        max_di, max_dj = self._cell_span(lat, max_radius_km)
+        max_ring = max(max_di, max_dj)
+        # Smallest distance covered by one ring of cells at this latitude
+        cell_km = self.cell_size * KM_PER_DEGREE_LAT * min(
+            1.0, max(math.cos(math.radians(min(89.9, abs(lat) + max_radius_km / KM_PER_DEGREE_LAT))), 1e-6)
+        )
+        best = []  # max-heap of (-distance, key, lat, lon)
+        with self._lock:
+            if not self._entries:
+                return []
+            for ring in range(max_ring + 1):
+                for cell in self._ring_cells(center, ring):
+                    members = self._cells.get(cell)
+                    if not members:
+                        continue
+                    for key in members:
+                        entry = self._entries[key]
+                        if not self._matches(entry, statuses):
+                            continue
+                        distance = haversine_km(lat, lon, entry[0], entry[1])
+                        if distance > max_radius_km:
+                            continue
+                        item = (-distance, key, entry[0], entry[1])
+                        if len(best) < k:
+                            heapq.heappush(best, item)
+                        elif distance < -best[0][0]:
+                            heapq.heapreplace(best, item)
+                # Everything within ring * cell_km has now been visited
+                if len(best) == k and -best[0][0] <= ring * cell_km:
+                    break
+        return sorted((-d, key, p_lat, p_lon) for d, key, p_lat, p_lon in best)
+
+
+class DriverLocationIndex(GridIndex):
+    """
+    Grid index over DriverProfile.current_latitude/current_longitude.
+
+    The index is loaded from the database on first use and then kept
+    current by the location views. Positions written by other workers are
+    picked up by a periodic delta sync on last_location_update; the sync
+    looks back sync_lookback seconds because write-behind flushes persist
+    ping timestamps that can predate the previous sync.
+    """
+
+    def __init__(self, cell_size_deg=0.02, sync_interval=5, sync_lookback=0):
+        super().__init__(cell_size_deg)
+        self.sync_interval = sync_interval
+        self.sync_lookback = datetime.timedelta(seconds=sync_lookback)
+        self._loaded = False
+        self._last_sync_monotonic = 0.0
+        self._synced_until = None
+
+    def _load_rows(self, queryset):
+        for driver_id, lat, lon, driver_status, updated_at in queryset.values_list(
+            'id', 'current_latitude', 'current_longitude', 'status', 'last_location_update'
+        ):
+            if lat is None or lon is None:
+                self.remove(driver_id)
+            else:
+                self.update(driver_id, lat, lon, driver_status, updated_at)
+
+    def ensure_fresh(self):
+        """Load the index on first use and pull positions changed since the last sync."""
+        now = time.monotonic()
+        if self._loaded and now - self._last_sync_monotonic < self.sync_interval:
+            return
+        from drivo.models import DriverProfile
+
+        with self._lock:
+            if self._loaded and now - self._last_sync_monotonic < self.sync_interval:
+                return
+            sync_started = timezone.now()
+            queryset = DriverProfile.objects.all()
+            if self._loaded and self._synced_until is not None:
+                queryset = queryset.filter(
+                    last_location_update__gte=self._synced_until - self.sync_lookback
+                )
+            else:
+                queryset = queryset.filter(current_latitude__isnull=False, current_longitude__isnull=False)
+            self._load_rows(queryset)
+            self._loaded = True
+            self._synced_until = sync_started
+            self._last_sync_monotonic = now
+
+    def update_profile(self, profile):
+        """Reflect a DriverProfile's saved position in the index."""
+        if profile.current_latitude is None or profile.current_longitude is None:
+            self.remove(profile.id)
+            return
+        coords = parse_coordinates(profile.current_latitude, profile.current_longitude)
+        if coords is None:
+            self.remove(profile.id)
+        else:
+            self.update(profile.id, coords[0], coords[1], profile.status, profile.last_location_update)
+
+
+driver_index = DriverLocationIndex(
+    cell_size_deg=getattr(settings, 'DRIVER_INDEX_CELL_DEGREES', 0.02),
+    sync_interval=getattr(settings, 'DRIVER_INDEX_SYNC_SECONDS', 5),
+    sync_lookback=getattr(settings, 'LIVE_LOCATION_FLUSH_SECONDS', 0) * 2,
+)
+
+
+def driver_status_counts(city=None):
+    """
+    {status: number of drivers} overall or in one city, from one GROUP BY
+    cached for DRIVER_STATUS_COUNTS_SECONDS, so listings do not COUNT(*)
+    the fleet on every request.
+    """
+    key = 'driver_status_counts_' + (re.sub(r'\W+', '_', city.strip().lower()) if city else '*')
+    counts = cache.get(key)
+    if counts is None:
+        from drivo.models import DriverProfile
+
+        queryset = DriverProfile.objects.all()
+        if city:
+            queryset = queryset.filter(city=city)
+        counts = dict(queryset.order_by().values_list('status').annotate(Count('id')))
+        cache.set(key, counts, getattr(settings, 'DRIVER_STATUS_COUNTS_SECONDS', 30))
+    return counts
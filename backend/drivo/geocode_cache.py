@@ -0,0 +1,294 @@
+"""
+Two-tier cache for geocode payloads.
+
+Tier one is a bounded in-process LRU. Tier two is the GeocodeCacheEntry
+table, which every worker shares and which survives restarts. An entry is
+fresh until its timeout and then stale for another stale_seconds. Stale
+entries are still returned, flagged as stale, so the caller can answer at
+once and refresh in the background (stale-while-revalidate).
+
+On first use each process preloads the most requested entries into its
+LRU (warm start), so a deploy does not send every popular query back to
+Nominatim. Hit counts are buffered in memory and added to the table in a
+few UPDATEs per flush interval.
+
+Transient payloads (durable=False) are kept in the LRU only and are never
+served stale.
+"""
+import datetime
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import F
+
+from drivo.cache_backends import value_size
+
+logger = logging.getLogger(__name__)
+
+# GeocodeCacheEntry.key max_length
+MAX_KEY_LENGTH = 255
+
+
+class LRUCache:
+    """
+    Thread-safe mapping that evicts least recently used keys beyond
+    max_entries or, if max_bytes is set, beyond max_bytes of sizeof(value).
+    """
+
+    def __init__(self, max_entries, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or value_size
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store value and return the number of entries evicted to make room."""
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            self._pop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return 0
+            self._data[key] = value
+            self._sizes[key] = size
+            self.bytes += size
+            evicted = 0
+            while len(self._data) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                oldest, _ = self._data.popitem(last=False)
+                self.bytes -= self._sizes.pop(oldest)
+                evicted += 1
+            return evicted
+
+    def _pop(self, key):
+        if self._data.pop(key, None) is not None:
+            self.bytes -= self._sizes.pop(key)
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+
+def _to_datetime(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+
+
+class GeocodeCache:
+    def __init__(self, lru_entries=10000, lru_bytes=None, stale_seconds=7 * 86400, warm_entries=1000,
+                 hit_flush_seconds=60):
+        self.stale_seconds = stale_seconds
+        self.warm_entries = warm_entries
+        self.hit_flush_seconds = hit_flush_seconds
+        # Entries are (payload, expires_at, stale_until); only the payload is sized
+        self._lru = LRUCache(lru_entries, lru_bytes, sizeof=lambda entry: value_size(entry[0]))
+        self._warmed = False
+        self._warm_lock = threading.Lock()
+        self._hits = Counter()
+        self._hits_flushed_at = time.monotonic()
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(key):
+        if len(key) <= MAX_KEY_LENGTH:
+            return key
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return f'{key[:MAX_KEY_LENGTH - len(digest) - 1]}_{digest}'
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['pending_hits'] = sum(self._hits.values())
+        stats['lru_entries'] = len(self._lru)
+        stats['lru_bytes'] = self._lru.bytes
+        stats['warmed'] = self._warmed
+        return stats
+
+    def get(self, key, record_hit=True):
+        """(payload, fresh) for key, or None if unknown or past its stale window."""
+        self._ensure_warm()
+        key = self._key(key)
+        now = time.time()
+        entry = self._lru.get(key)
+        tier = 'lru'
+        if entry is not None and now >= entry[1]:
+            # Another worker may have refreshed it already
+            entry = self._load(key) or entry
+        elif entry is None:
+            entry = self._load(key)
+            tier = 'db'
+        if entry is None or now >= entry[2]:
+            if record_hit:
+                self._count('misses')
+            return None
+
+        payload, expires_at, _ = entry
+        fresh = now < expires_at
+        if record_hit:
+            self._count(f'{tier}_hits')
+            if not fresh:
+                self._count('stale_hits')
+            self._record_hit(key)
+        return payload, fresh
+
+    def set(self, key, query, payload, timeout, durable=True):
+        key = self._key(key)
+        expires_at = time.time() + timeout
+        self._store(key, (payload, expires_at, expires_at + (self.stale_seconds if durable else 0)))
+        if not durable:
+            return
+        from drivo.models import GeocodeCacheEntry
+
+        try:
+            GeocodeCacheEntry.objects.update_or_create(
+                key=key,
+                defaults={'query': query[:255], 'payload': payload, 'expires_at': _to_datetime(expires_at)},
+            )
+        except DatabaseError:
+            logger.exception("Could not persist geocode cache entry %s", key)
+
+    def extend(self, key, timeout):
+        """Keep serving the current payload as fresh for another `timeout` seconds."""
+        key = self._key(key)
+        entry = self._lru.get(key) or self._load(key)
+        if entry is None:
+            return
+        expires_at = time.time() + timeout
+        self._store(key, (entry[0], expires_at, max(entry[2], expires_at)))
+        from drivo.models import GeocodeCacheEntry
+
+        try:
+            GeocodeCacheEntry.objects.filter(key=key).update(expires_at=_to_datetime(expires_at))
+        except DatabaseError:
+            logger.exception("Could not extend geocode cache entry %s", key)
+
+    def _store(self, key, entry):
+        evicted = self._lru.set(key, entry)
+        if evicted:
+            self._count('evictions', evicted)
+
+    def _load(self, key):
+        from drivo.models import GeocodeCacheEntry
+
+        try:
+            row = GeocodeCacheEntry.objects.filter(key=key).values_list('payload', 'expires_at').first()
+        except DatabaseError:
+            logger.exception("Could not read geocode cache entry %s", key)
+            return None
+        if row is None:
+            return None
+        expires_at = row[1].timestamp()
+        entry = (row[0], expires_at, expires_at + self.stale_seconds)
+        self._store(key, entry)
+        return entry
+
+    def _record_hit(self, key):
+        with self._lock:
+            self._hits[key] += 1
+            if time.monotonic() - self._hits_flushed_at < self.hit_flush_seconds:
+                return
+            pending = self._hits
+            self._hits = Counter()
+            self._hits_flushed_at = time.monotonic()
+        self.flush_hits(pending)
+
+    def flush_hits(self, pending=None):
+        """Add buffered hit counts to the table, one UPDATE per distinct count."""
+        if pending is None:
+            with self._lock:
+                pending = self._hits
+                self._hits = Counter()
+                self._hits_flushed_at = time.monotonic()
+        by_count = defaultdict(list)
+        for key, hits in pending.items():
+            by_count[hits].append(key)
+        from drivo.models import GeocodeCacheEntry
+
+        try:
+            with transaction.atomic():
+                for hits, keys in by_count.items():
+                    GeocodeCacheEntry.objects.filter(key__in=keys).update(hits=F('hits') + hits)
+        except DatabaseError:
+            logger.exception("Could not record geocode cache hits")
+
+    def _ensure_warm(self):
+        if self._warmed:
+            return
+        with self._warm_lock:
+            if not self._warmed:
+                try:
+                    self.warm_start()
+                finally:
+                    self._warmed = True
+
+    def warm_start(self, limit=None):
+        """Load the `limit` most requested, still servable entries into the LRU. Returns the count."""
+        from drivo.models import GeocodeCacheEntry
+
+        limit = self.warm_entries if limit is None else limit
+        if limit <= 0:
+            self._warmed = True
+            return 0
+        cutoff = _to_datetime(time.time() - self.stale_seconds)
+        try:
+            rows = list(
+                GeocodeCacheEntry.objects.filter(expires_at__gt=cutoff).order_by('-hits')
+                .values_list('key', 'payload', 'expires_at')[:limit]
+            )
+        except DatabaseError:
+            logger.exception("Geocode cache warm start failed")
+            return 0
+        # Hottest last, so they are the last to be evicted
+        for key, payload, expires_at in reversed(rows):
+            expires_at = expires_at.timestamp()
+            self._store(key, (payload, expires_at, expires_at + self.stale_seconds))
+        self._warmed = True
+        self._count('warmed', len(rows))
+        logger.info("Loaded %d geocode cache entries", len(rows))
+        return len(rows)
+
+    def prune(self):
+        """Delete table entries past their stale window. Returns the number deleted."""
+        from drivo.models import GeocodeCacheEntry
+
+        cutoff = _to_datetime(time.time() - self.stale_seconds)
+        deleted, _ = GeocodeCacheEntry.objects.filter(expires_at__lte=cutoff).delete()
+        return deleted
+
+    def clear_local(self):
+        self._lru.clear()
+
+
+geocode_cache = GeocodeCache(
+    lru_entries=getattr(settings, 'GEOCODE_CACHE_LRU_ENTRIES', 10000),
+    lru_bytes=getattr(settings, 'GEOCODE_CACHE_LRU_BYTES', 32 * 2 ** 20),
+    stale_seconds=getattr(settings, 'GEOCODE_CACHE_STALE_SECONDS', 7 * 86400),
+    warm_entries=getattr(settings, 'GEOCODE_CACHE_WARM_ENTRIES', 1000),
+    hit_flush_seconds=getattr(settings, 'GEOCODE_CACHE_HIT_FLUSH_SECONDS', 60),
+)
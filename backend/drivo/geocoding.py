@@ -0,0 +1,302 @@
+"""
+Forward geocoding used by GeocodeView.
+
+Queries resolve from the local gazetteer first, then from the two-tier
+geocode cache (drivo.geocode_cache), and only then from Nominatim. Cache
+misses go through a single-flight so concurrent misses for the same query,
+in this worker or another, share one upstream request. Expired entries
+are served while one background refresh per query fetches a new result.
+
+A result ("payload") is a non-empty list of results, [] when nothing was
+found, or {'error': ...} when the upstream request failed. Results are
+compact records by default (see compact_result), cached under
+geocode_<query>. Full Nominatim-style results are cached under
+geocode_full:<query> only once a caller has asked for them (full=True).
+"""
+import logging
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from drivo.cache_backends import shared_cache
+from drivo.gazetteer import get_gazetteer, to_result
+from drivo.geocode_cache import geocode_cache
+from drivo.nominatim import GeocodingUnavailable, UpstreamError, nominatim
+from drivo.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+FOUND_TIMEOUT = 86400  # 24 hours
+NOT_FOUND_TIMEOUT = 3600  # avoid repeated API calls for unknown places
+ERROR_TIMEOUT = 300  # avoid hammering the API while it fails
+
+geocode_flight = SingleFlight(
+    'geocode',
+    lock_timeout=getattr(settings, 'GEOCODE_SINGLE_FLIGHT_LOCK_SECONDS', 10),
+    wait_timeout=getattr(settings, 'GEOCODE_SINGLE_FLIGHT_WAIT_SECONDS', 10),
+)
+
+_counters = Counter()
+_counters_lock = threading.Lock()
+
+_refresher = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'GEOCODE_REFRESH_WORKERS', 2), thread_name_prefix='geocode-refresh'
+)
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def _count(counter):
+    with _counters_lock:
+        _counters[counter] += 1
+
+
+def geocode_stats():
+    """Per-process request counters plus cache, single-flight and upstream client stats."""
+    with _counters_lock:
+        stats = dict(_counters)
+    stats['cache'] = geocode_cache.stats()
+    stats['single_flight'] = geocode_flight.stats()
+    stats['upstream'] = nominatim.stats()
+    return stats
+
+
+def normalize_query(query):
+    return ' '.join(query.split())
+
+
+def sanitize_cache_key(query):
+    # More robust sanitization that handles special characters consistently
+    return re.sub(r'[^A-Za-z0-9]', '_', query.strip().lower())
+
+
+def geocode_cache_key(normalized_query, full=False):
+    # sanitize_cache_key never produces ':', so the two key spaces cannot collide
+    if full:
+        return f'geocode_full:{sanitize_cache_key(normalized_query)}'
+    return f'geocode_{sanitize_cache_key(normalized_query)}'
+
+
+COMPACT_FIELDS = ('lat', 'lon', 'display_name', 'type', 'source')
+_COMPACT_KEYS = frozenset(COMPACT_FIELDS)
+
+
+def _float_or_none(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def compact_result(result):
+    """The fields clients use from a Nominatim-style result, with float coordinates."""
+    return {
+        'lat': _float_or_none(result.get('lat')),
+        'lon': _float_or_none(result.get('lon')),
+        'display_name': result.get('display_name', ''),
+        'type': result.get('type'),
+        'source': result.get('source', 'nominatim'),
+    }
+
+
+def compact_payload(payload):
+    if not isinstance(payload, list):
+        return payload
+    return [
+        result if result.keys() == _COMPACT_KEYS else compact_result(result)
+        for result in payload
+    ]
+
+
+def resolve_geocode(normalized_query):
+    """
+    Ask Nominatim, falling back to a place mentioned in the query. Returns
+    (payload, timeout); timeout is None for payloads that must not be cached.
+    """
+    params = {
+        'q': normalized_query,
+        'limit': 1,
+        'addressdetails': 1,
+        'extratags': 1,
+        'namedetails': 1
+    }
+    error = None
+    try:
+        data = nominatim.search(params)
+    except GeocodingUnavailable as e:
+        logger.warning("Geocoding request failed for %r: %s", normalized_query, e)
+        data, error = None, e
+    if data:
+        return data, FOUND_TIMEOUT
+
+    # Nothing upstream; use a known place mentioned in the query
+    place = get_gazetteer().find_in_text(normalized_query)
+    if place is not None:
+        return [to_result(place)], FOUND_TIMEOUT
+    if error is not None:
+        # Upstream failures are cached briefly; requests refused locally
+        # (open circuit, full queue, rate limit deadline) are not
+        return {'error': str(error)}, ERROR_TIMEOUT if isinstance(error, UpstreamError) else None
+    return [], NOT_FOUND_TIMEOUT
+
+
+def store_geocode(normalized_query, payload, timeout, full=False):
+    """Cache a resolved payload as compact records, and in full if it was asked for in full."""
+    # Errors stay in this worker's memory only
+    durable = not isinstance(payload, dict)
+    compact = compact_payload(payload)
+    geocode_cache.set(geocode_cache_key(normalized_query), normalized_query, compact, timeout, durable=durable)
+    if full:
+        geocode_cache.set(
+            geocode_cache_key(normalized_query, full=True), normalized_query, payload, timeout, durable=durable
+        )
+    return payload if full else compact
+
+
+def fetch_geocode(normalized_query, full=False):
+    """Resolve a query, cache and return the payload."""
+    payload, timeout = resolve_geocode(normalized_query)
+    if timeout is None:
+        return payload
+    return store_geocode(normalized_query, payload, timeout, full)
+
+
+def refresh_geocode(normalized_query, full=False):
+    """Re-resolve an expired entry. On failure the old payload keeps being served for a while."""
+    cache_key = geocode_cache_key(normalized_query, full)
+    lock_key = f'geocode_refresh_{cache_key}'
+    cache = shared_cache()
+    if not cache.add(lock_key, True, timeout=ERROR_TIMEOUT):
+        return  # another worker is refreshing it
+    try:
+        payload, timeout = resolve_geocode(normalized_query)
+        if isinstance(payload, dict):
+            geocode_cache.extend(cache_key, ERROR_TIMEOUT)
+        else:
+            store_geocode(normalized_query, payload, timeout, full)
+        _count('refreshed')
+    finally:
+        cache.delete(lock_key)
+
+
+def _run_refresh(normalized_query, cache_key, full):
+    try:
+        close_old_connections()
+        refresh_geocode(normalized_query, full)
+    except Exception:
+        logger.exception("Background geocode refresh failed for %r", normalized_query)
+    finally:
+        close_old_connections()
+        with _refreshing_lock:
+            _refreshing.discard(cache_key)
+
+
+def schedule_refresh(normalized_query, full=False):
+    cache_key = geocode_cache_key(normalized_query, full)
+    with _refreshing_lock:
+        if cache_key in _refreshing:
+            return
+        _refreshing.add(cache_key)
+    _refresher.submit(_run_refresh, normalized_query, cache_key, full)
+
+
+def _fresh_payload(cache_key):
+    cached = geocode_cache.get(cache_key, record_hit=False)
+    return cached[0] if cached is not None and cached[1] else None
+
+
+def local_geocode(normalized_query, full=False):
+    """The payload from the gazetteer or the cache, or None if the upstream must be asked."""
+    # Known places resolve from the local gazetteer without a network hop
+    places = get_gazetteer().lookup(normalized_query)
+    if places:
+        _count('gazetteer')
+        result = to_result(places[0])
+        return [result if full else compact_result(result)]
+
+    cached = geocode_cache.get(geocode_cache_key(normalized_query, full))
+    if cached is not None:
+        payload, fresh = cached
+        _count('hits')
+        if not fresh:
+            schedule_refresh(normalized_query, full)
+        return payload if full else compact_payload(payload)
+    return None
+
+
+def remote_geocode(normalized_query, full=False):
+    _count('misses')
+    cache_key = geocode_cache_key(normalized_query, full)
+    return geocode_flight.run(
+        cache_key,
+        lambda: fetch_geocode(normalized_query, full),
+        lambda: _fresh_payload(cache_key),
+    )
+
+
+def geocode(query, full=False):
+    """The geocode payload for a query (see module docstring)."""
+    normalized_query = normalize_query(query)
+    payload = local_geocode(normalized_query, full)
+    if payload is None:
+        payload = remote_geocode(normalized_query, full)
+    return payload
+
+
+def _remote_geocode_in_worker(normalized_query, full):
+    try:
+        return remote_geocode(normalized_query, full)
+    finally:
+        close_old_connections()
+
+
+def geocode_many(queries, max_workers=4, full=False):
+    """
+    Geocode many queries, yielding (normalized_query, indexes, payload, cached)
+    as each result becomes available. Queries that share a cache key are
+    resolved once; indexes are their positions in `queries`. Local results
+    are yielded first, then upstream results in completion order. The
+    upstream client's shared rate limit still applies to every worker.
+    """
+    unique = {}
+    for index, query in enumerate(queries):
+        normalized_query = normalize_query(query)
+        cache_key = geocode_cache_key(normalized_query)
+        if cache_key in unique:
+            unique[cache_key][1].append(index)
+        else:
+            unique[cache_key] = (normalized_query, [index])
+
+    misses = []
+    for normalized_query, indexes in unique.values():
+        payload = local_geocode(normalized_query, full)
+        if payload is None:
+            misses.append((normalized_query, indexes))
+        else:
+            yield normalized_query, indexes, payload, True
+    if not misses:
+        return
+
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(misses))), thread_name_prefix='geocode-batch'
+    )
+    try:
+        futures = {
+            executor.submit(_remote_geocode_in_worker, normalized_query, full): (normalized_query, indexes)
+            for normalized_query, indexes in misses
+        }
+        for future in as_completed(futures):
+            normalized_query, indexes = futures[future]
+            try:
+                payload = future.result()
+            except Exception as e:
+                logger.exception("Batch geocoding failed for %r", normalized_query)
+                payload = {'error': str(e)}
+            yield normalized_query, indexes, payload, False
+    finally:
+        # The client may disconnect mid-stream; drop work not yet started
+        executor.shutdown(wait=False, cancel_futures=True)
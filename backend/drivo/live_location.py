@@ -0,0 +1,344 @@
+"""
+Live driver location store with write-behind to DriverProfile.
+
+GPS pings are recorded in the memory of the worker that took them and
+flushed to the database in periodic batched UPDATEs. Only the latest
+position per driver is written, so a driver pinging every few seconds
+costs one UPDATE per flush instead of one SELECT + full-row UPDATE per
+ping. Flushes never move last_location_update backwards: a worker holding
+an older ping than the one already stored leaves the row alone.
+
+The store is per process, so other workers only see a position once it is
+flushed. Readers serve a ping this worker took within the last flush
+interval without a query, since other workers' pings reach the row that
+late anyway; otherwise they compare the local entry with the flushed row.
+
+Positions not yet flushed are lost if the process dies; at most
+LIVE_LOCATION_FLUSH_SECONDS worth of pings is at risk.
+"""
+import atexit
+import datetime
+import logging
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from drivo.bulk import bulk_update_columns
+from drivo.geo import driver_index, parse_coordinates
+
+logger = logging.getLogger(__name__)
+
+# DriverProfile.current_latitude/current_longitude have 6 decimal places
+COORDINATE_QUANTUM = Decimal('0.000001')
+
+POSITION_FIELDS = ('current_latitude', 'current_longitude', 'last_location_update')
+
+PROFILE_ID_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def quantize_coordinate(value):
+    return Decimal(str(value)).quantize(COORDINATE_QUANTUM, rounding=ROUND_HALF_UP)
+
+
+def parse_recorded_at(value):
+    """
+    Parse a point timestamp given as ISO-8601 or epoch seconds/milliseconds.
+    Naive datetimes are taken as UTC. Returns None if the value is invalid.
+    """
+    if isinstance(value, bool) or value is None or value == '':
+        return None
+    if isinstance(value, (int, float)) or (isinstance(value, str) and value.replace('.', '', 1).isdigit()):
+        seconds = float(value)
+        if seconds > 1e11:
+            seconds /= 1000.0
+        try:
+            return datetime.datetime.fromtimestamp(seconds, tz=datetime.timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        return None
+    if parsed is None:
+        return None
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+    return parsed
+
+
+def bulk_update_positions(rows, batch_size=500):
+    """
+    Write current_latitude/current_longitude/last_location_update for many
+    drivers. rows is [(driver_id, latitude, longitude, recorded_at), ...].
+    Drivers whose stored position is newer than recorded_at are skipped.
+    """
+    from drivo.models import DriverProfile
+
+    return bulk_update_columns(
+        DriverProfile, POSITION_FIELDS, rows, batch_size=batch_size, newer_field='last_location_update'
+    )
+
+
+def driver_profile_id_for_user(user):
+    """
+    Return the DriverProfile id for a user, or None if there is none.
+    The user -> profile mapping never changes, so it is cached.
+    """
+    from drivo.models import DriverProfile
+
+    cache_key = f'driver_profile_id_{user.id}'
+    profile_id = cache.get(cache_key)
+    if profile_id is None:
+        profile_id = DriverProfile.objects.filter(user=user).values_list('id', flat=True).first()
+        if profile_id is not None:
+            cache.set(cache_key, profile_id, timeout=PROFILE_ID_CACHE_TIMEOUT)
+    return profile_id
+
+
+class LiveLocationStore:
+    """
+    Latest known position per driver, held for `ttl` seconds.
+
+    Entries are driver_id -> (latitude, longitude, recorded_at) with
+    Decimal coordinates quantized to the DriverProfile columns. Drivers
+    whose position changed since the last flush are tracked in a dirty set
+    and written by flush().
+    """
+
+    def __init__(self, ttl=300, flush_interval=5, batch_size=500):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._positions = {}
+        self._expires = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+
+    def record(self, driver_id, latitude, longitude, recorded_at=None, persist=True):
+        """
+        Store a position for a driver. With persist=False the position is
+        assumed to be saved already and is not queued for flushing.
+        """
+        recorded_at = recorded_at or timezone.now()
+        entry = (quantize_coordinate(latitude), quantize_coordinate(longitude), recorded_at)
+        with self._lock:
+            current = self._positions.get(driver_id)
+            if current is not None and current[2] > recorded_at:
+                # Out-of-order ping; keep the newer position
+                return False
+            self._positions[driver_id] = entry
+            self._expires[driver_id] = time.monotonic() + self.ttl
+            if persist:
+                self._dirty.add(driver_id)
+            elif driver_id in self._dirty:
+                self._dirty.discard(driver_id)
+        driver_index.update(driver_id, entry[0], entry[1], timestamp=recorded_at)
+        if persist:
+            self._ensure_flusher()
+        return True
+
+    def record_many(self, entries):
+        """
+        Store already-persisted positions given as
+        [(driver_id, latitude, longitude, recorded_at), ...].
+        """
+        expires = time.monotonic() + self.ttl
+        stored = []
+        with self._lock:
+            for driver_id, latitude, longitude, recorded_at in entries:
+                current = self._positions.get(driver_id)
+                if current is not None and current[2] > recorded_at:
+                    continue
+                entry = (quantize_coordinate(latitude), quantize_coordinate(longitude), recorded_at)
+                self._positions[driver_id] = entry
+                self._expires[driver_id] = expires
+                self._dirty.discard(driver_id)
+                stored.append((driver_id, entry))
+        for driver_id, entry in stored:
+            driver_index.update(driver_id, entry[0], entry[1], timestamp=entry[2])
+
+    def get(self, driver_id, max_age=None):
+        """
+        Return this worker's (latitude, longitude, recorded_at) for a driver,
+        or None if unknown or expired. Another worker may hold a newer one.
+        With max_age, only an entry stored in the last max_age seconds is
+        returned.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._positions.get(driver_id)
+            if entry is not None and self._expires[driver_id] < now:
+                self._forget(driver_id)
+                entry = None
+            if entry is not None and max_age is not None and self._expires[driver_id] - self.ttl + max_age < now:
+                entry = None
+        return entry
+
+    def _forget(self, driver_id):
+        if driver_id not in self._dirty:
+            self._positions.pop(driver_id, None)
+            self._expires.pop(driver_id, None)
+
+    def pending(self):
+        with self._lock:
+            return len(self._dirty)
+
+    def flush(self):
+        """Write all dirty positions in batched UPDATEs. Returns the number of drivers written."""
+        with self._flush_lock:
+            with self._lock:
+                dirty = self._dirty
+                self._dirty = set()
+                batch = [(driver_id, self._positions[driver_id]) for driver_id in dirty]
+                now = time.monotonic()
+                for driver_id in [d for d, expires in self._expires.items() if expires < now]:
+                    self._forget(driver_id)
+            if not batch:
+                return 0
+
+            rows = [
+                (driver_id, latitude, longitude, recorded_at)
+                for driver_id, (latitude, longitude, recorded_at) in batch
+            ]
+            try:
+                # last_location_update is written as the ping time, not the
+                # flush time
+                with transaction.atomic():
+                    bulk_update_positions(rows, batch_size=self.batch_size)
+            except Exception:
+                logger.exception("Live location flush failed; re-queueing %d drivers", len(batch))
+                with self._lock:
+                    self._dirty.update(driver_id for driver_id, _ in batch)
+                raise
+            return len(rows)
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._flush_lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(
+                target=self._run_flusher, name='live-location-flusher', daemon=True
+            )
+            self._flusher.start()
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                # Already logged; positions stay dirty for the next round
+                pass
+
+
+live_locations = LiveLocationStore(
+    ttl=getattr(settings, 'LIVE_LOCATION_TTL_SECONDS', 300),
+    flush_interval=getattr(settings, 'LIVE_LOCATION_FLUSH_SECONDS', 5),
+    batch_size=getattr(settings, 'LIVE_LOCATION_FLUSH_BATCH_SIZE', 500),
+)
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        live_locations.flush()
+    except Exception:
+        pass
+
+
+def _parse_driver_id(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        driver_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    return driver_id if driver_id > 0 and str(driver_id) == str(value).strip() else None
+
+
+def _ingest_chunk(chunk, result, store):
+    from drivo.models import DriverProfile
+
+    # Coalesce to the newest record per driver within the chunk
+    latest = {}
+    for index, record in chunk:
+        if not isinstance(record, dict):
+            result['rejected'].append({'index': index, 'reason': 'invalid'})
+            continue
+        driver_id = _parse_driver_id(record.get('driver_id'))
+        recorded_at = parse_recorded_at(record.get('ts'))
+        if driver_id is None or recorded_at is None or parse_coordinates(record.get('lat'), record.get('lon')) is None:
+            result['rejected'].append({'index': index, 'driver_id': record.get('driver_id'), 'reason': 'invalid'})
+            continue
+        previous = latest.get(driver_id)
+        if previous is not None:
+            result['coalesced'] += 1
+            if previous[3] >= recorded_at:
+                continue
+        latest[driver_id] = (index, record['lat'], record['lon'], recorded_at)
+    if not latest:
+        return
+
+    # Stored ping times, so records older than the current position are
+    # reported as stale rather than skipped by the UPDATE's guard
+    known = dict(DriverProfile.objects.filter(id__in=list(latest)).values_list('id', 'last_location_update'))
+    applied = []
+    for driver_id, (index, latitude, longitude, recorded_at) in latest.items():
+        if driver_id not in known:
+            result['rejected'].append({'index': index, 'driver_id': driver_id, 'reason': 'unknown_driver'})
+            continue
+        current = store.get(driver_id)
+        stored_at = known[driver_id]
+        if (current is not None and current[2] >= recorded_at) or (stored_at is not None and stored_at >= recorded_at):
+            result['rejected'].append({'index': index, 'driver_id': driver_id, 'reason': 'stale'})
+            continue
+        applied.append((driver_id, quantize_coordinate(latitude), quantize_coordinate(longitude), recorded_at))
+    if not applied:
+        return
+
+    with transaction.atomic():
+        bulk_update_positions(applied, batch_size=store.batch_size)
+    store.record_many(applied)
+    result['applied'] += len(applied)
+
+
+def ingest_positions(records, chunk_size=1000, max_records=None, store=None):
+    """
+    Apply an iterable of {driver_id, lat, lon, ts} records directly to
+    DriverProfile with set-based UPDATEs, one transaction per chunk of
+    chunk_size records.
+
+    Records may come from a lazily parsed stream; at most max_records are
+    read. Returns a summary with per-record rejects keyed by the record's
+    position in the input.
+    """
+    store = store or live_locations
+    result = {'received': 0, 'applied': 0, 'coalesced': 0, 'chunks': 0, 'truncated': False, 'rejected': []}
+    chunk = []
+    for index, record in enumerate(records):
+        if max_records is not None and index >= max_records:
+            result['truncated'] = True
+            break
+        result['received'] += 1
+        chunk.append((index, record))
+        if len(chunk) >= chunk_size:
+            _ingest_chunk(chunk, result, store)
+            result['chunks'] += 1
+            chunk = []
+    if chunk:
+        _ingest_chunk(chunk, result, store)
+        result['chunks'] += 1
+    return result
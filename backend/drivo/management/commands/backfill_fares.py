@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from drivo.bulk import bulk_update_columns
+from drivo.fares import price_ride_rows
+from drivo.models import Ride
+
+FARE_INPUT_FIELDS = (
+    'pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude',
+    'vehicle_type', 'fuel_type', 'trip_type',
+)
+
+
+class Command(BaseCommand):
+    help = "Compute Ride.fare for rides that have none (or all rides with --all), in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Re-price rides that already have a fare.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        queryset = Ride.objects.all()
+        if not options['all']:
+            queryset = queryset.filter(fare__isnull=True)
+        queryset = queryset.filter(
+            pickup_latitude__isnull=False, pickup_longitude__isnull=False,
+            dropoff_latitude__isnull=False, dropoff_longitude__isnull=False,
+        ).order_by('id')
+
+        batch_size = options['batch_size']
+        last_id = 0
+        updated = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id).values_list('id', *FARE_INPUT_FIELDS)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            fares = price_ride_rows([row[1:] for row in batch])
+            rows = [(row[0], fare) for row, fare in zip(batch, fares) if fare is not None]
+            with transaction.atomic():
+                bulk_update_columns(Ride, ('fare',), rows, batch_size=batch_size)
+            updated += len(rows)
+        self.stdout.write(f"Priced {updated} rides")
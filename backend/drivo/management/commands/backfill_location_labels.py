@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from drivo.bulk import bulk_update_columns
+from drivo.gazetteer import display_name, get_gazetteer
+from drivo.models import Ride
+
+
+class Command(BaseCommand):
+    help = "Fill empty Ride pickup/dropoff location labels from their coordinates, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument(
+            '--max-km', type=float, default=getattr(settings, 'REVERSE_GEOCODE_MAX_KM', 5),
+            help="Leave a label empty if no known place is this close."
+        )
+
+    def handle(self, *args, **options):
+        for prefix in ('pickup', 'dropoff'):
+            updated = self.backfill(prefix, options['batch_size'], options['max_km'])
+            self.stdout.write(f"Labelled {updated} {prefix} locations")
+
+    def backfill(self, prefix, batch_size, max_km):
+        gazetteer = get_gazetteer()
+        label_field = f'{prefix}_location'
+        queryset = Ride.objects.filter(
+            Q(**{label_field: ''}) | Q(**{f'{label_field}__isnull': True}),
+            **{f'{prefix}_latitude__isnull': False, f'{prefix}_longitude__isnull': False}
+        ).order_by('id')
+
+        last_id = 0
+        updated = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id).values_list(
+                'id', f'{prefix}_latitude', f'{prefix}_longitude'
+            )[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            place_ids, _ = gazetteer.nearest(
+                [float(row[1]) for row in batch], [float(row[2]) for row in batch], max_km
+            )
+            rows = [
+                (row[0], display_name(gazetteer.places[place_id]))
+                for row, place_id in zip(batch, place_ids.tolist()) if place_id >= 0
+            ]
+            if rows:
+                with transaction.atomic():
+                    bulk_update_columns(Ride, (label_field,), rows, batch_size=batch_size)
+            updated += len(rows)
+        return updated
@@ -0,0 +1,100 @@
+import io
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from drivo.models import ClientProfile, DriverProfile, Ride, User
+from drivo.parsers import ORJSONParser
+from drivo.renderers import ORJSONRenderer, orjson
+from drivo.serializers import DriverProfileSerializer, RideSerializer
+
+CITIES = ('Lahore', 'Karachi', 'Islamabad', 'Rawalpindi', 'Faisalabad', 'Multan')
+
+
+def _coordinate(rng, low, high):
+    return round(Decimal(str(rng.uniform(low, high))), 8)
+
+
+def make_drivers(count, rng):
+    now = timezone.now()
+    return [
+        DriverProfile(
+            id=i, user=User(id=i, email=f'driver{i}@example.com', is_driver=True, date_joined=now),
+            full_name=f'Driver {i}', cnic='35202-1234567-1', age=rng.randint(21, 60),
+            driving_license=f'LHR-{i:06d}', phone_number='03001234567', city=rng.choice(CITIES),
+            status='available', current_latitude=_coordinate(rng, 24, 34).quantize(Decimal('0.000001')),
+            current_longitude=_coordinate(rng, 67, 74).quantize(Decimal('0.000001')), last_location_update=now,
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def make_rides(count, rng):
+    now = timezone.now()
+    drivers = make_drivers(max(count // 4, 1), rng)
+    rides = []
+    for i in range(1, count + 1):
+        client = ClientProfile(
+            id=i, user=User(id=100000 + i, email=f'client{i}@example.com', is_client=True, date_joined=now),
+            full_name=f'Client {i}', phone_number='03211234567', address='House 12, Street 4, Gulberg',
+        )
+        rides.append(Ride(
+            id=i, client=client, driver=rng.choice(drivers), pickup_location='Liberty Market, Lahore',
+            dropoff_location='Allama Iqbal International Airport, Lahore',
+            pickup_latitude=_coordinate(rng, 31.4, 31.6), pickup_longitude=_coordinate(rng, 74.2, 74.4),
+            dropoff_latitude=_coordinate(rng, 31.4, 31.6), dropoff_longitude=_coordinate(rng, 74.2, 74.4),
+            scheduled_datetime=now, vehicle_type='car', fuel_type='petrol', trip_type='one-way',
+            fare=Decimal('845.50'), status='accepted', created_at=now,
+        ))
+    return rides
+
+
+def best_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+class Command(BaseCommand):
+    help = "Compare render and parse time and size of DRF's JSON renderer/parser with the orjson ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rides', type=int, default=500, help="Rides in the ride list payload.")
+        parser.add_argument('--drivers', type=int, default=500, help="Drivers in the driver list payload.")
+        parser.add_argument('--repeat', type=int, default=20, help="Runs per measurement; the best is reported.")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stderr.write("orjson is not installed; ORJSONRenderer falls back to the stdlib renderer")
+        rng = random.Random(options['seed'])
+        payloads = {
+            f"{options['rides']} rides": RideSerializer(make_rides(options['rides'], rng), many=True).data,
+            f"{options['drivers']} drivers": DriverProfileSerializer(
+                make_drivers(options['drivers'], rng), many=True
+            ).data,
+        }
+        repeat = options['repeat']
+        for name, data in payloads.items():
+            baseline = JSONRenderer().render(data)
+            fast = ORJSONRenderer().render(data)
+            if JSONParser().parse(io.BytesIO(baseline)) != ORJSONParser().parse(io.BytesIO(fast)):
+                self.stderr.write(f"{name}: renderers disagree")
+            render = [best_ms(lambda r=renderer: r.render(data), repeat) for renderer in (JSONRenderer(), ORJSONRenderer())]
+            parse = [
+                best_ms(lambda p=parser: p.parse(io.BytesIO(baseline)), repeat)
+                for parser in (JSONParser(), ORJSONParser())
+            ]
+            self.stdout.write(
+                f"{name}: render {render[0]:.2f}ms -> {render[1]:.2f}ms ({render[0] / render[1]:.1f}x), "
+                f"parse {parse[0]:.2f}ms -> {parse[1]:.2f}ms ({parse[0] / parse[1]:.1f}x), "
+                f"{len(baseline)} -> {len(fast)} bytes"
+            )
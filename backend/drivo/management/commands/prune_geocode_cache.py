@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from drivo.geocode_cache import geocode_cache
+
+
+class Command(BaseCommand):
+    help = "Delete persisted geocode results that are past their stale window."
+
+    def handle(self, *args, **options):
+        deleted = geocode_cache.prune()
+        self.stdout.write(f"Deleted {deleted} geocode cache entries")
@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from drivo.dispatch import DispatchEngine
+
+
+class Command(BaseCommand):
+    help = "Assign requested rides to nearby idle drivers in batches, one tick per interval."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=getattr(settings, 'DISPATCH_TICK_SECONDS', 2),
+            help="Seconds between ticks (the batching window)."
+        )
+        parser.add_argument('--once', action='store_true', help="Run a single tick and exit.")
+        parser.add_argument(
+            '--solver', choices=['auto', 'hungarian', 'greedy'], default=None,
+            help="Assignment solver; 'auto' uses Hungarian when scipy is installed."
+        )
+
+    def handle(self, *args, **options):
+        engine = DispatchEngine(solver=options['solver'])
+        while True:
+            close_old_connections()
+            metrics = engine.tick()
+            if 'skipped' in metrics:
+                self.stdout.write(f"skipped: {metrics['skipped']}")
+            else:
+                timings = metrics['timings']
+                self.stdout.write(
+                    f"{metrics['assigned']}/{metrics['rides']} rides assigned, "
+                    f"{metrics['drivers']} idle drivers, "
+                    f"pickup {metrics['total_pickup_km']} km total, solver={metrics['solver']}, "
+                    f"collect={timings['collect_ms']}ms solve={timings['solve_ms']}ms "
+                    f"persist={timings['persist_ms']}ms total={timings['total_ms']}ms"
+                )
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,167 @@
+"""
+Distance and ETA matrices between many origins and many destinations.
+
+Origins (usually drivers) x destinations (usually pickups) are computed
+with numpy broadcasting in row chunks of at most MATRIX_CHUNK_CELLS
+entries, so memory stays bounded however large N and M get. With a
+max_km cutoff each chunk only looks at destinations inside the chunk's
+bounding box grown by max_km, and pairs beyond the cutoff are np.inf.
+
+ETAs use per-city speed profiles from ETA_SPEED_PROFILES:
+road distance = great-circle distance * road_factor, travelled at the
+city's speed_kmh (peak_speed_kmh during peak_hours). Cities without a
+profile use the 'default' one.
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from drivo.geo import KM_PER_DEGREE_LAT, haversine_matrix
+
+DEFAULT_SPEED_PROFILES = {
+    'default': {'speed_kmh': 25, 'road_factor': 1.3},
+}
+
+# float64 entries per chunk; 2M entries is ~16 MB per intermediate array
+DEFAULT_CHUNK_CELLS = 2_000_000
+
+
+def speed_profile(city=None):
+    """The speed profile for a city name (case-insensitive), or the default profile."""
+    profiles = getattr(settings, 'ETA_SPEED_PROFILES', DEFAULT_SPEED_PROFILES)
+    key = (city or '').strip().lower()
+    return profiles.get(key) or profiles.get('default') or DEFAULT_SPEED_PROFILES['default']
+
+
+def profile_speed_kmh(profile, when=None):
+    """A profile's speed at the given time (now by default), honouring peak hours."""
+    hour = timezone.localtime(when).hour
+    if hour in profile.get('peak_hours', ()):
+        return profile.get('peak_speed_kmh', profile['speed_kmh'])
+    return profile['speed_kmh']
+
+
+def city_speeds(cities, when=None):
+    """Per-entry (speed_kmh, road_factor) arrays for a sequence of city names."""
+    keys = np.array([(city or '').strip().lower() for city in cities])
+    if keys.size == 0:
+        return np.empty(0), np.empty(0)
+    distinct, inverse = np.unique(keys, return_inverse=True)
+    profiles = [speed_profile(city) for city in distinct]
+    speeds = np.array([profile_speed_kmh(profile, when) for profile in profiles], dtype=np.float64)
+    factors = np.array([profile.get('road_factor', 1.0) for profile in profiles], dtype=np.float64)
+    return speeds[inverse], factors[inverse]
+
+
+def eta_minutes(distance_km, speed_kmh, road_factor=1.0):
+    """Travel time in minutes for great-circle distances; broadcasts over arrays."""
+    return np.asarray(distance_km, dtype=np.float64) * road_factor / speed_kmh * 60.0
+
+
+def bounding_box_mask(lats, lons, box_lats, box_lons, max_km):
+    """Mask of the points (lats, lons) within the bounding box of (box_lats, box_lons) grown by max_km."""
+    lat_pad = max_km / KM_PER_DEGREE_LAT
+    # Longitude degrees shrink towards the poles; pad for the widest case
+    edge_lat = min(89.0, float(np.abs(box_lats).max()) + lat_pad)
+    lon_pad = max_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(edge_lat)), 1e-6))
+    return (
+        (lats >= box_lats.min() - lat_pad)
+        & (lats <= box_lats.max() + lat_pad)
+        & (lons >= box_lons.min() - lon_pad)
+        & (lons <= box_lons.max() + lon_pad)
+    )
+
+
+def _as_arrays(*values):
+    return [np.asarray(value, dtype=np.float64) for value in values]
+
+
+def iter_distance_blocks(origin_lats, origin_lons, dest_lats, dest_lons, max_km=None, chunk_cells=None):
+    """
+    Yield (start, stop, cols, distances) for consecutive chunks of origins.
+
+    distances has shape (stop - start, len(cols)) and holds the distances
+    from origins[start:stop] to destinations[cols]. Without max_km, cols is
+    every destination; with it, only destinations that passed the chunk's
+    bounding-box prefilter, and distances over max_km are np.inf.
+    """
+    origin_lats, origin_lons, dest_lats, dest_lons = _as_arrays(origin_lats, origin_lons, dest_lats, dest_lons)
+    n_origins, n_dests = len(origin_lats), len(dest_lats)
+    if n_origins == 0:
+        return
+    chunk_cells = chunk_cells or getattr(settings, 'MATRIX_CHUNK_CELLS', DEFAULT_CHUNK_CELLS)
+    rows_per_chunk = max(1, chunk_cells // max(n_dests, 1))
+    all_cols = np.arange(n_dests)
+
+    for start in range(0, n_origins, rows_per_chunk):
+        stop = min(start + rows_per_chunk, n_origins)
+        lats, lons = origin_lats[start:stop], origin_lons[start:stop]
+        if max_km is None or n_dests == 0:
+            cols = all_cols
+        else:
+            cols = np.flatnonzero(bounding_box_mask(dest_lats, dest_lons, lats, lons, max_km))
+        if cols.size == 0:
+            yield start, stop, cols, np.empty((stop - start, 0))
+            continue
+        distances = haversine_matrix(lats, lons, dest_lats[cols], dest_lons[cols])
+        if max_km is not None:
+            distances[distances > max_km] = np.inf
+        yield start, stop, cols, distances
+
+
+def distance_matrix(origin_lats, origin_lons, dest_lats, dest_lons, max_km=None, chunk_cells=None):
+    """Dense (N, M) great-circle distances in km; np.inf beyond max_km."""
+    result = np.full((len(origin_lats), len(dest_lats)), np.inf)
+    for start, stop, cols, distances in iter_distance_blocks(
+        origin_lats, origin_lons, dest_lats, dest_lons, max_km, chunk_cells
+    ):
+        result[start:stop, cols] = distances
+    return result
+
+
+def eta_matrix(origin_lats, origin_lons, dest_lats, dest_lons, origin_cities=None,
+               max_km=None, when=None, chunk_cells=None):
+    """
+    Dense (N, M) distance (km) and ETA (minutes) matrices. Each origin
+    travels at the speed profile of its city in origin_cities (the default
+    profile when omitted); pairs beyond max_km are np.inf in both.
+    """
+    distances = distance_matrix(origin_lats, origin_lons, dest_lats, dest_lons, max_km, chunk_cells)
+    if origin_cities is None:
+        profile = speed_profile()
+        speeds = np.float64(profile_speed_kmh(profile, when))
+        factors = np.float64(profile.get('road_factor', 1.0))
+    else:
+        speeds, factors = city_speeds(origin_cities, when)
+        speeds, factors = speeds[:, None], factors[:, None]
+    return distances, eta_minutes(distances, speeds, factors)
+
+
+def nearest_k(origin_lats, origin_lons, dest_lats, dest_lons, k, max_km=None, chunk_cells=None):
+    """
+    For every origin, the indices and distances of its k nearest
+    destinations (within max_km), closest first. Returns (cols, distances)
+    of shape (N, min(k, M)); missing neighbours are -1 / np.inf.
+    """
+    n_origins = len(origin_lats)
+    k = min(k, len(dest_lats))
+    cols_out = np.full((n_origins, k), -1, dtype=np.int64)
+    dist_out = np.full((n_origins, k), np.inf)
+    if k == 0:
+        return cols_out, dist_out
+    for start, stop, cols, distances in iter_distance_blocks(
+        origin_lats, origin_lons, dest_lats, dest_lons, max_km, chunk_cells
+    ):
+        kk = min(k, cols.size)
+        if kk == 0:
+            continue
+        nearest = np.argpartition(distances, kk - 1, axis=1)[:, :kk]
+        nearest_dist = np.take_along_axis(distances, nearest, axis=1)
+        order = np.argsort(nearest_dist, axis=1)
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        nearest_dist = np.take_along_axis(nearest_dist, order, axis=1)
+        cols_out[start:stop, :kk] = np.where(np.isfinite(nearest_dist), cols[nearest], -1)
+        dist_out[start:stop, :kk] = nearest_dist
+    return cols_out, dist_out
@@ -0,0 +1,57 @@
+"""
+Prometheus text exposition of this worker's cache counters
+(drivo.cache_backends.InstrumentedCache), served at metrics/.
+"""
+from drivo.cache_backends import cache_stats
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# (metric, type, help, stats field)
+CACHE_COUNTERS = (
+    ('drivo_cache_hits_total', 'counter', 'Cache lookups that found a value.', 'hits'),
+    ('drivo_cache_misses_total', 'counter', 'Cache lookups that found nothing.', 'misses'),
+    ('drivo_cache_sets_total', 'counter', 'Values written to the cache.', 'sets'),
+    ('drivo_cache_deletes_total', 'counter', 'Cache deletes.', 'deletes'),
+    ('drivo_cache_evictions_total', 'counter', 'Values evicted to stay within the cache size.', 'evictions'),
+    ('drivo_cache_written_bytes_total', 'counter', 'Approximate bytes written to the cache.', 'bytes_written'),
+    ('drivo_cache_rejected_total', 'counter', 'Values larger than their namespace budget.', 'rejected'),
+    ('drivo_cache_stored_bytes', 'gauge', 'Bytes currently held in the cache.', 'stored_bytes'),
+    ('drivo_cache_entries', 'gauge', 'Entries currently held in the cache.', 'entries'),
+    ('drivo_cache_budget_bytes', 'gauge', 'Configured byte budget.', 'budget_bytes'),
+)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(alias='default'):
+    stats = cache_stats(alias)
+    if stats is None:
+        return ''
+    lines = []
+    for metric, kind, help_text, field in CACHE_COUNTERS:
+        samples = [
+            (namespace, values[field]) for namespace, values in stats.items() if values.get(field) is not None
+        ]
+        if not samples:
+            continue
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {kind}']
+        lines += [
+            f'{metric}{{cache="{_escape(alias)}",namespace="{_escape(namespace)}"}} {value}'
+            for namespace, value in samples
+        ]
+
+    lines += [
+        '# HELP drivo_cache_operation_seconds Time spent in cache operations.',
+        '# TYPE drivo_cache_operation_seconds summary',
+    ]
+    for namespace, values in stats.items():
+        for op in ('get', 'set'):
+            latency = values[f'{op}_latency_us']
+            if not latency['calls']:
+                continue
+            labels = f'cache="{_escape(alias)}",namespace="{_escape(namespace)}",op="{op}"'
+            lines.append(f'drivo_cache_operation_seconds_sum{{{labels}}} {latency["total"] / 1e6:.6f}')
+            lines.append(f'drivo_cache_operation_seconds_count{{{labels}}} {latency["calls"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drivo', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationTrace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('recorded_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='location_traces', to='drivo.driverprofile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('driver', 'recorded_at'), name='unique_driver_trace_point')],
+            },
+        ),
+    ]
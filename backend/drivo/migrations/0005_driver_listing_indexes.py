@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drivo', '0004_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='driverprofile',
+            index=models.Index(fields=['status', 'city'], name='driver_status_city_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='driverprofile',
+            index=models.Index(fields=['city'], name='driver_city_idx'),
+        ),
+    ]
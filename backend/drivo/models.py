@@ -42,9 +42,34 @@ class DriverProfile(models.Model):
     current_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     current_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     last_location_update = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            # Available-drivers listing filters on status and/or city and pages by id
+            models.Index(fields=['status', 'city'], name='driver_status_city_idx'),
+            models.Index(fields=['city'], name='driver_city_idx'),
+        ]
+    
     def __str__(self):
         return self.full_name or "DriverProfile"
 
+class LocationTrace(models.Model):
+    """GPS points uploaded in batches by drivers, kept as route history."""
+    driver = models.ForeignKey(DriverProfile, on_delete=models.CASCADE, related_name='location_traces')
+    latitude = models.DecimalField(max_digits=9, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    recorded_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            # Also serves as the (driver, recorded_at) index for watermark lookups
+            models.UniqueConstraint(fields=['driver', 'recorded_at'], name='unique_driver_trace_point'),
+        ]
+    
+    def __str__(self):
+        return f"Trace {self.driver_id} @ {self.recorded_at}"
+
 class ClientProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='client_profile')
     full_name = models.CharField(max_length=100, blank=True, null=True)
@@ -104,6 +129,12 @@ class Ride(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            # Keyset pagination (drivo.pagination) walks (created_at, id) newest first
+            models.Index(fields=['-created_at', '-id'], name='ride_keyset_idx'),
+        ]
+    
     def __str__(self):
         return f"Ride {self.id} - {self.pickup_location} to {self.dropoff_location}"
 
@@ -124,6 +155,12 @@ class Payment(models.Model):
     ], default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            # Keyset pagination (drivo.pagination) walks (created_at, id) newest first
+            models.Index(fields=['-created_at', '-id'], name='payment_keyset_idx'),
+        ]
+    
     def __str__(self):
         return f"Payment {self.id} - {self.amount} PKR"
 
@@ -135,6 +172,12 @@ class Review(models.Model):
     comment = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            # Keyset pagination (drivo.pagination) walks (created_at, id) newest first
+            models.Index(fields=['-created_at', '-id'], name='review_keyset_idx'),
+        ]
+    
     def __str__(self):
         return f"Review by {self.client.full_name or 'Unknown'} - {self.rating} stars"
 
@@ -148,4 +191,21 @@ class EmailOTP(models.Model):
         return timezone.now() > self.created_at + datetime.timedelta(minutes=5)
     
     def __str__(self):
-        return f"OTP for {self.email} - {'Used' if self.is_used else 'Active'}"
\ No newline at end of file
+        return f"OTP for {self.email} - {'Used' if self.is_used else 'Active'}"
+class GeocodeCacheEntry(models.Model):
+    """Durable tier of the geocode cache (drivo.geocode_cache), shared by all workers."""
+    key = models.CharField(max_length=255, unique=True)
+    query = models.CharField(max_length=255)
+    payload = models.JSONField()
+    expires_at = models.DateTimeField(db_index=True)
+    hits = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            # Warm start loads the most requested entries
+            models.Index(fields=['-hits'], name='geocode_cache_hits_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Geocode {self.query}"
@@ -0,0 +1,269 @@
+"""
+Pooled, rate-limited client for the Nominatim geocoding API.
+
+* One requests.Session per client keeps connections alive and pooled, so
+  a call does not pay a fresh TCP + TLS handshake.
+* A token bucket whose state lives in the shared cache
+  (drivo.cache_backends.shared_cache) enforces the usage policy
+  (1 request/second by default) across all workers.
+* At most max_queue callers wait for a token at once, and each waits only
+  until its deadline; callers beyond that fail fast.
+* A circuit breaker opens after consecutive failures so callers go
+  straight to their local fallbacks, then lets a single trial call through
+  after a cooldown.
+* Call latencies are recorded in a fixed-bucket histogram.
+
+Calls that cannot be made or fail raise a GeocodingUnavailable subclass.
+"""
+import bisect
+import threading
+import time
+from collections import Counter
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from drivo.cache_backends import shared_cache
+
+NOMINATIM_URL = 'https://nominatim.openstreetmap.org'
+USER_AGENT = 'Drivo/1.0 (gdooduii@gmail.com)'
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class GeocodingUnavailable(Exception):
+    """The upstream geocoder could not answer; use a local fallback."""
+
+
+class QueueFull(GeocodingUnavailable):
+    pass
+
+
+class DeadlineExceeded(GeocodingUnavailable):
+    pass
+
+
+class CircuitOpen(GeocodingUnavailable):
+    pass
+
+
+class UpstreamError(GeocodingUnavailable):
+    pass
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second up to `capacity`.
+
+    With shared=True the bucket state lives in the shared cache under
+    ratelimit_<name> and is updated under a short cache.add lock, so every
+    worker draws from the same bucket.
+    """
+
+    def __init__(self, name, rate, capacity=1, shared=True):
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.shared = shared
+        self._state_key = f'ratelimit_{name}'
+        self._lock_key = f'ratelimit_{name}_lock'
+        self._local_lock = threading.Lock()
+        self._local_state = None
+
+    def _take(self, now):
+        """Take a token if one is available. Returns 0 on success or seconds until the next token."""
+        state = shared_cache().get(self._state_key) if self.shared else self._local_state
+        tokens, updated_at = state if state is not None else (self.capacity, now)
+        tokens = min(self.capacity, tokens + max(0.0, now - updated_at) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / self.rate
+        if self.shared:
+            shared_cache().set(self._state_key, (tokens, now), timeout=max(60, int(self.capacity / self.rate) + 1))
+        else:
+            self._local_state = (tokens, now)
+        return wait
+
+    def try_acquire(self):
+        with self._local_lock:
+            if not self.shared:
+                return self._take(time.time())
+            cache = shared_cache()
+            if not cache.add(self._lock_key, True, timeout=1):
+                # Another worker is updating the bucket
+                return 0.01
+            try:
+                return self._take(time.time())
+            finally:
+                cache.delete(self._lock_key)
+
+    def acquire(self, deadline):
+        """Wait for a token until the monotonic deadline. Returns False if it passed first."""
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures. While open, calls
+    are refused for `reset_timeout` seconds; then one trial call is allowed
+    (half-open) and its outcome closes or re-opens the circuit. A trial
+    that reports nothing within another reset_timeout is replaced.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.opened_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class LatencyHistogram:
+    def __init__(self, buckets_ms=LATENCY_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+        self.total_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_ms):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets_ms, elapsed_ms)] += 1
+            self.total_ms += elapsed_ms
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self.counts)
+            total_ms = self.total_ms
+        labels = [f'le_{bound}ms' for bound in self.buckets_ms] + ['inf']
+        calls = sum(counts)
+        return {
+            'buckets': dict(zip(labels, counts)),
+            'count': calls,
+            'mean_ms': round(total_ms / calls, 2) if calls else None,
+        }
+
+
+class NominatimClient:
+    def __init__(self, base_url=NOMINATIM_URL, rate=1.0, burst=1, timeout=5, deadline=8,
+                 max_queue=16, pool_size=4, failure_threshold=5, reset_timeout=30, shared_rate_limit=True):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.deadline = deadline
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.limiter = TokenBucket('nominatim', rate, burst, shared=shared_rate_limit)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latency = LatencyHistogram()
+        self._queue = threading.BoundedSemaphore(max_queue)
+        self._counters = Counter()
+        self._counters_lock = threading.Lock()
+
+    def _count(self, outcome):
+        with self._counters_lock:
+            self._counters[outcome] += 1
+
+    def stats(self):
+        with self._counters_lock:
+            outcomes = dict(self._counters)
+        return {
+            'outcomes': outcomes,
+            'circuit': self.breaker.state,
+            'latency': self.latency.snapshot(),
+        }
+
+    def get(self, path, params, deadline=None):
+        """GET base_url/path and return the decoded JSON, within `deadline` seconds overall."""
+        if not self.breaker.allow():
+            self._count('circuit_open')
+            raise CircuitOpen("Geocoding upstream is unavailable")
+        if not self._queue.acquire(blocking=False):
+            self._count('queue_full')
+            raise QueueFull("Too many geocoding requests waiting")
+        try:
+            expires = time.monotonic() + (deadline or self.deadline)
+            if not self.limiter.acquire(expires):
+                self._count('deadline_exceeded')
+                raise DeadlineExceeded("Timed out waiting for the geocoding rate limit")
+            started = time.monotonic()
+            # Connection errors, timeouts, 5xx and 429 mean the upstream is degraded
+            degraded = True
+            try:
+                response = self.session.get(
+                    f'{self.base_url}/{path.lstrip("/")}', params=params,
+                    timeout=max(0.1, min(self.timeout, expires - started)),
+                )
+                degraded = response.status_code >= 500 or response.status_code == 429
+                response.raise_for_status()
+                data = response.json()
+            except (requests.RequestException, ValueError) as e:
+                self.latency.observe((time.monotonic() - started) * 1000)
+                if degraded:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                self._count('error')
+                raise UpstreamError(str(e)) from e
+            self.latency.observe((time.monotonic() - started) * 1000)
+            self.breaker.record_success()
+            self._count('ok')
+            return data
+        finally:
+            self._queue.release()
+
+    def search(self, params, deadline=None):
+        return self.get('search', dict(params, format='json'), deadline)
+
+    def reverse(self, params, deadline=None):
+        return self.get('reverse', dict(params, format='json'), deadline)
+
+
+nominatim = NominatimClient(
+    base_url=getattr(settings, 'NOMINATIM_URL', NOMINATIM_URL),
+    rate=getattr(settings, 'NOMINATIM_RATE_PER_SECOND', 1.0),
+    burst=getattr(settings, 'NOMINATIM_BURST', 1),
+    timeout=getattr(settings, 'NOMINATIM_TIMEOUT_SECONDS', 5),
+    deadline=getattr(settings, 'NOMINATIM_DEADLINE_SECONDS', 8),
+    max_queue=getattr(settings, 'NOMINATIM_MAX_QUEUE', 16),
+    pool_size=getattr(settings, 'NOMINATIM_POOL_SIZE', 4),
+    failure_threshold=getattr(settings, 'NOMINATIM_BREAKER_FAILURES', 5),
+    reset_timeout=getattr(settings, 'NOMINATIM_BREAKER_RESET_SECONDS', 30),
+)
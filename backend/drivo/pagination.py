@@ -0,0 +1,202 @@
+"""
+Keyset (cursor) pagination, by default on (created_at, id), newest first.
+
+Each page is one indexed range query: WHERE (created_at, id) < cursor
+ORDER BY created_at DESC, id DESC LIMIT page_size + 1. There is no
+COUNT(*) and no OFFSET, so page 10,000 costs the same as page 1, and rows
+inserted while a client pages do not shift or repeat later pages.
+
+Cursors are opaque to clients. Pass ?total=1 for an approximate row count
+taken from table statistics (MySQL, PostgreSQL) or a briefly cached
+COUNT(*). A view that already knows its total sets a `total` attribute,
+which is reported instead and costs no query.
+"""
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def _table_estimate(model):
+    """Row estimate from the database's table statistics, or None."""
+    table = model._meta.db_table
+    if connection.vendor == 'mysql':
+        sql = 'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s'
+    elif connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s'
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    # reltuples is -1 for tables that have never been analyzed
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+def approximate_count(queryset):
+    """
+    Approximate number of rows in queryset: table statistics for an
+    unfiltered queryset, otherwise its COUNT(*) cached for
+    APPROXIMATE_COUNT_TIMEOUT seconds.
+    """
+    model = queryset.model
+    filtered = bool(queryset.query.where)
+    if filtered:
+        digest = hashlib.sha1(str(queryset.query).encode()).hexdigest()
+        key = f'approx_count_{model._meta.db_table}_{digest}'
+    else:
+        key = f'approx_count_{model._meta.db_table}'
+    count = cache.get(key)
+    if count is None:
+        count = None if filtered else _table_estimate(model)
+        if count is None:
+            count = queryset.count()
+        cache.set(key, count, getattr(settings, 'APPROXIMATE_COUNT_TIMEOUT', 60))
+    return count
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opaque-cursor pagination over the `keys` columns, newest (descending)
+    first by default. The keys must end in a unique column and be backed by
+    a matching index on each paginated model.
+    """
+    keys = ('created_at', 'id')
+    descending = True
+    results_key = 'results'
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    total_query_param = 'total'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        position, reverse = self.decode_cursor(request, queryset.model)
+        self.total = getattr(view, 'total', None)
+        if self.total is None and request.query_params.get(self.total_query_param) in ('1', 'true'):
+            self.total = approximate_count(queryset)
+
+        # Walking backwards flips the comparison and the ordering
+        descending = self.descending != reverse
+        if position is not None:
+            queryset = queryset.filter(self.after(position, descending))
+        # The cursor is built from the keys, so keep them out of any deferral
+        immediate, deferred = queryset.query.deferred_loading
+        if immediate and not deferred:
+            queryset = queryset.only(*immediate, *self.keys)
+        ordering = [f'-{key}' if descending else key for key in self.keys]
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        # Walking backwards, more rows means an earlier page exists; the page
+        # we came from is always a later one
+        if reverse:
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = position is not None, has_more
+        self.page = rows
+        return rows
+
+    def after(self, position, descending):
+        """Rows past position in key order: (a, b) < (x, y) as a < x OR (a = x AND b < y)."""
+        lookup = 'lt' if descending else 'gt'
+        condition = Q()
+        for i, key in enumerate(self.keys):
+            condition |= Q(**dict(zip(self.keys[:i], position[:i])), **{f'{key}__{lookup}': position[i]})
+        return condition
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(size, self.max_page_size) if size > 0 else self.page_size
+
+    def decode_cursor(self, request, model):
+        """(key values, reverse) from the cursor parameter, or (None, False)."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            direction, *values = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            if direction not in ('n', 'p') or len(values) != len(self.keys):
+                raise ValueError(direction)
+            position = tuple(
+                model._meta.get_field(key).to_python(value) for key, value in zip(self.keys, values)
+            )
+        except (TypeError, ValueError, UnicodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, direction == 'p'
+
+    def encode_cursor(self, row, reverse):
+        # isoformat() keeps microseconds, which DjangoJSONEncoder would drop
+        values = [getattr(row, key) for key in self.keys]
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        raw = json.dumps(['p' if reverse else 'n', *values], separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(raw.encode()).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        payload = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            (self.results_key, data),
+        ])
+        if self.total is not None:
+            payload['count'] = self.total
+            payload.move_to_end('count', last=False)
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer', 'description': 'Approximate total, only with ?total=1'},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class DriverFeedPagination(KeysetPagination):
+    """Driver listings by id, oldest profile first, under 'drivers'."""
+    keys = ('id',)
+    descending = False
+    results_key = 'drivers'
@@ -0,0 +1,22 @@
+import hmac
+
+from django.conf import settings
+from rest_framework.permissions import BasePermission
+
+
+class HasIngestToken(BasePermission):
+    """
+    Allows service clients (telematics gateway, load simulator) that send
+    one of settings.LOCATION_INGEST_TOKENS in the X-Ingest-Token header.
+    """
+    message = "A valid X-Ingest-Token header is required."
+
+    def has_permission(self, request, view):
+        provided = request.headers.get('X-Ingest-Token', '')
+        if not provided:
+            return False
+        return any(
+            hmac.compare_digest(provided, token)
+            for token in getattr(settings, 'LOCATION_INGEST_TOKENS', ())
+            if token
+        )
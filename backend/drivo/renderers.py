@@ -0,0 +1,91 @@
+"""
+orjson-backed drop-in for DRF's JSONRenderer, and a MessagePack renderer
+for the high-frequency mobile endpoints.
+
+Output matches JSONRenderer: Decimals (RideSerializer's coordinates are
+coerce_to_string=False) render as numbers, datetimes, numpy values and
+lazy strings go through DRF's JSONEncoder, non-string dict keys are
+stringified and U+2028/U+2029 are escaped. Requests for indented output
+(the browsable API, `Accept: application/json; indent=4`),
+UNICODE_JSON = False and COMPACT_JSON = False fall back to the stdlib
+renderer, as does everything when orjson is not installed.
+"""
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; without it only JSON is offered
+    msgpack = None
+
+# Types orjson would otherwise serialize itself, differently from DRF
+ORJSON_OPTIONS = (
+    orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+    if orjson is not None else 0
+)
+
+
+class ORJSONRenderer(JSONRenderer):
+    encoder_class = encoders.JSONEncoder
+
+    def __init__(self):
+        self._default = self.encoder_class().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (orjson is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {})):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=self._default, option=ORJSON_OPTIONS)
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Renders the same values as the JSON renderers, as MessagePack: Decimals
+    become floats and datetimes ISO 8601 strings via DRF's JSONEncoder.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    encoder_class = encoders.JSONEncoder
+
+    def __init__(self):
+        self._default = self.encoder_class().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=self._default, use_bin_type=True)
+
+
+class MessagePackMixin:
+    """
+    View mixin that also accepts and returns application/msgpack, chosen
+    by Content-Type and Accept. JSON stays the default for clients that do
+    not ask for MessagePack.
+    """
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if msgpack is not None:
+            renderers.append(MessagePackRenderer())
+        return renderers
+
+    def get_parsers(self):
+        from drivo.parsers import MessagePackParser
+
+        parsers = super().get_parsers()
+        if msgpack is not None:
+            parsers.append(MessagePackParser())
+        return parsers
@@ -0,0 +1,107 @@
+"""
+Single-flight request coalescing.
+
+When many requests miss the cache for the same key at once, only one of
+them should compute the value. Within a worker, concurrent callers for a
+key share one in-flight call. Across workers, the caller that computes
+holds a short lock in the shared cache (drivo.cache_backends.shared_cache;
+cache.add is atomic on every backend), and callers in other workers poll
+lookup() for the result instead of computing it again.
+"""
+import threading
+import time
+from collections import Counter
+
+from drivo.cache_backends import shared_cache
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent computations of the same key.
+
+    run(key, compute, lookup) returns compute()'s value. compute() must
+    store its result where lookup() can find it (usually the cache), and
+    lookup() returns that result or None. Counters are kept per process.
+    """
+
+    def __init__(self, name, lock_timeout=10, wait_timeout=10, poll_interval=0.05):
+        self.name = name
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._counters = Counter()
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['in_flight'] = len(self._calls)
+        return stats
+
+    def run(self, key, compute, lookup):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._counters['coalesced'] += 1
+        if not leader:
+            if not call.done.wait(self.wait_timeout + self.lock_timeout):
+                self._count('wait_timeouts')
+                return compute()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = self._run_across_workers(key, compute, lookup)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.value
+
+    def _run_across_workers(self, key, compute, lookup):
+        cache = shared_cache()
+        lock_key = f'singleflight_{self.name}_{key}'
+        if cache.add(lock_key, True, timeout=self.lock_timeout):
+            self._count('computed')
+            try:
+                return compute()
+            finally:
+                cache.delete(lock_key)
+
+        # Another worker is computing; wait for its result to land
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            value = lookup()
+            if value is not None:
+                self._count('coalesced_remote')
+                return value
+            if cache.get(lock_key) is None:
+                break
+        value = lookup()
+        if value is not None:
+            self._count('coalesced_remote')
+            return value
+        # The other worker gave up or finished without storing a result
+        self._count('computed')
+        self._count('lock_fallbacks')
+        return compute()
@@ -0,0 +1,1720 @@
+import datetime
+import io
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import msgpack
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from drivo import autocomplete, geocoding
+from drivo.autocomplete import AutocompleteIndex, compute_popularity, get_autocomplete_index
+from drivo.cache_backends import InstrumentedCache, NamespaceResolver, SizedLRUCache, shared_cache
+from drivo.conditional import USERS_VERSION_KEY, users_version
+from drivo.dispatch import (
+    UNREACHABLE, DispatchEngine, assign_rides, greedy_assignment, improve_assignment, solve_assignment,
+)
+from drivo.fares import compute_fares, estimate_fare, price_ride_rows, quote_matrix
+from drivo.gazetteer import Gazetteer, Place
+from drivo.geo import GridIndex, driver_index, haversine_km
+from drivo.geocode_cache import GeocodeCache, LRUCache
+from drivo.live_location import LiveLocationStore, bulk_update_positions, ingest_positions
+from drivo.management.commands import backfill_location_labels
+from drivo.matrix import city_speeds, distance_matrix, eta_matrix, iter_distance_blocks, nearest_k
+from drivo.models import (
+    ClientProfile, DriverProfile, GeocodeCacheEntry, LocationTrace, Payment, Review, Ride, User,
+)
+from drivo.nominatim import (
+    CircuitBreaker, CircuitOpen, DeadlineExceeded, NominatimClient, QueueFull, TokenBucket, UpstreamError,
+)
+from drivo.parsers import ORJSONParser
+from drivo.singleflight import SingleFlight
+from drivo.renderers import ORJSONRenderer
+
+
+class StubNominatimHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep connections alive between requests
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.connections.add(self.client_address)
+        if server.delay:
+            time.sleep(server.delay)
+        body = json.dumps(server.payload).encode()
+        self.send_response(server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up (deadline tests)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubNominatimServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubNominatimHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.connections = set()
+        self.status = 200
+        self.delay = 0
+        self.payload = [{'lat': '31.5204', 'lon': '74.3587', 'display_name': 'Lahore, Pakistan'}]
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+# Threads share a LocMemCache as worker processes share the database cache;
+# the in-memory SQLite test database rejects concurrent writers
+IN_PROCESS_SHARED_CACHES = {
+    **settings.CACHES,
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'drivo-tests-shared'},
+}
+
+
+class NominatimStubMixin:
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = StubNominatimServer()
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        caches['shared'].clear()
+        self.server.requests.clear()
+        self.server.connections.clear()
+        self.server.status = 200
+        self.server.delay = 0
+
+    def make_client(self, **kwargs):
+        options = {'rate': 1000, 'burst': 1000, 'timeout': 2, 'deadline': 2, 'reset_timeout': 60}
+        options.update(kwargs)
+        client = NominatimClient(base_url=self.server.url, **options)
+        self.addCleanup(client.session.close)
+        return client
+
+
+@override_settings(CACHES=IN_PROCESS_SHARED_CACHES)
+class NominatimClientTests(NominatimStubMixin, SimpleTestCase):
+    def test_search_reuses_pooled_connection(self):
+        client = self.make_client()
+        for _ in range(5):
+            self.assertEqual(client.search({'q': 'lahore'})[0]['display_name'], 'Lahore, Pakistan')
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertIn('format=json', self.server.requests[0])
+        self.assertEqual(len(self.server.connections), 1)
+        self.assertEqual(client.stats()['outcomes'], {'ok': 5})
+
+    def test_rate_limit_spaces_requests(self):
+        client = self.make_client(rate=20, burst=1)
+        started = time.monotonic()
+        for _ in range(4):
+            client.search({'q': 'lahore'})
+        # The first token is available immediately, the other three 50 ms apart
+        self.assertGreaterEqual(time.monotonic() - started, 0.14)
+
+    def test_rate_limit_is_shared_between_clients(self):
+        first = self.make_client(rate=0.5, burst=1)
+        second = self.make_client(rate=0.5, burst=1)
+        first.search({'q': 'lahore'})
+        with self.assertRaises(DeadlineExceeded):
+            second.search({'q': 'lahore'}, deadline=0.2)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_deadline_bounds_slow_upstream(self):
+        self.server.delay = 0.5
+        client = self.make_client(deadline=0.2)
+        started = time.monotonic()
+        with self.assertRaises(UpstreamError):
+            client.search({'q': 'lahore'})
+        self.assertLess(time.monotonic() - started, 0.45)
+
+    def test_queue_full_fails_fast(self):
+        client = self.make_client(rate=2, burst=1, max_queue=1)
+        client.search({'q': 'lahore'})
+        # Holds the only queue slot while it waits ~0.5 s for a token
+        waiting = threading.Thread(target=client.search, args=({'q': 'lahore'},))
+        waiting.start()
+        time.sleep(0.1)
+        started = time.monotonic()
+        with self.assertRaises(QueueFull):
+            client.search({'q': 'lahore'})
+        self.assertLess(time.monotonic() - started, 0.1)
+        waiting.join()
+        self.assertEqual(client.stats()['outcomes']['queue_full'], 1)
+
+    def test_circuit_opens_after_failures_and_recovers(self):
+        self.server.status = 503
+        client = self.make_client(failure_threshold=3, reset_timeout=0.2)
+        for _ in range(3):
+            with self.assertRaises(UpstreamError):
+                client.search({'q': 'lahore'})
+        with self.assertRaises(CircuitOpen):
+            client.search({'q': 'lahore'})
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(client.stats()['circuit'], CircuitBreaker.OPEN)
+
+        self.server.status = 200
+        time.sleep(0.25)
+        self.assertTrue(client.search({'q': 'lahore'}))
+        self.assertEqual(client.stats()['circuit'], CircuitBreaker.CLOSED)
+
+    def test_client_errors_do_not_open_circuit(self):
+        self.server.status = 400
+        client = self.make_client(failure_threshold=2)
+        for _ in range(3):
+            with self.assertRaises(UpstreamError):
+                client.search({'q': 'lahore'})
+        self.assertEqual(client.stats()['circuit'], CircuitBreaker.CLOSED)
+
+    def test_latency_histogram(self):
+        self.server.delay = 0.06
+        client = self.make_client()
+        client.search({'q': 'lahore'})
+        client.search({'q': 'lahore'})
+        latency = client.stats()['latency']
+        self.assertEqual(latency['count'], 2)
+        self.assertEqual(latency['buckets']['le_100ms'] + latency['buckets']['le_250ms'], 2)
+        self.assertGreaterEqual(latency['mean_ms'], 60)
+
+
+@override_settings(CACHES=IN_PROCESS_SHARED_CACHES)
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        caches['shared'].clear()
+
+    def test_burst_then_refill(self):
+        bucket = TokenBucket('test', rate=10, capacity=2)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertEqual(bucket.try_acquire(), 0)
+        wait = bucket.try_acquire()
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.1)
+        time.sleep(wait)
+        self.assertEqual(bucket.try_acquire(), 0)
+
+
+class GeocodeTestCase(NominatimStubMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.geocode_cache = GeocodeCache(warm_entries=0)
+        patcher = mock.patch.object(geocoding, 'geocode_cache', self.geocode_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class GeocodeFallbackTests(GeocodeTestCase):
+    def test_open_circuit_falls_back_to_gazetteer(self):
+        self.server.status = 503
+        client = self.make_client(failure_threshold=1)
+        with mock.patch.object(geocoding, 'nominatim', client):
+            payload = geocoding.geocode('House 12, Street 4, Gulberg, Lahore')
+            self.assertEqual(payload[0]['source'], 'gazetteer')
+            payload = geocoding.geocode('House 14, Street 4, Gulberg, Lahore')
+            self.assertEqual(payload[0]['source'], 'gazetteer')
+        # The second query never reached the upstream
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(client.stats()['outcomes']['circuit_open'], 1)
+
+    def test_refused_requests_are_not_cached(self):
+        client = self.make_client(failure_threshold=1)
+        client.breaker.record_failure()
+        with mock.patch.object(geocoding, 'nominatim', client):
+            payload = geocoding.geocode('zzz unknown place qqq')
+        self.assertIn('error', payload)
+        self.assertIsNone(self.geocode_cache.get(geocoding.geocode_cache_key('zzz unknown place qqq')))
+
+
+class GeocodeDetailTests(GeocodeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server.payload = [{
+            'place_id': 1, 'lat': '31.5204', 'lon': '74.3587', 'display_name': 'Lahore, Pakistan',
+            'type': 'city', 'address': {'city': 'Lahore', 'country': 'Pakistan'},
+            'extratags': {'population': '11126285'}, 'namedetails': {'name:ur': 'لاہور'},
+        }]
+        patcher = mock.patch.object(geocoding, 'nominatim', self.make_client())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_compact_by_default(self):
+        response = self.client.get(reverse('drivo:geocode'), {'q': '1 Main St zzz'})
+        self.assertEqual(response.json(), [{
+            'lat': 31.5204, 'lon': 74.3587, 'display_name': 'Lahore, Pakistan', 'type': 'city', 'source': 'nominatim',
+        }])
+        # Only the compact record is cached
+        self.assertIsNone(self.geocode_cache.get(geocoding.geocode_cache_key('1 Main St zzz', full=True)))
+        self.assertEqual(
+            GeocodeCacheEntry.objects.get().payload, response.json()
+        )
+
+    def test_full_detail_on_request(self):
+        response = self.client.get(reverse('drivo:geocode'), {'q': '1 Main St zzz', 'detail': 'full'})
+        self.assertEqual(response.json()[0]['extratags'], {'population': '11126285'})
+        # The compact record was cached from the same upstream call
+        response = self.client.get(reverse('drivo:geocode'), {'q': '1 Main St zzz'})
+        self.assertEqual(response.json()[0]['lat'], 31.5204)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_gazetteer_results_are_compact(self):
+        response = self.client.get(reverse('drivo:geocode'), {'q': 'Lahore'})
+        self.assertEqual(set(response.json()[0]), set(geocoding.COMPACT_FIELDS))
+        self.assertIsInstance(response.json()[0]['lat'], float)
+
+    def test_invalid_detail(self):
+        response = self.client.get(reverse('drivo:geocode'), {'q': 'Lahore', 'detail': 'everything'})
+        self.assertEqual(response.status_code, 400)
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        lru = LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        self.assertEqual(lru.set('c', 3), 1)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual((lru.get('a'), lru.get('c')), (1, 3))
+
+
+class GeocodeCacheTests(GeocodeTestCase):
+    def test_results_survive_a_restart(self):
+        client = self.make_client()
+        with mock.patch.object(geocoding, 'nominatim', client):
+            first = geocoding.geocode('12 Mall Road somewhere')
+            # A new process starts with an empty LRU
+            self.geocode_cache.clear_local()
+            second = geocoding.geocode('12 mall road SOMEWHERE')
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(GeocodeCacheEntry.objects.count(), 1)
+
+    def test_errors_are_not_persisted(self):
+        self.server.status = 500
+        client = self.make_client()
+        with mock.patch.object(geocoding, 'nominatim', client):
+            self.assertIn('error', geocoding.geocode('zzz unknown place qqq'))
+            self.assertIn('error', geocoding.geocode('zzz unknown place qqq'))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertFalse(GeocodeCacheEntry.objects.exists())
+
+    def test_stale_entry_is_served_while_refreshing(self):
+        key = geocoding.geocode_cache_key('12 mall road')
+        old = [geocoding.compact_result({'lat': '31.5', 'lon': '74.3', 'display_name': 'old'})]
+        self.geocode_cache.set(key, '12 mall road', old, timeout=-1)
+        client = self.make_client()
+        refreshes = []
+        with mock.patch.object(geocoding, 'nominatim', client), \
+                mock.patch.object(geocoding._refresher, 'submit', lambda *args: refreshes.append(args)):
+            self.assertEqual(geocoding.geocode('12 mall road'), old)
+            self.assertEqual(geocoding.geocode('12 mall road'), old)
+            self.assertEqual(len(self.server.requests), 0)
+            # Run the one scheduled refresh here, inside the test transaction
+            self.assertEqual(len(refreshes), 1)
+            geocoding.refresh_geocode(refreshes[0][1], full=refreshes[0][3])
+        geocoding._refreshing.clear()
+        payload, fresh = self.geocode_cache.get(key)
+        self.assertTrue(fresh)
+        self.assertEqual(payload[0]['display_name'], 'Lahore, Pakistan')
+        self.assertEqual(GeocodeCacheEntry.objects.get(key=key).payload, payload)
+
+    def test_failed_refresh_keeps_stale_payload(self):
+        key = geocoding.geocode_cache_key('zzz unknown place qqq')
+        self.geocode_cache.set(key, 'zzz unknown place qqq', [{'display_name': 'old'}], timeout=-1)
+        self.server.status = 503
+        client = self.make_client()
+        with mock.patch.object(geocoding, 'nominatim', client):
+            geocoding.refresh_geocode('zzz unknown place qqq')
+        self.assertEqual(self.geocode_cache.get(key), ([{'display_name': 'old'}], True))
+
+    def test_warm_start_loads_hottest_entries(self):
+        for hits, query in enumerate(['cold', 'warm', 'hot']):
+            self.geocode_cache.set(query, query, [{'display_name': query}], timeout=60)
+            GeocodeCacheEntry.objects.filter(key=query).update(hits=hits)
+        restarted = GeocodeCache(warm_entries=2)
+        with self.assertNumQueries(1):
+            self.assertEqual(restarted.warm_start(), 2)
+            self.assertTrue(restarted.get('hot')[1])
+            self.assertTrue(restarted.get('warm')[1])
+        self.assertEqual(restarted.stats()['lru_hits'], 2)
+
+    def test_hits_are_flushed_in_batches(self):
+        self.geocode_cache.set('a', 'a', [], timeout=60)
+        self.geocode_cache.set('b', 'b', [], timeout=60)
+        for key in ('a', 'a', 'b'):
+            self.geocode_cache.get(key)
+        self.assertEqual(GeocodeCacheEntry.objects.get(key='a').hits, 0)
+        self.geocode_cache.flush_hits()
+        self.assertEqual(
+            dict(GeocodeCacheEntry.objects.values_list('key', 'hits')), {'a': 2, 'b': 1}
+        )
+
+
+@override_settings(CACHES=IN_PROCESS_SHARED_CACHES)
+class BatchGeocodeTests(NominatimStubMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        for target, value in (
+            ('geocode_cache', GeocodeCache(warm_entries=0)),
+            ('nominatim', self.make_client()),
+        ):
+            patcher = mock.patch.object(geocoding, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # The in-memory SQLite test database rejects concurrent writers; the
+        # cache logs and keeps those results in memory only
+        patcher = mock.patch.object(logging.getLogger('drivo.geocode_cache'), 'disabled', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post_batch(self, queries):
+        response = self.client.post(reverse('drivo:batch-geocode'), {'queries': queries}, content_type='application/json')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_duplicates_resolve_once_and_hits_come_first(self):
+        geocoding.geocode('7 Canal Road zzz')
+        self.server.requests.clear()
+        lines = self.post_batch(['1 Main St zzz', '7 canal road ZZZ', ' 1  main st zzz', 'Lahore', '2 Main St zzz'])
+        summary = lines.pop()
+        self.assertEqual(summary, {'done': True, 'queries': 5, 'unique': 4, 'cached': 2})
+        self.assertEqual([line['cached'] for line in lines], [True, True, False, False])
+        by_query = {line['query']: line for line in lines}
+        self.assertEqual(by_query['1 Main St zzz']['indexes'], [0, 2])
+        self.assertEqual(by_query['Lahore']['results'][0]['source'], 'gazetteer')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_misses_resolve_concurrently(self):
+        self.server.delay = 0.2
+        started = time.monotonic()
+        lines = self.post_batch([f'{number} Main St zzz' for number in range(4)])
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual({line.get('status') for line in lines[:-1]}, {'ok'})
+
+    def test_rejects_invalid_queries(self):
+        response = self.client.post(reverse('drivo:batch-geocode'), {'queries': ['ok', '', 3]}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['indexes'], [1, 2])
+
+
+class InstrumentedCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = InstrumentedCache('instrumented-test', {
+            'OPTIONS': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        })
+        self.cache.clear()
+        self.cache._stats.clear()
+
+    def test_counts_per_namespace(self):
+        self.cache.set('geocode_lahore', [{'lat': 31.5}])
+        self.cache.get('geocode_lahore')
+        self.cache.get('geocode_karachi')
+        self.cache.set_many({'fare_quote_1': 100, 'fare_quote_2': 200})
+        self.cache.get_many(['fare_quote_1', 'fare_quote_2', 'fare_quote_3'])
+        self.assertTrue(self.cache.add('misc', 1))
+        self.assertFalse(self.cache.add('misc', 2))
+        self.cache.delete('misc')
+
+        stats = self.cache.stats()
+        self.assertEqual(
+            {key: stats['geocode'][key] for key in ('hits', 'misses', 'hit_ratio', 'sets')},
+            {'hits': 1, 'misses': 1, 'hit_ratio': 0.5, 'sets': 1},
+        )
+        self.assertGreater(stats['geocode']['bytes_written'], 0)
+        self.assertEqual(stats['geocode']['get_latency_us']['calls'], 2)
+        self.assertEqual((stats['fare_quote']['hits'], stats['fare_quote']['misses']), (2, 1))
+        self.assertEqual(
+            {key: stats['other'][key] for key in ('sets', 'add_conflicts', 'deletes')},
+            {'sets': 1, 'add_conflicts': 1, 'deletes': 1},
+        )
+        # LocMemCache does not report evictions
+        self.assertIsNone(stats['geocode']['evictions'])
+
+    def test_falsy_values_are_hits(self):
+        self.cache.set('geocode_x', [])
+        self.assertEqual(self.cache.get('geocode_x', 'missing'), [])
+        self.assertEqual(self.cache.get('geocode_y', 'missing'), 'missing')
+        self.assertEqual(self.cache.stats()['geocode']['hits'], 1)
+
+    def test_instances_share_counters(self):
+        # Django creates one backend instance per thread
+        other = InstrumentedCache('instrumented-test', {
+            'OPTIONS': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        })
+        self.cache.set('geocode_x', 1)
+        self.assertEqual(other.get('geocode_x'), 1)
+        self.assertEqual(self.cache.stats()['geocode']['hits'], 1)
+
+    def test_longest_prefix_wins(self):
+        namespace = NamespaceResolver(['geocode_', 'geocode_refresh_'])
+        self.assertEqual(namespace('geocode_refresh_geocode_x'), 'geocode_refresh')
+        self.assertEqual(namespace('geocode_x'), 'geocode')
+        self.assertEqual(namespace('user_1'), 'other')
+
+
+class CacheReportingViewTests(SimpleTestCase):
+    def test_cache_stats_and_metrics(self):
+        cache.set('fare_quote_test', 1)
+        cache.get('fare_quote_test')
+        response = self.client.get(reverse('drivo:cache-stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(response.json()['namespaces']['fare_quote']['hits'], 1)
+
+        response = self.client.get(reverse('drivo:metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('# TYPE drivo_cache_hits_total counter', body)
+        self.assertIn('drivo_cache_hits_total{cache="default",namespace="fare_quote"}', body)
+        self.assertIn('drivo_cache_operation_seconds_count{cache="default",namespace="fare_quote",op="get"}', body)
+
+
+class SizedLRUCacheTests(SimpleTestCase):
+    def make_cache(self, name='sized-test', **options):
+        options.setdefault('BUDGETS', {'geocode_': 4000, 'other': 2000})
+        cache = SizedLRUCache(name, {'OPTIONS': options})
+        cache.clear()
+        return cache
+
+    def test_namespaces_evict_independently(self):
+        cache = self.make_cache()
+        cache.set('other_key', 'x')
+        for number in range(20):
+            cache.set(f'geocode_{number}', 'y' * 300)
+        usage = cache.usage()
+        self.assertLessEqual(usage['geocode']['stored_bytes'], 4000)
+        self.assertGreater(cache.evictions()['geocode'], 0)
+        # Large geocode values never push out other namespaces
+        self.assertEqual(cache.get('other_key'), 'x')
+        self.assertIsNone(cache.get('geocode_0'))
+        self.assertEqual(cache.get('geocode_19'), 'y' * 300)
+
+    def test_least_recently_used_goes_first(self):
+        cache = self.make_cache(BUDGETS={'other': 1000})
+        cache.set('a', 'a' * 200)
+        cache.set('b', 'b' * 200)
+        cache.get('a')
+        cache.set('c', 'c' * 200)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+
+    def test_oversized_values_are_rejected(self):
+        cache = self.make_cache()
+        cache.set('other_big', 'z' * 5000)
+        self.assertIsNone(cache.get('other_big'))
+        self.assertEqual(cache.usage()['other']['rejected'], 1)
+
+    def test_compression_shrinks_stored_bytes(self):
+        value = [{'display_name': f'House {number}, Gulberg III, Lahore, Punjab, Pakistan'} for number in range(50)]
+        plain = self.make_cache('sized-plain', BUDGETS={'other': 10 ** 6})
+        compact = self.make_cache('sized-compact', BUDGETS={'other': 10 ** 6}, COMPRESS_MIN_BYTES=256)
+        plain.set('k', value)
+        compact.set('k', value)
+        self.assertEqual(compact.get('k'), value)
+        self.assertLess(compact.usage()['other']['stored_bytes'] * 2, plain.usage()['other']['stored_bytes'])
+
+    def test_cache_api(self):
+        cache = self.make_cache()
+        self.assertTrue(cache.add('n', 1))
+        self.assertFalse(cache.add('n', 2))
+        self.assertEqual(cache.incr('n', 5), 6)
+        self.assertTrue(cache.has_key('n'))
+        self.assertTrue(cache.delete('n'))
+        self.assertFalse(cache.has_key('n'))
+        cache.set('t', 1, timeout=-1)
+        self.assertIsNone(cache.get('t'))
+        self.assertEqual(cache.usage()['other']['stored_bytes'], 0)
+
+    def test_instances_share_storage(self):
+        self.make_cache('sized-shared').set('k', 1)
+        self.assertEqual(SizedLRUCache('sized-shared', {'OPTIONS': {}}).get('k'), 1)
+
+
+class RideDataTestCase(TestCase):
+    """Rides with their client, driver, payment and review, read by an authenticated user."""
+    ROWS = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('budget@example.com', 'pass')
+        for i in range(cls.ROWS):
+            cls.add_ride(i)
+
+    @classmethod
+    def add_ride(cls, i):
+        client = ClientProfile.objects.create(
+            user=User.objects.create_user(f'client{i}@example.com', 'pass', is_client=True),
+            full_name=f'Client {i}',
+        )
+        driver = DriverProfile.objects.create(
+            user=User.objects.create_user(f'driver{i}@example.com', 'pass', is_driver=True),
+            full_name=f'Driver {i}', status='approved',
+        )
+        ride = Ride.objects.create(
+            client=client, driver=driver, pickup_location='A', dropoff_location='B',
+            vehicle_type='car', fuel_type='petrol', trip_type='one-way',
+        )
+        Payment.objects.create(ride=ride, client=client, amount=100, method='Cash')
+        Review.objects.create(ride=ride, client=client, driver=driver, rating=5)
+
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+
+class QueryBudgetTests(RideDataTestCase):
+    """List endpoints must load nested profiles and users in a fixed number of queries."""
+
+    # url name -> queries for a full page (page-number count + rows, keyset rows only, or
+    # cached status counts + the ETag's row digest and users token + rows)
+    BUDGETS = {
+        'drivo:user-list': 2,
+        'drivo:driverprofile-list': 2,
+        'drivo:clientprofile-list': 2,
+        'drivo:ride-list': 1,
+        'drivo:payment-list': 1,
+        'drivo:review-list': 1,
+        'drivo:available-drivers': 4,
+    }
+
+    def assert_budgets(self):
+        # Minted once per ETAG_VERSION_SECONDS, not per request
+        users_version()
+        for name, budget in self.BUDGETS.items():
+            cache.clear()
+            with self.subTest(endpoint=name), self.assertNumQueries(budget):
+                response = self.api.get(reverse(name))
+                self.assertEqual(response.status_code, 200)
+
+    def test_list_endpoints_within_budget(self):
+        self.assert_budgets()
+
+    def test_budget_does_not_grow_with_rows(self):
+        for i in range(self.ROWS, self.ROWS * 2):
+            self.add_ride(i)
+        self.assert_budgets()
+
+
+class SparseFieldsetTests(RideDataTestCase):
+    ROWS = 3
+
+    def test_fields_limit_columns_and_representation(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get(reverse('drivo:ride-list'), {'fields': 'id,status,fare,client'})
+        self.assertEqual(response.status_code, 200)
+        ride = response.json()['results'][0]
+        self.assertEqual(set(ride), {'id', 'status', 'fare', 'client'})
+        self.assertIsInstance(ride['client'], int)
+        select = queries.captured_queries[-1]['sql']
+        self.assertNotIn('JOIN', select)
+        self.assertNotIn('pickup_location', select)
+
+    def test_expand_nests_relation(self):
+        response = self.api.get(reverse('drivo:ride-list'), {'fields': 'id,driver', 'expand': 'driver'})
+        self.assertEqual(response.status_code, 200)
+        driver = response.json()['results'][0]['driver']
+        self.assertEqual(driver['user']['email'][:6], 'driver')
+
+        response = self.api.get(reverse('drivo:review-list'), {'expand': 'client'})
+        review = response.json()['results'][0]
+        self.assertIn('full_name', review['client'])
+        self.assertIsInstance(review['driver'], int)
+
+    def test_driver_endpoints(self):
+        response = self.api.get(reverse('drivo:driverprofile-list'), {'fields': 'id,full_name,dp_url'})
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'full_name', 'dp_url'})
+
+        response = self.api.get(reverse('drivo:available-drivers'), {'fields': 'id,full_name,user'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['drivers'][0]), {'id', 'full_name', 'user'})
+
+    def test_default_representation_unchanged(self):
+        ride = self.api.get(reverse('drivo:ride-list')).json()['results'][0]
+        self.assertIn('pickup_location', ride)
+        self.assertEqual(ride['client']['user']['email'][:6], 'client')
+
+    def test_unknown_names_rejected(self):
+        response = self.api.get(reverse('drivo:ride-list'), {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('fields', response.json())
+        response = self.api.get(reverse('drivo:ride-list'), {'expand': 'ride'})
+        self.assertEqual(response.status_code, 400)
+
+
+class KeysetPaginationTests(RideDataTestCase):
+    ROWS = 7
+
+    def walk(self, name, **params):
+        pages, url = [], reverse(name)
+        params.setdefault('page_size', 3)
+        while url:
+            with self.assertNumQueries(1):
+                body = self.api.get(url, params).json()
+            pages.append(body)
+            url, params = body['next'], {}
+        return pages
+
+    def test_pages_walk_newest_first_without_count(self):
+        pages = self.walk('drivo:ride-list')
+        self.assertEqual([len(page['results']) for page in pages], [3, 3, 1])
+        ids = [ride['id'] for page in pages for ride in page['results']]
+        self.assertEqual(ids, list(Ride.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+        self.assertNotIn('count', pages[0])
+        self.assertIsNone(pages[0]['previous'])
+        self.assertIsNotNone(pages[-1]['previous'])
+
+    def test_previous_returns_same_page(self):
+        pages = self.walk('drivo:payment-list')
+        body = self.api.get(pages[2]['previous']).json()
+        self.assertEqual(body['results'], pages[1]['results'])
+        body = self.api.get(body['previous']).json()
+        self.assertEqual(body['results'], pages[0]['results'])
+        self.assertIsNone(body['previous'])
+
+    def test_inserts_do_not_shift_later_pages(self):
+        first = self.api.get(reverse('drivo:review-list'), {'page_size': 3}).json()
+        self.add_ride(self.ROWS)
+        second = self.api.get(first['next']).json()
+        expected = list(Review.objects.order_by('-created_at', '-id').values_list('id', flat=True))[4:7]
+        self.assertEqual([review['id'] for review in second['results']], expected)
+
+    def test_ties_on_created_at_are_broken_by_id(self):
+        Ride.objects.update(created_at=Ride.objects.first().created_at)
+        pages = self.walk('drivo:ride-list', fields='id')
+        ids = [ride['id'] for page in pages for ride in page['results']]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+    def test_approximate_total(self):
+        body = self.api.get(reverse('drivo:ride-list'), {'total': 1}).json()
+        self.assertEqual(body['count'], self.ROWS)
+        with self.assertNumQueries(1):
+            self.api.get(reverse('drivo:ride-list'), {'total': 1})
+
+    def test_invalid_cursor(self):
+        response = self.api.get(reverse('drivo:ride-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class AvailableDriversFeedTests(RideDataTestCase):
+    ROWS = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        DriverProfile.objects.filter(full_name__in=['Driver 0', 'Driver 1', 'Driver 2']).update(status='available')
+        DriverProfile.objects.filter(full_name='Driver 0').update(city='Lahore')
+
+    def get(self, **params):
+        return self.api.get(reverse('drivo:available-drivers'), params).json()
+
+    def test_pages_available_drivers_with_cached_count(self):
+        first = self.get(page_size=2)
+        self.assertEqual(first['count'], 3)
+        self.assertEqual([d['full_name'] for d in first['drivers']], ['Driver 0', 'Driver 1'])
+        # The count is cached; the ETag's row digest and users token, then the rows
+        with self.assertNumQueries(3):
+            second = self.api.get(first['next']).json()
+        self.assertEqual([d['full_name'] for d in second['drivers']], ['Driver 2'])
+        self.assertIsNone(second['next'])
+
+    def test_total_param_reuses_cached_count(self):
+        self.get()
+        # The feed supplies its cached count, so ?total=1 adds no COUNT(*)
+        with self.assertNumQueries(3):
+            body = self.get(total=1)
+        self.assertEqual(body['count'], 3)
+
+    def test_city_and_status_filters(self):
+        body = self.get(city='Lahore')
+        self.assertEqual(body['count'], 1)
+        self.assertEqual([d['full_name'] for d in body['drivers']], ['Driver 0'])
+        body = self.get(status='approved')
+        self.assertEqual(body['count'], 1)
+        self.assertEqual([d['full_name'] for d in body['drivers']], ['Driver 3'])
+
+    def test_lists_every_driver_when_none_available(self):
+        DriverProfile.objects.update(status='approved')
+        body = self.get()
+        self.assertEqual(body['count'], self.ROWS)
+        self.assertEqual(len(body['drivers']), self.ROWS)
+
+
+class ORJSONTests(SimpleTestCase):
+    data = {
+        'fare': Decimal('845.50'),
+        'pickup_latitude': Decimal('31.52036100'),
+        'created_at': datetime.datetime(2026, 10, 18, 9, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+        'when': datetime.date(2026, 10, 18),
+        1: ['Lahore   Karachi', None, True, 2.5],
+        'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+    }
+
+    def test_renders_like_json_renderer(self):
+        self.assertEqual(ORJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_indent_falls_back(self):
+        rendered = ORJSONRenderer().render({'a': 1}, 'application/json; indent=2')
+        self.assertEqual(rendered, b'{\n  "a": 1\n}')
+
+    def test_parser(self):
+        self.assertEqual(ORJSONParser().parse(io.BytesIO(b'{"lat": 31.5, "tags": ["a"]}')), {'lat': 31.5, 'tags': ['a']})
+        for body in (b'{"lat": ', b'{"lat": NaN}'):
+            with self.assertRaises(ParseError):
+                ORJSONParser().parse(io.BytesIO(body))
+
+    def test_api_uses_orjson(self):
+        response = self.client.get(reverse('drivo:cache-stats'))
+        self.assertIsInstance(response.accepted_renderer, ORJSONRenderer)
+
+
+class MessagePackTests(RideDataTestCase):
+    ROWS = 3
+
+    def get(self, name, **params):
+        return self.api.get(reverse(name), params, HTTP_ACCEPT='application/msgpack')
+
+    def test_responses_match_json(self):
+        for name in ('drivo:ride-list', 'drivo:available-drivers'):
+            with self.subTest(endpoint=name):
+                response = self.get(name)
+                self.assertEqual(response['Content-Type'], 'application/msgpack')
+                self.assertEqual(msgpack.unpackb(response.content), self.api.get(reverse(name)).json())
+
+    def test_json_stays_default(self):
+        response = self.api.get(reverse('drivo:ride-list'))
+        self.assertEqual(response['Content-Type'], 'application/json')
+        response = self.client.get(reverse('drivo:cache-stats'), HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 406)
+
+    def test_location_update_body(self):
+        client = ClientProfile.objects.get(full_name='Client 0')
+        self.api.force_authenticate(client.user)
+        body = msgpack.packb({'latitude': 31.520361, 'longitude': 74.358749})
+        response = self.api.patch(
+            reverse('drivo:update-client-location'), body,
+            content_type='application/msgpack', HTTP_ACCEPT='application/msgpack',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(msgpack.unpackb(response.content)['success'])
+        client.refresh_from_db()
+        self.assertEqual(str(client.latitude), '31.520361')
+
+        response = self.api.patch(reverse('drivo:update-client-location'), b'\x92\x01', content_type='application/msgpack')
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTests(RideDataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ride = Ride.objects.select_related('client__user', 'driver__user').order_by('id').first()
+
+    def assert_not_modified(self, url, user=None, queries=1):
+        """The endpoint's ETag, after checking a matching If-None-Match is a 304 costing only the state read."""
+        if user is not None:
+            self.api.force_authenticate(user)
+        response = self.api.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertNumQueries(queries):
+            response = self.api.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+        return etag
+
+    def assert_modified(self, url, etag):
+        response = self.api.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response
+
+    def test_unchanged_resources_are_not_modified(self):
+        self.assert_not_modified(reverse('drivo:client-profile'), self.ride.client.user)
+        self.assert_not_modified(reverse('drivo:driver-profile'), self.ride.driver.user)
+        # The row digest and the shared users token; status counts are cached
+        self.assert_not_modified(reverse('drivo:available-drivers'), queries=2)
+        self.assert_not_modified(reverse('drivo:ride-detail', args=[self.ride.id]))
+
+    def test_representations_get_their_own_etags(self):
+        url = reverse('drivo:ride-detail', args=[self.ride.id])
+        etag = self.assert_not_modified(url)
+        response = self.api.get(url, HTTP_IF_NONE_MATCH=etag, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        response = self.api.get(url, {'fields': 'id,status'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_profile_save_changes_etags(self):
+        url = reverse('drivo:client-profile')
+        etag = self.assert_not_modified(url, self.ride.client.user)
+        self.ride.client.full_name = 'Renamed'
+        self.ride.client.save()
+        self.assertEqual(self.assert_modified(url, etag).json()['full_name'], 'Renamed')
+
+        # The ride nests the client, so its ETag moves with the profile too
+        url = reverse('drivo:ride-detail', args=[self.ride.id])
+        etag = self.assert_not_modified(url)
+        ClientProfile.objects.filter(id=self.ride.client_id).update(full_name='Renamed again')
+        self.assert_modified(url, etag)
+
+    def test_update_without_signals_changes_etag(self):
+        # As the backfill commands and other processes write: no save(), no signal
+        url = reverse('drivo:ride-detail', args=[self.ride.id])
+        etag = self.assert_not_modified(url)
+        Ride.objects.filter(id=self.ride.id).update(status='accepted')
+        self.assertEqual(self.assert_modified(url, etag).json()['status'], 'accepted')
+
+    def test_dispatch_assignment_changes_etag(self):
+        driver_index.clear()
+        driver_index._loaded = False
+        self.addCleanup(setattr, driver_index, '_loaded', False)
+        self.addCleanup(driver_index.clear)
+        DriverProfile.objects.filter(id=self.ride.driver_id).update(
+            status='available', current_latitude='31.510000', current_longitude='74.300000'
+        )
+        ride = Ride.objects.create(
+            client=self.ride.client, pickup_location='A', dropoff_location='B', vehicle_type='car',
+            fuel_type='petrol', trip_type='one-way', pickup_latitude=Decimal('31.5'), pickup_longitude=Decimal('74.3'),
+        )
+        url = reverse('drivo:ride-detail', args=[ride.id])
+        etag = self.assert_not_modified(url)
+        self.assertEqual(DispatchEngine().tick()['assigned'], 1)
+        response = self.assert_modified(url, etag)
+        self.assertEqual(response.json()['status'], 'accepted')
+
+    def test_bulk_position_update_changes_etags(self):
+        # Pings carry their own time: this one is older than another
+        # driver's stored update, so the newest update does not move
+        now = datetime.datetime.now(datetime.timezone.utc)
+        DriverProfile.objects.update(last_location_update=now)
+        DriverProfile.objects.filter(id=self.ride.driver_id).update(last_location_update=now - datetime.timedelta(minutes=10))
+        feed = self.assert_not_modified(reverse('drivo:available-drivers'), queries=2)
+        profile = self.assert_not_modified(reverse('drivo:driver-profile'), self.ride.driver.user)
+        pinged_at = now - datetime.timedelta(minutes=5)
+        self.assertEqual(bulk_update_positions([(self.ride.driver_id, Decimal('31.9'), Decimal('74.3'), pinged_at)]), 1)
+        self.assert_modified(reverse('drivo:driver-profile'), profile)
+        drivers = self.assert_modified(reverse('drivo:available-drivers'), feed).json()['drivers']
+        moved = next(driver for driver in drivers if driver['id'] == self.ride.driver_id)
+        self.assertEqual(Decimal(str(moved['current_latitude'])), Decimal('31.9'))
+
+    def test_user_changes_reach_the_feed_from_any_worker(self):
+        url = reverse('drivo:available-drivers')
+        etag = self.assert_not_modified(url, queries=2)
+        # Another worker's connection to the shared cache drops the users token
+        caches.create_connection('shared').delete(USERS_VERSION_KEY)
+        etag = self.assert_modified(url, etag)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ride.driver.user.email = 'renamed@example.com'
+            self.ride.driver.user.save()
+        self.assert_modified(url, etag)
+
+    def test_missing_ride_is_not_found(self):
+        self.assertEqual(self.api.get(reverse('drivo:ride-detail', args=[0])).status_code, 404)
+
+
+class FareTests(SimpleTestCase):
+    def scalar_fare(self, pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, vehicle, fuel, trip):
+        """One ride priced the obvious way, from the settings tables."""
+        tariff = settings.FARE_TARIFFS.get(vehicle, settings.FARE_TARIFFS[settings.FARE_DEFAULT_VEHICLE])
+        km = haversine_km(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon) * settings.FARE_ROAD_DISTANCE_FACTOR
+        fare = (tariff['base'] + tariff['per_km'] * km) * settings.FARE_FUEL_MULTIPLIERS.get(fuel or '', 1.0)
+        if trip == 'round-trip':
+            fare *= settings.FARE_ROUND_TRIP_MULTIPLIER
+        return round(max(fare, tariff['minimum']), 2)
+
+    def test_vectorised_fares_match_scalar(self):
+        rng = random.Random(3)
+        rides = [
+            (
+                31.5 + rng.uniform(-0.2, 0.2), 74.3 + rng.uniform(-0.2, 0.2),
+                31.5 + rng.uniform(-0.2, 0.2), 74.3 + rng.uniform(-0.2, 0.2),
+                rng.choice([*settings.FARE_TARIFFS, 'hovercraft']),
+                rng.choice([*settings.FARE_FUEL_MULTIPLIERS, None]),
+                rng.choice(['one-way', 'round-trip']),
+            )
+            for _ in range(200)
+        ]
+        fares, _ = compute_fares(
+            *zip(*[ride[:4] for ride in rides]),
+            vehicle_types=[ride[4] for ride in rides],
+            fuel_types=[ride[5] for ride in rides],
+            trip_types=[ride[6] for ride in rides],
+        )
+        np.testing.assert_allclose(fares, [self.scalar_fare(*ride) for ride in rides])
+        self.assertEqual(price_ride_rows(rides), [Decimal(str(fare)).quantize(Decimal('0.01')) for fare in fares])
+        self.assertEqual(estimate_fare(*rides[0]), price_ride_rows(rides[:1])[0])
+
+    def test_missing_coordinates_are_not_priced(self):
+        row = (31.5, 74.3, None, 74.4, 'car', 'petrol', 'one-way')
+        self.assertEqual(price_ride_rows([row]), [None])
+        self.assertIsNone(estimate_fare(*row))
+
+    def test_quote_matrix_prices_every_combination(self):
+        trip = (31.52, 74.35, 31.48, 74.30)
+        quote, = quote_matrix([trip])
+        self.assertEqual(set(quote['fares']), set(settings.FARE_TARIFFS))
+        for vehicle, fuels in quote['fares'].items():
+            for fuel, trip_types in fuels.items():
+                for trip_type, fare in trip_types.items():
+                    self.assertAlmostEqual(fare, self.scalar_fare(*trip, vehicle, fuel, trip_type))
+
+
+class FareViewTests(RideDataTestCase):
+    def quote(self, data):
+        return self.api.post(reverse('drivo:fare-quotes'), data, format='json')
+
+    def test_validation_errors(self):
+        trip = {'pickup_latitude': 31.52, 'pickup_longitude': 74.35, 'dropoff_latitude': 31.48, 'dropoff_longitude': 74.30}
+        for data in (
+            {**trip, 'pickup_latitude': 91},
+            {key: value for key, value in trip.items() if key != 'dropoff_longitude'},
+            {'trips': []},
+            {'trips': [trip] * (settings.FARE_QUOTE_MAX_TRIPS + 1)},
+        ):
+            with self.subTest(data=data):
+                response = self.quote(data)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('details', response.json())
+
+    def test_repeated_quote_is_served_from_cache(self):
+        trip = {'pickup_latitude': 31.52, 'pickup_longitude': 74.35, 'dropoff_latitude': 31.48, 'dropoff_longitude': 74.30}
+        first = self.quote(trip).json()
+        self.assertEqual(first['cache_hits'], 0)
+        # Within the rounding of the cache key, so the same booking
+        nudged = {**trip, 'pickup_latitude': 31.520001}
+        with mock.patch('drivo.fares.compute_fares', side_effect=AssertionError('priced again')):
+            second = self.quote({'trips': [trip, nudged]}).json()
+        self.assertEqual(second['cache_hits'], 2)
+        self.assertEqual(second['quotes'][0]['fares'], first['quotes'][0]['fares'])
+        self.assertEqual(second['quotes'][1]['pickup_latitude'], 31.520001)
+
+    def test_ride_create_prices_the_ride(self):
+        client = ClientProfile.objects.get(full_name='Client 0')
+        self.api.force_authenticate(client.user)
+        data = {
+            'pickup_location': 'A', 'dropoff_location': 'B', 'vehicle_type': 'suv', 'fuel_type': 'diesel',
+            'trip_type': 'round-trip', 'pickup_latitude': 31.52, 'pickup_longitude': 74.35,
+            'dropoff_latitude': 31.48, 'dropoff_longitude': 74.30,
+        }
+        with mock.patch('sys.stdout', io.StringIO()):
+            response = self.api.post(reverse('drivo:ride-list'), data, format='json')
+        self.assertEqual(response.status_code, 201)
+        ride = Ride.objects.get(id=response.json()['id'])
+        self.assertEqual(ride.fare, estimate_fare(31.52, 74.35, 31.48, 74.30, 'suv', 'diesel', 'round-trip'))
+        self.assertIsNotNone(ride.fare)
+
+
+def make_gazetteer():
+    """A few places in Lahore and Karachi, with a same-named area in both."""
+    rows = [
+        ('Lahore', 'city', '', 31.5497, 74.3436, 0.9, ()),
+        ('Karachi', 'city', '', 24.8607, 67.0011, 0.9, ()),
+        ('Gulberg', 'area', 'Lahore', 31.5204, 74.3587, 0.5, ('Gulberg III',)),
+        ('DHA', 'area', 'Lahore', 31.4805, 74.3902, 0.4, ('Defence',)),
+        ('DHA', 'area', 'Karachi', 24.8138, 67.0645, 0.6, ()),
+        ('Liberty Market', 'landmark', 'Lahore', 31.5102, 74.3441, 0.3, ()),
+    ]
+    places = [
+        Place(i, name, kind, city, 'Pakistan', lat, lon, importance)
+        for i, (name, kind, city, lat, lon, importance, _) in enumerate(rows)
+    ]
+    return Gazetteer(places, [row[-1] for row in rows])
+
+
+class GazetteerTests(SimpleTestCase):
+    def setUp(self):
+        self.gazetteer = make_gazetteer()
+        self.places = {(place.name, place.city): place for place in self.gazetteer.places}
+
+    def test_lookup_is_exact_and_case_insensitive(self):
+        gulberg = self.places['Gulberg', 'Lahore']
+        for query in ('Gulberg', 'GULBERG', '  gulberg  ', 'Gulberg-III', 'gulberg, lahore', 'Gulberg, Lahore, Pakistan'):
+            with self.subTest(query=query):
+                self.assertEqual(self.gazetteer.lookup(query), [gulberg])
+        self.assertEqual(self.gazetteer.lookup('gulb'), [])
+        # Same-named places come most important first
+        self.assertEqual(self.gazetteer.lookup('dha', limit=5), [self.places['DHA', 'Karachi'], self.places['DHA', 'Lahore']])
+
+    def test_prefix_orders_by_importance(self):
+        self.assertEqual(
+            [place.name for place in self.gazetteer.prefix('l')], ['Lahore', 'Liberty Market']
+        )
+        self.assertEqual(self.gazetteer.prefix('d', limit=1), [self.places['DHA', 'Karachi']])
+        self.assertEqual(self.gazetteer.prefix('  '), [])
+
+    def test_find_in_text_prefers_specific_multi_word_matches(self):
+        self.assertEqual(self.gazetteer.find_in_text('Gate 2, Liberty Market, Lahore'), self.places['Liberty Market', 'Lahore'])
+        self.assertEqual(self.gazetteer.find_in_text('House 5, DHA Phase 6, Karachi'), self.places['DHA', 'Karachi'])
+        self.assertEqual(self.gazetteer.find_in_text('Street 3, Defence, Lahore'), self.places['DHA', 'Lahore'])
+        self.assertEqual(self.gazetteer.find_in_text('somewhere in Lahore'), self.places['Lahore', ''])
+        self.assertIsNone(self.gazetteer.find_in_text('nowhere known'))
+
+    def test_nearest_without_scipy_matches_kd_tree(self):
+        lats = [31.5206, 24.8139, 31.49, 0.0]
+        lons = [74.3589, 67.0646, 74.38, 0.0]
+        with mock.patch('drivo.gazetteer.cKDTree', None):
+            fallback = make_gazetteer()
+        self.assertIsNone(fallback._tree)
+        ids, distances = fallback.nearest(lats, lons, max_km=5)
+        expected = [self.places['Gulberg', 'Lahore'].id, self.places['DHA', 'Karachi'].id, self.places['DHA', 'Lahore'].id, -1]
+        self.assertEqual(ids.tolist(), expected)
+        for lat, lon, place_id, distance in zip(lats[:3], lons[:3], ids, distances):
+            place = fallback.places[place_id]
+            self.assertAlmostEqual(distance, haversine_km(lat, lon, place.lat, place.lon), places=6)
+        self.assertTrue(np.isinf(distances[3]))
+        self.assertEqual(fallback.reverse(0.0, 0.0, max_km=5), (None, None))
+        if self.gazetteer._tree is not None:
+            tree_ids, tree_distances = self.gazetteer.nearest(lats, lons, max_km=5)
+            self.assertEqual(tree_ids.tolist(), expected)
+            np.testing.assert_allclose(tree_distances, distances)
+
+
+class ReverseGeocodeTests(RideDataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gazetteer = make_gazetteer()
+        for target in ('drivo.views.get_gazetteer', 'drivo.management.commands.backfill_location_labels.get_gazetteer'):
+            patcher = mock.patch(target, return_value=self.gazetteer)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_get_resolves_nearest_place(self):
+        url = reverse('drivo:reverse-geocode')
+        body = self.api.get(url, {'lat': 31.5206, 'lon': 74.3589}).json()
+        self.assertEqual((body['display_name'], body['found'], body['source']), ('Gulberg, Lahore, Pakistan', True, 'gazetteer'))
+        self.assertLess(body['distance_km'], 0.1)
+        self.assertEqual(self.api.get(url, {'lat': 0, 'lon': 0}).status_code, 404)
+        for params in ({'lat': 'north', 'lon': 74.3}, {'lat': 91, 'lon': 74.3}, {'lat': 'nan', 'lon': 74.3}, {'lat': 31.5}):
+            with self.subTest(params=params):
+                self.assertEqual(self.api.get(url, params).status_code, 400)
+
+    def test_post_resolves_points_in_one_call(self):
+        points = [{'lat': 31.5103, 'lon': 74.3442}, {'lat': 24.8139, 'lon': 67.0646}, {'lat': 0, 'lon': 0}]
+        response = self.api.post(reverse('drivo:reverse-geocode'), {'points': points}, format='json')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(
+            [result.get('display_name') for result in results],
+            ['Liberty Market, Lahore, Pakistan', 'DHA, Karachi, Pakistan', None],
+        )
+        self.assertEqual(results[2], {'lat': 0.0, 'lon': 0.0, 'found': False})
+
+    @override_settings(REVERSE_GEOCODE_MAX_POINTS=2)
+    def test_post_rejects_invalid_points(self):
+        url = reverse('drivo:reverse-geocode')
+        response = self.api.post(url, {'points': [{'lat': 31.5, 'lon': 74.3}, {'lat': 'x', 'lon': 74.3}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['indexes'], [1])
+        for data in ({'points': []}, {'points': {'lat': 31.5, 'lon': 74.3}}, {'points': [{'lat': 31.5, 'lon': 74.3}] * 3}):
+            with self.subTest(data=data):
+                self.assertEqual(self.api.post(url, data, format='json').status_code, 400)
+
+    def test_coordinates_only_ride_gets_labels(self):
+        client = ClientProfile.objects.get(full_name='Client 0')
+        self.api.force_authenticate(client.user)
+        data = {
+            'vehicle_type': 'car', 'fuel_type': 'petrol', 'trip_type': 'one-way',
+            'pickup_latitude': 31.5205, 'pickup_longitude': 74.3588,
+            'dropoff_latitude': 31.4806, 'dropoff_longitude': 74.3903,
+        }
+        with mock.patch('sys.stdout', io.StringIO()):
+            response = self.api.post(reverse('drivo:ride-list'), data, format='json')
+        self.assertEqual(response.status_code, 201)
+        ride = Ride.objects.get(id=response.json()['id'])
+        self.assertEqual(
+            (ride.pickup_location, ride.dropoff_location), ('Gulberg, Lahore, Pakistan', 'DHA, Lahore, Pakistan')
+        )
+
+    def test_backfill_labels_historical_rides_in_batches(self):
+        client = ClientProfile.objects.get(full_name='Client 0')
+        pickups = [(31.5205, 74.3588), (31.5103, 74.3442), (10.0, 10.0), (31.4806, 74.3903), (24.8139, 67.0646)]
+        rides = [
+            Ride.objects.create(
+                client=client, pickup_location='', dropoff_location='Known', vehicle_type='car',
+                fuel_type='petrol', trip_type='one-way', pickup_latitude=Decimal(str(lat)),
+                pickup_longitude=Decimal(str(lon)), dropoff_latitude=Decimal('31.5205'), dropoff_longitude=Decimal('74.3588'),
+            )
+            for lat, lon in pickups
+        ]
+        out = io.StringIO()
+        with mock.patch.object(
+            backfill_location_labels, 'bulk_update_columns', wraps=backfill_location_labels.bulk_update_columns
+        ) as bulk_update:
+            call_command('backfill_location_labels', batch_size=2, stdout=out)
+        # Three batches of at most two pickups; the far one is left empty
+        self.assertEqual([len(call.args[2]) for call in bulk_update.call_args_list], [2, 1, 1])
+        self.assertIn('Labelled 4 pickup locations', out.getvalue())
+        self.assertIn('Labelled 0 dropoff locations', out.getvalue())
+        labels = dict(Ride.objects.filter(id__in=[ride.id for ride in rides]).values_list('id', 'pickup_location'))
+        self.assertEqual([labels[ride.id] for ride in rides], [
+            'Gulberg, Lahore, Pakistan', 'Liberty Market, Lahore, Pakistan', '',
+            'DHA, Lahore, Pakistan', 'DHA, Karachi, Pakistan',
+        ])
+        self.assertEqual(set(Ride.objects.exclude(id__in=labels).values_list('pickup_location', flat=True)), {'A'})
+
+
+class GridIndexTests(SimpleTestCase):
+    def setUp(self):
+        rng = random.Random(7)
+        self.points = {i: (31.5 + rng.uniform(-0.3, 0.3), 74.3 + rng.uniform(-0.3, 0.3)) for i in range(300)}
+        self.index = GridIndex(cell_size_deg=0.02)
+        for key, (lat, lon) in self.points.items():
+            self.index.update(key, lat, lon, status='available' if key % 3 else 'offline')
+
+    def brute_force(self, lat, lon, radius_km, statuses=None):
+        hits = [
+            (haversine_km(lat, lon, p_lat, p_lon), key)
+            for key, (p_lat, p_lon) in self.points.items()
+            if statuses is None or (key % 3 and 'available' in statuses) or (not key % 3 and 'offline' in statuses)
+        ]
+        return sorted(hit for hit in hits if hit[0] <= radius_km)
+
+    def test_within_and_nearest_match_brute_force(self):
+        for radius_km in (0.5, 3, 20, 200):
+            with self.subTest(radius_km=radius_km):
+                expected = self.brute_force(31.52, 74.35, radius_km, statuses=('available',))
+                within = self.index.within(31.52, 74.35, radius_km, statuses=('available',))
+                self.assertEqual([hit[1] for hit in within], [key for _, key in expected])
+                nearest = self.index.nearest(31.52, 74.35, 10, radius_km, statuses=('available',))
+                self.assertEqual([hit[1] for hit in nearest], [key for _, key in expected[:10]])
+
+    def test_older_position_only_updates_status(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.index.update('late', 31.5, 74.3, 'available', now)
+        self.index.update('late', 32.0, 75.0, 'busy', now - datetime.timedelta(seconds=5))
+        self.assertEqual(self.index.get('late'), (31.5, 74.3, 'busy', now))
+        self.assertEqual(self.index.within(32.0, 75.0, 1), [])
+
+
+class NearbyDriversTests(RideDataTestCase):
+    def setUp(self):
+        super().setUp()
+        driver_index.clear()
+        driver_index._loaded = False
+        for i, (lat, lon) in enumerate([('31.520000', '74.350000'), ('31.530000', '74.360000')]):
+            DriverProfile.objects.filter(full_name=f'Driver {i}').update(
+                status='available', current_latitude=lat, current_longitude=lon
+            )
+
+    def tearDown(self):
+        driver_index.clear()
+        driver_index._loaded = False
+
+    def nearby(self, **params):
+        return self.api.get(reverse('drivo:available-drivers'), {'lat': '31.5201', 'lon': '74.3501', **params})
+
+    def test_closest_first_with_distance_and_eta(self):
+        body = self.nearby(radius_km=5).json()
+        self.assertEqual([driver['full_name'] for driver in body['drivers']], ['Driver 0', 'Driver 1'])
+        self.assertLess(body['drivers'][0]['distance_km'], body['drivers'][1]['distance_km'])
+        self.assertIn('eta_minutes', body['drivers'][0])
+        self.assertEqual(len(self.nearby(k=1).json()['drivers']), 1)
+
+    def test_invalid_search_parameters(self):
+        for params in ({'radius_km': 'nan'}, {'radius_km': '-1'}, {'radius_km': 'far'}, {'k': '0'}, {'lat': '91'}):
+            with self.subTest(**params):
+                self.assertEqual(self.nearby(**params).status_code, 400)
+
+
+@override_settings(TIME_ZONE='UTC', ETA_SPEED_PROFILES={
+    'default': {'speed_kmh': 25, 'road_factor': 1.3},
+    'lahore': {'speed_kmh': 30, 'peak_speed_kmh': 15, 'peak_hours': [8, 9], 'road_factor': 1.2},
+})
+class MatrixTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(11)
+        self.origins = (31.5 + rng.uniform(-0.3, 0.3, 40), 74.3 + rng.uniform(-0.3, 0.3, 40))
+        self.dests = (31.5 + rng.uniform(-0.3, 0.3, 60), 74.3 + rng.uniform(-0.3, 0.3, 60))
+        self.expected = np.array([
+            [haversine_km(o_lat, o_lon, d_lat, d_lon) for d_lat, d_lon in zip(*self.dests)]
+            for o_lat, o_lon in zip(*self.origins)
+        ])
+
+    def test_distance_matrix_and_nearest_k_match_brute_force(self):
+        np.testing.assert_allclose(distance_matrix(*self.origins, *self.dests), self.expected)
+        cols, distances = nearest_k(*self.origins, *self.dests, k=5)
+        expected_cols = np.argsort(self.expected, axis=1)[:, :5]
+        np.testing.assert_array_equal(cols, expected_cols)
+        np.testing.assert_allclose(distances, np.take_along_axis(self.expected, expected_cols, axis=1))
+
+    def test_small_chunks_give_identical_results(self):
+        for max_km in (None, 10):
+            with self.subTest(max_km=max_km):
+                blocks = list(iter_distance_blocks(*self.origins, *self.dests, max_km=max_km, chunk_cells=150))
+                self.assertEqual([(start, stop) for start, stop, _, _ in blocks][:2], [(0, 2), (2, 4)])
+                self.assertEqual(len(blocks), 20)
+                np.testing.assert_array_equal(
+                    distance_matrix(*self.origins, *self.dests, max_km=max_km, chunk_cells=150),
+                    distance_matrix(*self.origins, *self.dests, max_km=max_km),
+                )
+                for chunked, whole in zip(
+                    nearest_k(*self.origins, *self.dests, k=5, max_km=max_km, chunk_cells=150),
+                    nearest_k(*self.origins, *self.dests, k=5, max_km=max_km),
+                ):
+                    np.testing.assert_array_equal(chunked, whole)
+
+    def test_max_km_drops_far_candidates(self):
+        distances = distance_matrix(*self.origins, *self.dests, max_km=10)
+        near = self.expected <= 10
+        self.assertTrue(near.any() and not near.all())
+        np.testing.assert_allclose(distances[near], self.expected[near])
+        self.assertTrue(np.isinf(distances[~near]).all())
+
+        cols, nearest = nearest_k(*self.origins, *self.dests, k=len(self.dests[0]), max_km=10)
+        self.assertTrue((nearest[np.isfinite(nearest)] <= 10).all())
+        np.testing.assert_array_equal((cols >= 0).sum(axis=1), near.sum(axis=1))
+
+    def test_eta_uses_city_speed_profile(self):
+        cities = ['Lahore', ' lahore ', None, 'Nowhere']
+        origins = (self.origins[0][:4], self.origins[1][:4])
+        off_peak = datetime.datetime(2026, 10, 18, 12, tzinfo=datetime.timezone.utc)
+        speeds, factors = city_speeds(cities, when=off_peak)
+        np.testing.assert_array_equal(speeds, [30, 30, 25, 25])
+        np.testing.assert_array_equal(factors, [1.2, 1.2, 1.3, 1.3])
+
+        distances, etas = eta_matrix(*origins, *self.dests, origin_cities=cities, when=off_peak)
+        np.testing.assert_allclose(etas, distances * factors[:, None] / speeds[:, None] * 60)
+        peak = off_peak.replace(hour=8)
+        _, peak_etas = eta_matrix(*origins, *self.dests, origin_cities=cities, when=peak)
+        np.testing.assert_allclose(peak_etas[:2], etas[:2] * 2)
+        np.testing.assert_allclose(peak_etas[2:], etas[2:])
+
+
+class LiveLocationTests(RideDataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.driver = DriverProfile.objects.get(full_name='Driver 0')
+        self.now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+
+    def stored(self):
+        return DriverProfile.objects.filter(id=self.driver.id).values_list(
+            'current_latitude', 'current_longitude', 'last_location_update'
+        ).get()
+
+    def test_older_position_never_replaces_newer(self):
+        newer = self.now + datetime.timedelta(seconds=10)
+        self.assertEqual(bulk_update_positions([(self.driver.id, Decimal('31.5'), Decimal('74.3'), newer)]), 1)
+        self.assertEqual(bulk_update_positions([(self.driver.id, Decimal('30.0'), Decimal('70.0'), self.now)]), 0)
+        self.assertEqual(self.stored(), (Decimal('31.500000'), Decimal('74.300000'), newer))
+
+    def test_flush_writes_latest_ping_and_requeues_on_failure(self):
+        store = LiveLocationStore(flush_interval=3600)
+        store.record(self.driver.id, 31.1, 74.1, recorded_at=self.now)
+        store.record(self.driver.id, 31.2, 74.2, recorded_at=self.now + datetime.timedelta(seconds=5))
+        self.assertFalse(store.record(self.driver.id, 31.0, 74.0, recorded_at=self.now))
+        with mock.patch('drivo.live_location.bulk_update_positions', side_effect=RuntimeError('down')):
+            with self.assertRaises(RuntimeError), self.assertLogs('drivo.live_location', 'ERROR'):
+                store.flush()
+        self.assertEqual(store.pending(), 1)
+        self.assertEqual(store.flush(), 1)
+        self.assertEqual(store.pending(), 0)
+        self.assertEqual(self.stored()[:2], (Decimal('31.200000'), Decimal('74.200000')))
+
+    def current_location(self, store, monotonic):
+        with mock.patch('drivo.views.live_locations', store), \
+                mock.patch('drivo.live_location.time.monotonic', return_value=monotonic):
+            return self.api.get(reverse('drivo:get-current-location')).json()
+
+    def test_current_location_prefers_newer_flushed_row(self):
+        self.api.force_authenticate(self.driver.user)
+        bulk_update_positions([(self.driver.id, Decimal('31.5'), Decimal('74.3'), self.now)])
+        store = LiveLocationStore(flush_interval=5)
+        with mock.patch('drivo.live_location.time.monotonic', return_value=1000):
+            store.record(self.driver.id, 30.0, 70.0, recorded_at=self.now - datetime.timedelta(seconds=5), persist=False)
+        # Past the flush interval another worker may have flushed a later ping
+        body = self.current_location(store, monotonic=1010)
+        self.assertEqual((body['latitude'], body['longitude']), (31.5, 74.3))
+        with mock.patch('drivo.live_location.time.monotonic', return_value=1000):
+            store.record(self.driver.id, 32.0, 75.0, recorded_at=self.now + datetime.timedelta(seconds=5), persist=False)
+        body = self.current_location(store, monotonic=1010)
+        self.assertEqual((body['latitude'], body['longitude']), (32.0, 75.0))
+
+    def test_current_location_from_fresh_ping_costs_no_query(self):
+        self.api.force_authenticate(self.driver.user)
+        store = LiveLocationStore(flush_interval=5)
+        self.current_location(store, monotonic=1000)
+        with mock.patch('drivo.live_location.time.monotonic', return_value=1000):
+            store.record(self.driver.id, 31.5, 74.3, recorded_at=self.now, persist=False)
+        with self.assertNumQueries(0):
+            body = self.current_location(store, monotonic=1002)
+        self.assertEqual((body['latitude'], body['longitude']), (31.5, 74.3))
+
+
+class LocationTraceTests(RideDataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.driver = DriverProfile.objects.get(full_name='Driver 0')
+        self.api.force_authenticate(self.driver.user)
+        self.store = LiveLocationStore(flush_interval=3600)
+        patcher = mock.patch('drivo.views.live_locations', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        start = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0) - datetime.timedelta(minutes=1)
+        self.points = [
+            {'latitude': 31.5 + i / 1000, 'longitude': 74.3, 'recorded_at': (start + datetime.timedelta(seconds=5 * i)).isoformat()}
+            for i in range(4)
+        ]
+
+    def upload(self, points):
+        return self.api.post(reverse('drivo:driver-location-trace'), {'points': points}, format='json')
+
+    def test_batch_is_stored_and_newest_point_becomes_current(self):
+        body = self.upload(self.points).json()
+        self.assertEqual((body['accepted'], body['rejected'], body['position_updated']), (4, [], True))
+        self.assertEqual(LocationTrace.objects.filter(driver=self.driver).count(), 4)
+        self.assertEqual(self.store.get(self.driver.id)[0], Decimal('31.503000'))
+
+    def test_resent_batch_is_not_an_error(self):
+        self.upload(self.points[:3])
+        response = self.upload(self.points)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['accepted'], 1)
+
+        response = self.upload(self.points)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body['success'], body['accepted']), (True, 0))
+        self.assertEqual([reject['reason'] for reject in body['rejected']], ['out_of_order'] * 3 + ['duplicate'])
+
+    def test_invalid_points_are_rejected(self):
+        response = self.upload([{'latitude': 95, 'longitude': 74.3, 'recorded_at': self.points[0]['recorded_at']}, 'x'])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([reject['reason'] for reject in response.json()['rejected']], ['invalid', 'invalid'])
+        future = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+        future = dict(self.points[0], recorded_at=future.isoformat())
+        self.assertEqual(self.upload([future]).json()['rejected'], [{'index': 0, 'reason': 'future_timestamp'}])
+
+    def test_lagging_cached_watermark_is_rechecked(self):
+        # Another worker stored the batch after this one cached its watermark
+        self.upload(self.points[:1])
+        LocationTrace.objects.bulk_create([
+            LocationTrace(driver=self.driver, latitude=Decimal('31.5'), longitude=Decimal('74.3'),
+                          recorded_at=datetime.datetime.fromisoformat(point['recorded_at']))
+            for point in self.points[1:]
+        ])
+        body = self.upload(self.points).json()
+        self.assertEqual(body['accepted'], 0)
+        self.assertEqual(body['rejected'][-1], {'index': 3, 'reason': 'duplicate'})
+
+
+@override_settings(LOCATION_INGEST_TOKENS=['gateway-token'])
+class LocationIngestTests(RideDataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = LiveLocationStore(flush_interval=3600)
+        self.drivers = list(DriverProfile.objects.order_by('id').values_list('id', flat=True))
+        self.base = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0) + datetime.timedelta(minutes=1)
+
+    def record(self, driver_id, seconds, lat=31.5, lon=74.3):
+        return {'driver_id': driver_id, 'lat': lat, 'lon': lon, 'ts': (self.base + datetime.timedelta(seconds=seconds)).isoformat()}
+
+    def position(self, driver_id):
+        return DriverProfile.objects.filter(id=driver_id).values_list('current_latitude', 'last_location_update').get()
+
+    def test_coalesces_to_newest_record_per_driver(self):
+        first, second = self.drivers[:2]
+        result = ingest_positions([
+            self.record(first, 0, lat=31.1), self.record(first, 20, lat=31.3), self.record(first, 10, lat=31.2),
+            self.record(second, 5),
+        ], store=self.store)
+        self.assertEqual((result['applied'], result['coalesced'], result['rejected']), (2, 2, []))
+        self.assertEqual(self.position(first), (Decimal('31.300000'), self.base + datetime.timedelta(seconds=20)))
+        self.assertEqual(self.store.get(first)[0], Decimal('31.300000'))
+
+    def test_rejects_are_keyed_by_input_index(self):
+        stale = dict(self.record(self.drivers[1], 0), ts=(self.base - datetime.timedelta(hours=1)).isoformat())
+        result = ingest_positions([
+            self.record(self.drivers[0], 0), 'not a record', self.record(self.drivers[0], 5, lat=91),
+            dict(self.record(self.drivers[0], 5), ts='yesterday'), stale, self.record(999999, 0),
+        ], store=self.store)
+        self.assertEqual(result['applied'], 1)
+        self.assertEqual(
+            sorted((reject['index'], reject['reason']) for reject in result['rejected']),
+            [(1, 'invalid'), (2, 'invalid'), (3, 'invalid'), (4, 'stale'), (5, 'unknown_driver')],
+        )
+
+    def test_max_records_and_chunks(self):
+        records = [self.record(driver_id, 0) for driver_id in self.drivers]
+        result = ingest_positions(records, chunk_size=2, max_records=3, store=self.store)
+        self.assertEqual((result['received'], result['applied'], result['chunks'], result['truncated']), (3, 3, 2, True))
+        self.assertIsNone(self.position(self.drivers[3])[0])
+
+    def test_ndjson_stream_with_malformed_line(self):
+        body = b'\n'.join([
+            json.dumps(self.record(self.drivers[0], 0)).encode(), b'{"driver_id": ', b'',
+            json.dumps(self.record(self.drivers[1], 0)).encode(),
+        ])
+        with mock.patch('drivo.live_location.live_locations', self.store):
+            response = self.client.post(
+                reverse('drivo:bulk-location-ingest'), body,
+                content_type='application/x-ndjson', HTTP_X_INGEST_TOKEN='gateway-token',
+            )
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body['received'], body['applied']), (3, 2))
+        self.assertEqual(body['rejected'], [{'index': 1, 'reason': 'invalid'}])
+
+    def test_requires_ingest_token(self):
+        url = reverse('drivo:bulk-location-ingest')
+        records = [self.record(self.drivers[0], 0)]
+        self.assertEqual(self.client.post(url, records, content_type='application/json').status_code, 403)
+        response = self.client.post(url, records, content_type='application/json', HTTP_X_INGEST_TOKEN='guess')
+        self.assertEqual(response.status_code, 403)
+
+
+class AssignmentSolverTests(SimpleTestCase):
+    def optimum(self, cost):
+        return min(
+            sum(cost[row, col] for row, col in enumerate(cols))
+            for cols in itertools.permutations(range(cost.shape[1]), cost.shape[0])
+        )
+
+    def test_solvers_beat_greedy(self):
+        # Greedy takes the cheapest edge (0, 0) and leaves row 1 the expensive column
+        cost = np.array([[1.0, 2.0], [2.0, 100.0]])
+        greedy = greedy_assignment(cost)
+        self.assertEqual(cost[np.arange(2), greedy].sum(), 101)
+        improved = improve_assignment(cost, greedy.copy())
+        self.assertEqual(cost[np.arange(2), improved].sum(), 4)
+        rows, cols, _ = solve_assignment(cost)
+        self.assertEqual(cost[rows, cols].sum(), 4)
+
+    def test_optimal_on_random_matrices(self):
+        rng = np.random.default_rng(3)
+        for _ in range(20):
+            cost = rng.uniform(0, 10, size=(5, 6))
+            rows, cols, solver = solve_assignment(cost)
+            self.assertEqual(solver, 'hungarian')
+            self.assertEqual(len(rows), 5)
+            self.assertAlmostEqual(cost[rows, cols].sum(), self.optimum(cost))
+
+    def test_greedy_fallback_without_scipy(self):
+        cost = np.array([[4.0, 1.0, 3.0], [2.0, 0.0, 5.0], [3.0, 2.0, 2.0]])
+        with mock.patch('drivo.dispatch.linear_sum_assignment', None):
+            rows, cols, solver = solve_assignment(cost)
+        self.assertEqual(solver, 'greedy')
+        self.assertEqual(len(set(cols.tolist())), 3)
+        self.assertAlmostEqual(cost[rows, cols].sum(), self.optimum(cost))
+
+    def test_unreachable_pairs_are_never_assigned(self):
+        cost = np.array([[1.0, UNREACHABLE], [UNREACHABLE, UNREACHABLE]])
+        for solver in ('hungarian', 'greedy'):
+            with self.subTest(solver=solver):
+                rows, cols, _ = solve_assignment(cost, solver)
+                self.assertEqual((rows.tolist(), cols.tolist()), ([0], [0]))
+
+    def test_pickup_distance_cutoff(self):
+        # Drivers ~1.1 km and ~22 km north of the ride
+        rides, drivers, km, _ = assign_rides([31.5, 31.5], [74.3, 74.3], [31.51, 31.7], [74.3, 74.3], max_km=10)
+        self.assertEqual((rides.tolist(), drivers.tolist()), ([0], [0]))
+        self.assertLess(km[0], 1.2)
+
+
+class DispatchTickTests(RideDataTestCase):
+    def setUp(self):
+        super().setUp()
+        driver_index.clear()
+        driver_index._loaded = False
+        self.addCleanup(driver_index.clear)
+        for name, lat in (('Driver 0', '31.510000'), ('Driver 1', '31.580000')):
+            DriverProfile.objects.filter(full_name=name).update(
+                status='available', current_latitude=lat, current_longitude='74.300000'
+            )
+        client = ClientProfile.objects.get(full_name='Client 0')
+        self.rides = [
+            Ride.objects.create(
+                client=client, pickup_location='A', dropoff_location='B', vehicle_type='car',
+                fuel_type='petrol', trip_type='one-way', pickup_latitude=Decimal(lat), pickup_longitude=Decimal('74.3'),
+            )
+            for lat in ('31.5', '31.55')
+        ]
+
+    def tearDown(self):
+        driver_index._loaded = False
+
+    def test_tick_assigns_requested_rides(self):
+        metrics = DispatchEngine().tick()
+        self.assertEqual((metrics['rides'], metrics['drivers'], metrics['assigned']), (2, 2, 2))
+        self.assertIn('solve_ms', metrics['timings'])
+        assigned = dict(Ride.objects.filter(id__in=[ride.id for ride in self.rides]).values_list('id', 'driver__full_name'))
+        self.assertEqual(assigned, {self.rides[0].id: 'Driver 0', self.rides[1].id: 'Driver 1'})
+        self.assertEqual(
+            set(Ride.objects.filter(id__in=assigned).values_list('status', flat=True)), {'accepted'}
+        )
+        # Assigned drivers are busy for the next tick
+        self.assertEqual(DispatchEngine().tick()['rides'], 0)
+
+    @override_settings(DISPATCH_MAX_PICKUP_KM=2)
+    def test_tick_respects_max_pickup_distance(self):
+        metrics = DispatchEngine().tick()
+        self.assertEqual((metrics['assigned'], metrics['unassigned']), (1, 1))
+        self.assertIsNone(Ride.objects.get(id=self.rides[1].id).driver_id)
+
+
+class PlaceAutocompleteTests(TestCase):
+    def test_limit_must_be_positive(self):
+        url = reverse('drivo:place-autocomplete')
+        results = self.client.get(url, {'q': 'la', 'limit': 2}).json()['results']
+        self.assertTrue(0 < len(results) <= 2)
+        for limit in ('-3', '0', 'two'):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.client.get(url, {'q': 'la', 'limit': limit}).status_code, 400)
+
+    def test_complete_returns_nothing_for_non_positive_limit(self):
+        index = get_autocomplete_index()
+        self.assertEqual(index.complete('la', -3), [])
+        self.assertEqual(index.complete('lahore', -3), [])
+        self.assertEqual(len(index.complete('la')), index.max_results)
+
+    def add_rides(self, pickup_location, count):
+        client = ClientProfile.objects.create(
+            user=User.objects.create_user(f'{uuid.uuid4().hex}@example.com', 'pass', is_client=True)
+        )
+        for _ in range(count):
+            Ride.objects.create(
+                client=client, pickup_location=pickup_location, dropoff_location='', vehicle_type='car',
+                fuel_type='petrol', trip_type='one-way',
+            )
+
+    def test_popular_places_rank_first(self):
+        gazetteer = make_gazetteer()
+        karachi, lahore = gazetteer.lookup('dha karachi')[0], gazetteer.lookup('dha lahore')[0]
+        # Without rides the more important DHA (Karachi) leads
+        self.assertEqual([place for place, _ in AutocompleteIndex(gazetteer).complete('dh')], [karachi, lahore])
+
+        self.add_rides('DHA Phase 6, Lahore', 3)
+        self.add_rides('Defence, Lahore', 1)
+        self.add_rides('DHA, Karachi', 2)
+        popularity = compute_popularity(gazetteer)
+        self.assertEqual((popularity[lahore.id], popularity[karachi.id]), (4, 2))
+        # Precomputed short prefixes and ranges ranked on the fly agree
+        for precompute_chars in (3, 1):
+            index = AutocompleteIndex(gazetteer, popularity, precompute_chars=precompute_chars)
+            self.assertEqual(index.complete('dha'), [(lahore, 4), (karachi, 2)])
+
+    def test_popularity_is_shared_between_workers(self):
+        gazetteer = make_gazetteer()
+        self.add_rides('Liberty Market, Lahore', 2)
+        shared_cache().delete(autocomplete.POPULARITY_CACHE_KEY)
+        with mock.patch.object(autocomplete, 'get_gazetteer', return_value=gazetteer), \
+                mock.patch.object(autocomplete, '_index', None):
+            names = [result['name'] for result in self.client.get(reverse('drivo:place-autocomplete'), {'q': 'l'}).json()['results']]
+            self.assertEqual(names[0], 'Liberty Market')
+            # Another worker's first build reads the counts instead of recounting
+            autocomplete._index = None
+            with mock.patch.object(autocomplete, 'compute_popularity', side_effect=AssertionError('recounted')):
+                index = get_autocomplete_index()
+            self.assertEqual(index.complete('liberty')[0][1], 2)
+
+
+@override_settings(CACHES=IN_PROCESS_SHARED_CACHES)
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        caches['shared'].clear()
+
+    def run_concurrently(self, flight, compute, callers=5):
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(flight.run('key', compute, lambda: None))
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_threads_share_one_computation(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        flight = SingleFlight('test')
+        results, errors = self.run_concurrently(flight, compute)
+        self.assertEqual((results, errors, len(calls)), (['value'] * 5, [], 1))
+        self.assertEqual((flight.stats()['computed'], flight.stats()['coalesced']), (1, 4))
+
+    def test_error_reaches_every_waiter(self):
+        def compute():
+            time.sleep(0.2)
+            raise UpstreamError('down')
+
+        results, errors = self.run_concurrently(SingleFlight('test'), compute)
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 5)
+        self.assertTrue(all(error is errors[0] for error in errors))
+
+    def test_waits_for_result_from_another_worker(self):
+        # A separate backend instance stands in for another worker's connection
+        other_worker = caches.create_connection('shared')
+        other_worker.add('singleflight_test_key', True, timeout=10)
+        polls = []
+
+        def lookup():
+            polls.append(1)
+            return 'remote' if len(polls) >= 2 else None
+
+        flight = SingleFlight('test', poll_interval=0.01)
+        self.assertEqual(flight.run('key', lambda: self.fail('computed twice'), lookup), 'remote')
+        self.assertEqual(flight.stats()['coalesced_remote'], 1)
+
+    def test_computes_when_other_worker_stores_nothing(self):
+        caches.create_connection('shared').add('singleflight_test_key', True, timeout=10)
+        flight = SingleFlight('test', wait_timeout=0.2, poll_interval=0.05)
+        self.assertEqual(flight.run('key', lambda: 'local', lambda: None), 'local')
+        self.assertEqual((flight.stats()['computed'], flight.stats()['lock_fallbacks']), (1, 1))
+
+        # A released lock ends the wait early
+        flight = SingleFlight('test', wait_timeout=10, poll_interval=0.05)
+        caches.create_connection('shared').add('singleflight_test_other', True, timeout=10)
+        release = threading.Timer(0.1, lambda: caches.create_connection('shared').delete('singleflight_test_other'))
+        release.start()
+        started = time.monotonic()
+        self.assertEqual(flight.run('other', lambda: 'local', lambda: None), 'local')
+        self.assertLess(time.monotonic() - started, 2)
+        release.join()
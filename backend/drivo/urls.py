@@ -2,10 +2,12 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     UserViewSet, DriverProfileViewSet, ClientProfileViewSet, RideViewSet, 
-    PaymentViewSet, ReviewViewSet, AvailableDriversView, DebugDriversView,
+    PaymentViewSet, ReviewViewSet, FareQuoteView, AvailableDriversView, DebugDriversView,
     SignupView, SendOTPView, VerifyOTPView, SetUserTypeView, ClientProfileView,
     DriverProfileView, UpdateDriverLocationView, UpdateClientLocationView,
-    SaveLocationView, GetCurrentLocationView, GeocodeView, CacheStatsView,
+    DriverLocationTraceView, BulkLocationIngestView,
+    SaveLocationView, GetCurrentLocationView, GeocodeView, BatchGeocodeView, CacheStatsView,
+    ReverseGeocodeView, PlaceAutocompleteView, MetricsView,
     ResetPasswordView, UserTypeView, RequestDebugView, test_media_view, 
     serve_media_view, UserProfileView, CurrentUserView
 )
@@ -40,15 +42,24 @@ urlpatterns = [
     
     # Location endpoints
     path('driver/update-location/', UpdateDriverLocationView.as_view(), name='update-driver-location'),
+    path('driver/location-trace/', DriverLocationTraceView.as_view(), name='driver-location-trace'),
+    path('ingest/locations/', BulkLocationIngestView.as_view(), name='bulk-location-ingest'),
     path('client/update-location/', UpdateClientLocationView.as_view(), name='update-client-location'),
     path('save-location/', SaveLocationView.as_view(), name='save-location'),
     path('get-current-location/', GetCurrentLocationView.as_view(), name='get-current-location'),
     
+    # Fare endpoints
+    path('fare-quotes/', FareQuoteView.as_view(), name='fare-quotes'),
+    
     # Other endpoints
     path('available-drivers/', AvailableDriversView.as_view(), name='available-drivers'),
     path('debug-drivers/', DebugDriversView.as_view(), name='debug-drivers'),
     path('geocode/', GeocodeView.as_view(), name='geocode'),
+    path('geocode/batch/', BatchGeocodeView.as_view(), name='batch-geocode'),
+    path('reverse-geocode/', ReverseGeocodeView.as_view(), name='reverse-geocode'),
+    path('places/autocomplete/', PlaceAutocompleteView.as_view(), name='place-autocomplete'),
     path('cache-stats/', CacheStatsView.as_view(), name='cache-stats'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('request-debug/', RequestDebugView.as_view(), name='request-debug'),
     
     # Media debug endpoints
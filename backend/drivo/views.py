@@ -9,19 +9,45 @@ from django.core.mail import send_mail
 from django.conf import settings
 from django.contrib.auth.hashers import make_password
 from django.views.static import serve
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+import json
+import math
 import random
-import requests
 from django.core.cache import cache
 import re
+import time
 from datetime import datetime, timedelta
 import os
 from drivo.models import (
-    User, DriverProfile, ClientProfile, Ride, Payment, Review, EmailOTP
+    User, DriverProfile, ClientProfile, Ride, Payment, Review, EmailOTP,
+    LocationTrace
 )
 from drivo.serializers import (
     UserSerializer, DriverProfileSerializer, ClientProfileSerializer,
     RideSerializer, PaymentSerializer, ReviewSerializer,
+    FareQuoteSerializer, RIDE_COORDINATE_FIELDS,
 )
+from drivo.autocomplete import get_autocomplete_index
+from drivo.cache_backends import cache_stats
+from drivo.conditional import (
+    etag_for, feed_state, not_modified, ride_state, row_state, set_etag, state_fields, user_state,
+)
+from drivo.fares import cached_quotes, estimate_fare, quote_options
+from drivo.fieldsets import SparseFieldsViewMixin
+from drivo.gazetteer import display_name, get_gazetteer, to_result
+from drivo.geocoding import geocode, geocode_many, geocode_stats
+from drivo.geo import AVAILABLE_DRIVER_STATUSES, driver_index, driver_status_counts, parse_coordinates
+from drivo.live_location import (
+    live_locations, driver_profile_id_for_user, parse_recorded_at, quantize_coordinate,
+    ingest_positions
+)
+from drivo.matrix import city_speeds, eta_minutes
+from drivo.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, prometheus_text
+from drivo.pagination import DriverFeedPagination, KeysetPagination
+from drivo.parsers import NDJSONParser, ORJSONParser
+from drivo.permissions import HasIngestToken
+from drivo.renderers import MessagePackMixin
 
 # ------------------- TEST MEDIA VIEW -------------------
 def test_media_view(request):
@@ -98,20 +124,60 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
-class DriverProfileViewSet(viewsets.ModelViewSet):
-    queryset = DriverProfile.objects.all()
+class DriverProfileViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
+    queryset = DriverProfile.objects.select_related('user')
     serializer_class = DriverProfileSerializer
 
 class ClientProfileViewSet(viewsets.ModelViewSet):
-    queryset = ClientProfile.objects.all()
+    queryset = ClientProfile.objects.select_related('user')
     serializer_class = ClientProfileSerializer
 
-class RideViewSet(viewsets.ModelViewSet):
-    queryset = Ride.objects.all()
+def fill_location_labels(data):
+    """
+    Set missing pickup_location/dropoff_location in ride data to the
+    nearest known place to the matching coordinates, in one lookup.
+    """
+    missing = []
+    for prefix in ('pickup', 'dropoff'):
+        if data.get(f'{prefix}_location'):
+            continue
+        coords = parse_coordinates(data.get(f'{prefix}_latitude'), data.get(f'{prefix}_longitude'))
+        if coords is not None:
+            missing.append((prefix, coords))
+    if not missing:
+        return
+    gazetteer = get_gazetteer()
+    place_ids, _ = gazetteer.nearest(
+        [coords[0] for _, coords in missing], [coords[1] for _, coords in missing],
+        getattr(settings, 'REVERSE_GEOCODE_MAX_KM', 5)
+    )
+    for (prefix, _), place_id in zip(missing, place_ids.tolist()):
+        if place_id >= 0:
+            data[f'{prefix}_location'] = display_name(gazetteer.places[place_id])
+
+class RideViewSet(MessagePackMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
+    # RideSerializer nests both profiles and their users; join them up front
+    queryset = Ride.objects.select_related('client__user', 'driver__user')
     serializer_class = RideSerializer
+    pagination_class = KeysetPagination
     permission_classes = [permissions.IsAuthenticated]
     authentication_classes = [JWTAuthentication]
     
+    def retrieve(self, request, *args, **kwargs):
+        # Polled for status changes: answer an unchanged ride from one
+        # values_list() read, without loading or serializing it
+        try:
+            state = ride_state(int(kwargs[self.lookup_url_kwarg or self.lookup_field]))
+        except ValueError:
+            state = None
+        if state is None:
+            return super().retrieve(request, *args, **kwargs)
+        etag = etag_for(request, state)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        return set_etag(super().retrieve(request, *args, **kwargs), etag)
+    
     def create(self, request, *args, **kwargs):
         print("=" * 60)
         print("=== RIDE CREATE DEBUG ===")
@@ -164,6 +230,9 @@ class RideViewSet(viewsets.ModelViewSet):
             'client': client_profile.id
         }
         
+        # Label coordinates-only pickups/dropoffs with the nearest known place
+        fill_location_labels(mapped_data)
+        
         # Handle date and time conversion
         date_str = request.data.get('date')
         time_str = request.data.get('time')
@@ -206,6 +275,17 @@ class RideViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        validated = serializer.validated_data
+        fare = estimate_fare(
+            validated.get('pickup_latitude'),
+            validated.get('pickup_longitude'),
+            validated.get('dropoff_latitude'),
+            validated.get('dropoff_longitude'),
+            vehicle_type=validated['vehicle_type'],
+            fuel_type=validated.get('fuel_type'),
+            trip_type=validated['trip_type'],
+        )
+
         try:
             # Create the ride instance with explicit driver=None
             ride = Ride.objects.create(
@@ -221,6 +301,7 @@ class RideViewSet(viewsets.ModelViewSet):
                 vehicle_type=serializer.validated_data['vehicle_type'],
                 fuel_type=serializer.validated_data.get('fuel_type'),
                 trip_type=serializer.validated_data['trip_type'],
+                fare=fare,
                 status='requested'  # Default status
             )
             
@@ -244,59 +325,163 @@ class RideViewSet(viewsets.ModelViewSet):
             )
 
 class PaymentViewSet(viewsets.ModelViewSet):
-    queryset = Payment.objects.all()
+    queryset = Payment.objects.select_related('client__user')
     serializer_class = PaymentSerializer
+    pagination_class = KeysetPagination
 
-class ReviewViewSet(viewsets.ModelViewSet):
-    queryset = Review.objects.all()
+class ReviewViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
+    queryset = Review.objects.select_related('client__user', 'driver__user')
     serializer_class = ReviewSerializer
+    pagination_class = KeysetPagination
+
+# ------------------- FARE QUOTE VIEW -------------------
+class FareQuoteView(APIView):
+    """
+    API endpoint to quote every vehicle/fuel/trip type combination for one
+    pickup/dropoff pair, or for several under {"trips": [...]}, in a single
+    batched pricing pass. Quotes are cached briefly by rounded coordinates.
+    """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+    
+    def post(self, request):
+        serializer = FareQuoteSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"error": "Validation failed", "details": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        trips = [
+            tuple(trip[field] for field in RIDE_COORDINATE_FIELDS)
+            for trip in serializer.validated_data['trips']
+        ]
+        quotes, cache_hits = cached_quotes(
+            trips,
+            places=getattr(settings, 'FARE_QUOTE_COORDINATE_PLACES', 4),
+            timeout=getattr(settings, 'FARE_QUOTE_CACHE_SECONDS', 60),
+        )
+        vehicle_types, fuel_types, trip_types = quote_options()
+        return Response({
+            "currency": getattr(settings, 'FARE_CURRENCY', 'PKR'),
+            "vehicle_types": vehicle_types,
+            "fuel_types": fuel_types,
+            "trip_types": trip_types,
+            "cache_hits": cache_hits,
+            "quotes": [
+                dict(zip(RIDE_COORDINATE_FIELDS, map(float, trip)), **quote)
+                for trip, quote in zip(trips, quotes)
+            ],
+        }, status=status.HTTP_200_OK)
 
 # ------------------- AVAILABLE DRIVERS VIEW -------------------
-class AvailableDriversView(generics.ListAPIView):
+class AvailableDriversView(MessagePackMixin, SparseFieldsViewMixin, generics.ListAPIView):
     """
-    API endpoint that returns available drivers.
+    API endpoint that returns available drivers, a page at a time
+    (?cursor=, ?page_size=), optionally narrowed with ?city= and
+    ?status=a,b. 'count' comes from cached per-status counts; if no driver
+    is available every driver is listed.
+    Pass ?lat=&lon= (with optional radius_km and k) to get the drivers
+    nearest to a point, closest first, from the in-memory grid index, with
+    distance and an ETA from the driver's city speed profile.
+    Both forms accept ?fields= and ?expand=user.
     """
     serializer_class = DriverProfileSerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = DriverFeedPagination
+    
+    def get_statuses(self, counts):
+        """Statuses to list: ?status=, else the available ones, else None (all) if none are available."""
+        requested = [value.strip() for value in self.request.query_params.get('status', '').split(',') if value.strip()]
+        if requested:
+            return requested
+        if any(counts.get(driver_status) for driver_status in AVAILABLE_DRIVER_STATUSES):
+            return list(AVAILABLE_DRIVER_STATUSES)
+        return None
     
     def get_queryset(self):
-        # Debug: Print all drivers in the database
-        all_drivers = DriverProfile.objects.all()
-        print(f"=== DEBUG: Total drivers in database: {all_drivers.count()} ===")
-        
-        # Print details of each driver
-        for driver in all_drivers:
-            print(f"Driver ID: {driver.id}, Name: {driver.full_name}, Status: '{driver.status}', Phone: {driver.phone_number}")
-            print(f"User: {driver.user.email if driver.user else 'No user linked'}, is_driver: {driver.user.is_driver if driver.user else 'N/A'}")
-            print("-" * 40)
-        
-        # Try to get drivers with expected statuses
-        available_drivers = DriverProfile.objects.filter(status__in=['available', 'online', 'active'])
-        print(f"=== DEBUG: Drivers with expected status: {available_drivers.count()} ===")
+        counts = driver_status_counts(self.request.query_params.get('city') or None)
+        return self.get_feed_queryset(counts)
+    
+    def get_feed_queryset(self, counts):
+        city = self.request.query_params.get('city') or None
+        statuses = self.get_statuses(counts)
+        self.total = sum(counts.values()) if statuses is None else sum(counts.get(s, 0) for s in statuses)
+        queryset = DriverProfile.objects.select_related('user')
+        if statuses is not None:
+            queryset = queryset.filter(status__in=statuses)
+        if city:
+            queryset = queryset.filter(city=city)
+        return self.apply_fieldset(queryset)
+    
+    def list(self, request, *args, **kwargs):
+        if 'lat' in request.query_params or 'lon' in request.query_params:
+            return self.list_nearby(request)
         
-        # If no drivers have expected status, return all drivers for debugging
-        if not available_drivers.exists():
-            print("=== DEBUG: No drivers with expected status, returning all drivers ===")
-            return all_drivers
+        # An unchanged feed costs one narrow read of the matching rows instead
+        # of a serialized page; the cached 'count' is left out of the ETag
+        counts = driver_status_counts(request.query_params.get('city') or None)
+        queryset = self.get_feed_queryset(counts)
+        etag = etag_for(request, feed_state(queryset))
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
         
-        return available_drivers
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return set_etag(self.get_paginated_response(serializer.data), etag)
     
-    def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
+    def list_nearby(self, request):
+        params = request.query_params
+        coords = parse_coordinates(params.get('lat'), params.get('lon'))
+        if coords is None:
+            return Response(
+                {"error": "Valid 'lat' and 'lon' query parameters are required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        response_data = {
-            'count': queryset.count(),
-            'drivers': serializer.data
-        }
+        max_radius = getattr(settings, 'DRIVER_SEARCH_MAX_RADIUS_KM', 50)
+        max_results = getattr(settings, 'DRIVER_SEARCH_MAX_RESULTS', 100)
+        try:
+            radius_km = float(params.get('radius_km', getattr(settings, 'DRIVER_SEARCH_DEFAULT_RADIUS_KM', 5)))
+            k = int(params['k']) if params.get('k') else None
+        except ValueError:
+            return Response(
+                {"error": "'radius_km' must be a number and 'k' an integer"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not math.isfinite(radius_km) or radius_km <= 0 or (k is not None and k <= 0):
+            return Response(
+                {"error": "'radius_km' and 'k' must be positive"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        radius_km = min(radius_km, max_radius)
+        k = min(k, max_results) if k is not None else max_results
         
-        # Add debug information
-        if queryset.count() == 0:
-            response_data['debug'] = "No drivers found in database"
-        else:
-            response_data['debug'] = f"Found {queryset.count()} drivers"
+        driver_index.ensure_fresh()
+        lat, lon = coords
+        hits = driver_index.nearest(lat, lon, k, radius_km, statuses=AVAILABLE_DRIVER_STATUSES)
+        
+        # One query for the matched rows; the index may be a few seconds stale,
+        # so the status filter is re-applied against the database
+        profiles = self.apply_fieldset(
+            DriverProfile.objects.select_related('user').filter(status__in=AVAILABLE_DRIVER_STATUSES),
+            extra_columns=('city',)
+        ).in_bulk([hit[1] for hit in hits])
+        ordered = [(profiles[hit[1]], hit[0]) for hit in hits if hit[1] in profiles]
+        serializer = self.get_serializer([profile for profile, _ in ordered], many=True)
+        drivers = serializer.data
+        speeds, road_factors = city_speeds([profile.city for profile, _ in ordered])
+        etas = eta_minutes([distance for _, distance in ordered], speeds, road_factors)
+        for item, (_, distance), eta in zip(drivers, ordered, etas.tolist()):
+            item['distance_km'] = round(distance, 3)
+            item['eta_minutes'] = round(eta, 1)
         
-        return Response(response_data)
+        return Response({
+            'count': len(drivers),
+            'radius_km': radius_km,
+            'drivers': drivers
+        })
 
 # ------------------- DEBUG DRIVERS VIEW -------------------
 class DebugDriversView(APIView):
@@ -552,6 +737,13 @@ class ClientProfileView(APIView):
                 {"error": "User is not a client. Please switch to client mode."}, 
                 status=status.HTTP_403_FORBIDDEN
             )
+        
+        # Unchanged since the client's last poll: answer from one row read
+        state = row_state(ClientProfile.objects.filter(user_id=request.user.id), state_fields(ClientProfile))
+        etag = etag_for(request, state, user_state(request.user)) if state is not None else None
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
             
         profile, created = ClientProfile.objects.get_or_create(user=request.user, defaults={
             'full_name': '',
@@ -562,7 +754,7 @@ class ClientProfileView(APIView):
         })
         
         serializer = ClientProfileSerializer(profile, context={'request': request})
-        return Response(serializer.data, status=200)
+        return set_etag(Response(serializer.data, status=200), etag)
     
     def put(self, request):
         # Check if user is a client
@@ -625,6 +817,13 @@ class DriverProfileView(APIView):
                 {"error": "User is not a driver. Please switch to driver mode."}, 
                 status=status.HTTP_403_FORBIDDEN
             )
+        
+        # Unchanged since the driver's last poll: answer from one row read
+        state = row_state(DriverProfile.objects.filter(user_id=request.user.id), state_fields(DriverProfile))
+        etag = etag_for(request, state, user_state(request.user)) if state is not None else None
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
             
         profile, created = DriverProfile.objects.get_or_create(user=request.user, defaults={
             'full_name': '',
@@ -638,7 +837,7 @@ class DriverProfileView(APIView):
         })
         
         serializer = DriverProfileSerializer(profile, context={'request': request})
-        return Response(serializer.data, status=200)
+        return set_etag(Response(serializer.data, status=200), etag)
     
     def put(self, request):
         # Check if user is a driver
@@ -705,33 +904,177 @@ class DriverProfileView(APIView):
         return Response(serializer.data, status=200)
 
 # ------------------- UPDATE DRIVER LOCATION VIEW -------------------
-class UpdateDriverLocationView(APIView):
+class UpdateDriverLocationView(MessagePackMixin, APIView):
     """
     API endpoint for drivers to update their current latitude and longitude.
+    Pings go to the live location store and reach DriverProfile in the
+    next write-behind flush.
     """
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
     
     def patch(self, request):
-        try:
-            # Get the logged-in user's driver profile
-            profile = DriverProfile.objects.get(user=request.user)
-            # Update latitude and longitude from request
-            profile.current_latitude = request.data.get('current_latitude')
-            profile.current_longitude = request.data.get('current_longitude')
-            profile.save()
+        # Get the logged-in user's driver profile id (cached, no row fetch)
+        profile_id = driver_profile_id_for_user(request.user)
+        if profile_id is None:
             return Response(
-                {"success": True, "message": "Location updated successfully", "next_step": "driver_home"},
-                status=status.HTTP_200_OK
+                {"success": False, "error": "Driver profile not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        latitude = request.data.get('current_latitude')
+        longitude = request.data.get('current_longitude')
+        if parse_coordinates(latitude, longitude) is None:
+            return Response(
+                {"success": False, "error": "Valid current_latitude and current_longitude are required"},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        except DriverProfile.DoesNotExist:
+        
+        live_locations.record(profile_id, latitude, longitude)
+        return Response(
+            {"success": True, "message": "Location updated successfully", "next_step": "driver_home"},
+            status=status.HTTP_200_OK
+        )
+
+# ------------------- DRIVER LOCATION TRACE VIEW -------------------
+class DriverLocationTraceView(APIView):
+    """
+    API endpoint for drivers to upload buffered GPS points in one request.
+    Body: {"points": [{"latitude": .., "longitude": .., "recorded_at": ..}, ...]}
+    with recorded_at as ISO-8601 or epoch seconds/milliseconds, oldest first.
+    Accepted points are stored with a single bulk insert and the newest one
+    becomes the driver's current position. Resending points that are
+    already stored is answered with 200 and the points rejected as
+    duplicate or out_of_order.
+    """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+    
+    def post(self, request):
+        profile_id = driver_profile_id_for_user(request.user)
+        if profile_id is None:
             return Response(
                 {"success": False, "error": "Driver profile not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
+        
+        points = request.data.get('points') if hasattr(request.data, 'get') else request.data
+        if not isinstance(points, list) or not points:
+            return Response(
+                {"success": False, "error": "'points' must be a non-empty list"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        max_points = getattr(settings, 'LOCATION_TRACE_MAX_POINTS', 1000)
+        if len(points) > max_points:
+            return Response(
+                {"success": False, "error": f"At most {max_points} points per request"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        future_limit = timezone.now() + timedelta(
+            seconds=getattr(settings, 'LOCATION_TRACE_MAX_CLOCK_SKEW_SECONDS', 60)
+        )
+        valid = []
+        rejected = []
+        for index, point in enumerate(points):
+            if not isinstance(point, dict):
+                rejected.append({'index': index, 'reason': 'invalid'})
+                continue
+            latitude = point.get('latitude')
+            longitude = point.get('longitude')
+            recorded_at = parse_recorded_at(point.get('recorded_at'))
+            if parse_coordinates(latitude, longitude) is None or recorded_at is None:
+                rejected.append({'index': index, 'reason': 'invalid'})
+            elif recorded_at > future_limit:
+                rejected.append({'index': index, 'reason': 'future_timestamp'})
+            else:
+                valid.append((index, latitude, longitude, recorded_at))
+        
+        # Newest stored trace point; anything at or before it is a resend.
+        # The cached value only ever lags the table (another worker may have
+        # stored newer points), so it is enough to reject a resend, but
+        # points past it are checked against the table
+        watermark_key = f'location_trace_watermark_{profile_id}'
+        watermark = cache.get(watermark_key)
+        if valid and (watermark is None or max(point[3] for point in valid) > watermark):
+            watermark = LocationTrace.objects.filter(driver_id=profile_id).order_by(
+                '-recorded_at'
+            ).values_list('recorded_at', flat=True).first()
+        
+        accepted = []
+        for index, latitude, longitude, recorded_at in valid:
+            if watermark is not None and recorded_at == watermark:
+                rejected.append({'index': index, 'reason': 'duplicate'})
+            elif watermark is not None and recorded_at < watermark:
+                rejected.append({'index': index, 'reason': 'out_of_order'})
+            else:
+                accepted.append(LocationTrace(
+                    driver_id=profile_id,
+                    latitude=quantize_coordinate(latitude),
+                    longitude=quantize_coordinate(longitude),
+                    recorded_at=recorded_at,
+                ))
+                watermark = recorded_at
+        rejected.sort(key=lambda reject: reject['index'])
+        
+        position_updated = False
+        if accepted:
+            # The unique (driver, recorded_at) constraint backs up the
+            # watermark check if two uploads race
+            LocationTrace.objects.bulk_create(accepted, ignore_conflicts=True)
+            cache.set(watermark_key, watermark, timeout=getattr(settings, 'LIVE_LOCATION_TTL_SECONDS', 300))
+            newest = accepted[-1]
+            position_updated = live_locations.record(
+                profile_id, newest.latitude, newest.longitude, recorded_at=newest.recorded_at
+            )
+        
+        # A retried upload whose points are all stored already is not an
+        # error; only a batch with nothing but invalid points is
+        resent = all(reject['reason'] in ('duplicate', 'out_of_order') for reject in rejected)
+        ok = bool(accepted) or resent
+        return Response({
+            "success": ok,
+            "accepted": len(accepted),
+            "rejected": rejected,
+            "position_updated": position_updated,
+            "next_step": "driver_home"
+        }, status=status.HTTP_200_OK if ok else status.HTTP_400_BAD_REQUEST)
+
+# ------------------- BULK LOCATION INGEST VIEW -------------------
+class BulkLocationIngestView(APIView):
+    """
+    Service endpoint for the telematics gateway and load simulator to push
+    many driver positions at once. Accepts a JSON array of
+    {driver_id, lat, lon, ts} records (or {"records": [...]}), or a streamed
+    application/x-ndjson body with one record per line. Records are applied
+    in chunks, each with one bulk_update inside its own transaction.
+    Authenticated with the X-Ingest-Token header instead of JWT.
+    """
+    authentication_classes = []
+    permission_classes = [HasIngestToken]
+    parser_classes = [ORJSONParser, NDJSONParser]
+    
+    def post(self, request):
+        started = time.perf_counter()
+        records = request.data
+        if isinstance(records, dict):
+            records = records.get('records')
+        if records is None or isinstance(records, (str, bytes, dict)) or not hasattr(records, '__iter__'):
+            return Response(
+                {"error": "Expected a list of {driver_id, lat, lon, ts} records"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        result = ingest_positions(
+            records,
+            chunk_size=getattr(settings, 'LOCATION_INGEST_CHUNK_SIZE', 1000),
+            max_records=getattr(settings, 'LOCATION_INGEST_MAX_RECORDS', 50000),
+        )
+        result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return Response(result, status=status.HTTP_200_OK)
 
 # ------------------- UPDATE CLIENT LOCATION VIEW -------------------
-class UpdateClientLocationView(APIView):
+class UpdateClientLocationView(MessagePackMixin, APIView):
     """
     API endpoint for clients to update their current latitude and longitude.
     """
@@ -788,6 +1131,11 @@ class SaveLocationView(APIView):
             profile.current_latitude = latitude
             profile.current_longitude = longitude
             profile.save()
+            driver_index.update_profile(profile)
+            live_locations.record(
+                profile.id, latitude, longitude,
+                recorded_at=profile.last_location_update, persist=False
+            )
             # For drivers, next step is driver profile
             return Response({
                 "success": "Location saved successfully.", 
@@ -830,26 +1178,39 @@ class GetCurrentLocationView(APIView):
                     status=status.HTTP_404_NOT_FOUND
                 )
         elif getattr(user, 'is_driver', False):
-            try:
-                profile = DriverProfile.objects.get(user=user)
-                if profile.current_latitude is not None and profile.current_longitude is not None:
-                    return Response({
-                        "latitude": profile.current_latitude,
-                        "longitude": profile.current_longitude,
-                        "last_updated": profile.last_location_update,
-                        "is_active": user.is_active,
-                        "next_step": "driver_home"
-                    }, status=status.HTTP_200_OK)
-                else:
-                    return Response(
-                        {"error": "No location data available for this user."}, 
-                        status=status.HTTP_404_NOT_FOUND
-                    )
-            except DriverProfile.DoesNotExist:
+            profile_id = driver_profile_id_for_user(user)
+            if profile_id is None:
                 return Response(
                     {"error": "Driver profile not found."}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
+            
+            # Other workers' pings reach the row up to a flush interval late,
+            # so a ping this worker took within that window is served as is
+            position = live_locations.get(profile_id, max_age=live_locations.flush_interval)
+            if position is None:
+                # This worker's older ping or the flushed row, whichever is
+                # newer: another worker may have taken and flushed a later ping
+                position = live_locations.get(profile_id)
+                stored = DriverProfile.objects.filter(id=profile_id).values_list(
+                    'current_latitude', 'current_longitude', 'last_location_update'
+                ).first()
+                if position is None or (stored is not None and stored[2] is not None and stored[2] > position[2]):
+                    position = stored
+            
+            if position is not None and position[0] is not None and position[1] is not None:
+                return Response({
+                    "latitude": position[0],
+                    "longitude": position[1],
+                    "last_updated": position[2],
+                    "is_active": user.is_active,
+                    "next_step": "driver_home"
+                }, status=status.HTTP_200_OK)
+            else:
+                return Response(
+                    {"error": "No location data available for this user."}, 
+                    status=status.HTTP_404_NOT_FOUND
+                )
         else:
             return Response(
                 {"error": "User has no associated profile."}, 
@@ -857,11 +1218,19 @@ class GetCurrentLocationView(APIView):
             )
 
 # ------------------- GEOCODE VIEW (IMPROVED) -------------------
-def sanitize_cache_key(query):
-    # More robust sanitization that handles special characters consistently
-    return re.sub(r'[^A-Za-z0-9]', '_', query.strip().lower())
+def geocode_detail_is_full(request):
+    """True for ?detail=full, False for compact results (the default), None if invalid."""
+    detail = request.query_params.get('detail', 'compact')
+    return {'compact': False, 'full': True}.get(detail)
+
+GEOCODE_DETAIL_ERROR = {"error": "Query parameter 'detail' must be 'compact' or 'full'"}
 
 class GeocodeView(APIView):
+    """
+    API endpoint that geocodes an address. Returns compact results
+    (lat/lon as numbers, display_name, type, source); ?detail=full returns the
+    full Nominatim-style results instead.
+    """
     permission_classes = [AllowAny]
     
     def get(self, request):
@@ -872,124 +1241,218 @@ class GeocodeView(APIView):
                 {"error": "Query parameter 'q' is required"},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        full = geocode_detail_is_full(request)
+        if full is None:
+            return Response(GEOCODE_DETAIL_ERROR, status=status.HTTP_400_BAD_REQUEST)
         
-        # Normalize the query for consistent caching
-        normalized_query = ' '.join(query.split())
-        cache_key = f'geocode_{sanitize_cache_key(normalized_query)}'
+        # Known places come from the gazetteer; concurrent cache misses for
+        # the same query share one upstream request
+        payload = geocode(query, full=full)
+        if isinstance(payload, dict):
+            return Response(
+                {"error": "External API request failed", "details": payload.get('error')},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        if not payload:
+            return Response(
+                {"error": "Location not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(payload, status=status.HTTP_200_OK)
+
+# ------------------- BATCH GEOCODE VIEW -------------------
+def batch_geocode_line(normalized_query, indexes, payload, cached):
+    line = {'query': normalized_query, 'indexes': indexes, 'cached': cached}
+    if isinstance(payload, dict):
+        line.update({'status': 'error', 'error': payload.get('error')})
+    elif not payload:
+        line.update({'status': 'not_found'})
+    else:
+        line.update({'status': 'ok', 'results': payload})
+    return json.dumps(line, separators=(',', ':')) + '\n'
+
+class BatchGeocodeView(APIView):
+    """
+    API endpoint that geocodes many addresses in one call.
+    POST {"queries": ["...", ...]}. Queries are deduplicated, and the response
+    is streamed as application/x-ndjson: one line per distinct query as soon
+    as it resolves (cached results first), with `indexes` pointing back into
+    `queries`, then a final summary line. Results are compact unless
+    ?detail=full is given.
+    """
+    permission_classes = [AllowAny]
+    
+    def post(self, request):
+        queries = request.data.get('queries') if hasattr(request.data, 'get') else None
+        max_queries = getattr(settings, 'GEOCODE_BATCH_MAX_QUERIES', 1000)
+        if not isinstance(queries, list) or not queries or len(queries) > max_queries:
+            return Response(
+                {"error": f"'queries' must be a list of 1 to {max_queries} strings"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        invalid = [
+            index for index, query in enumerate(queries)
+            if not isinstance(query, str) or not query.strip()
+        ]
+        if invalid:
+            return Response(
+                {"error": "Queries must be non-empty strings", "indexes": invalid},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        full = geocode_detail_is_full(request)
+        if full is None:
+            return Response(GEOCODE_DETAIL_ERROR, status=status.HTTP_400_BAD_REQUEST)
         
-        # Try to get from cache
-        cached_response = cache.get(cache_key)
-        if cached_response is not None:
-            print(f"Cache hit for: {query}")
-            return Response(cached_response, status=status.HTTP_200_OK)
+        def stream():
+            unique = cached = 0
+            for normalized_query, indexes, payload, from_cache in geocode_many(
+                queries, max_workers=getattr(settings, 'GEOCODE_BATCH_WORKERS', 4), full=full
+            ):
+                unique += 1
+                cached += from_cache
+                yield batch_geocode_line(normalized_query, indexes, payload, from_cache)
+            summary = {'done': True, 'queries': len(queries), 'unique': unique, 'cached': cached}
+            yield json.dumps(summary, separators=(',', ':')) + '\n'
         
-        print(f"Cache miss for: {query} - Making API request")
+        response = StreamingHttpResponse(stream(), content_type='application/x-ndjson')
+        response['Cache-Control'] = 'no-store'
+        return response
+
+# ------------------- REVERSE GEOCODE VIEW -------------------
+def reverse_geocode_result(gazetteer, place_id, distance, lat, lon):
+    if place_id < 0:
+        return {'lat': lat, 'lon': lon, 'found': False}
+    result = to_result(gazetteer.places[place_id])
+    result.update({'found': True, 'distance_km': round(float(distance), 3)})
+    return result
+
+class ReverseGeocodeView(APIView):
+    """
+    API endpoint that maps coordinates to the nearest known place.
+    GET ?lat=&lon= for one point, or POST {"points": [{"lat": .., "lon": ..}, ...]}
+    to resolve many points in one call.
+    """
+    permission_classes = [AllowAny]
+    
+    def get(self, request):
+        coords = parse_coordinates(request.query_params.get('lat'), request.query_params.get('lon'))
+        if coords is None:
+            return Response(
+                {"error": "Valid 'lat' and 'lon' query parameters are required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # Default coordinates for major cities as fallback
-        default_coordinates = {
-            'lahore': {'lat': '31.5204', 'lon': '74.3587', 'display_name': 'Lahore, Pakistan'},
-            'karachi': {'lat': '24.8607', 'lon': '67.0011', 'display_name': 'Karachi, Pakistan'},
-            'islamabad': {'lat': '33.6844', 'lon': '73.0479', 'display_name': 'Islamabad, Pakistan'},
-            'rawalpindi': {'lat': '33.6007', 'lon': '73.0679', 'display_name': 'Rawalpindi, Pakistan'},
-            'peshawar': {'lat': '34.0151', 'lon': '71.5249', 'display_name': 'Peshawar, Pakistan'},
-            'quetta': {'lat': '30.1798', 'lon': '66.9750', 'display_name': 'Quetta, Pakistan'},
-            'multan': {'lat': '30.1575', 'lon': '71.5249', 'display_name': 'Multan, Pakistan'},
-            'faisalabad': {'lat': '31.4187', 'lon': '73.0791', 'display_name': 'Faisalabad, Pakistan'},
-        }
+        gazetteer = get_gazetteer()
+        place_ids, distances = gazetteer.nearest(
+            [coords[0]], [coords[1]], getattr(settings, 'REVERSE_GEOCODE_MAX_KM', 5)
+        )
+        if place_ids[0] < 0:
+            return Response(
+                {"error": "No known place near these coordinates"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(
+            reverse_geocode_result(gazetteer, place_ids[0], distances[0], *coords),
+            status=status.HTTP_200_OK
+        )
+    
+    def post(self, request):
+        points = request.data.get('points') if hasattr(request.data, 'get') else None
+        max_points = getattr(settings, 'REVERSE_GEOCODE_MAX_POINTS', 500)
+        if not isinstance(points, list) or not points or len(points) > max_points:
+            return Response(
+                {"error": f"'points' must be a list of 1 to {max_points} {{lat, lon}} objects"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        url = 'https://nominatim.openstreetmap.org/search'
-        params = {
-            'q': normalized_query,
-            'format': 'json',
-            'limit': 1,
-            'addressdetails': 1,
-            'extratags': 1,
-            'namedetails': 1
-        }
-        headers = {
-            'User-Agent': 'Drivo/1.0 (gdooduii@gmail.com)'
-        }
+        coords = [
+            parse_coordinates(point.get('lat'), point.get('lon')) if isinstance(point, dict) else None
+            for point in points
+        ]
+        invalid = [index for index, point in enumerate(coords) if point is None]
+        if invalid:
+            return Response(
+                {"error": "Invalid coordinates", "indexes": invalid},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
+        gazetteer = get_gazetteer()
+        place_ids, distances = gazetteer.nearest(
+            [lat for lat, _ in coords], [lon for _, lon in coords],
+            getattr(settings, 'REVERSE_GEOCODE_MAX_KM', 5)
+        )
+        return Response({
+            'results': [
+                reverse_geocode_result(gazetteer, place_id, distance, lat, lon)
+                for place_id, distance, (lat, lon) in zip(place_ids.tolist(), distances.tolist(), coords)
+            ]
+        }, status=status.HTTP_200_OK)
+
+# ------------------- PLACE AUTOCOMPLETE VIEW -------------------
+class PlaceAutocompleteView(APIView):
+    """
+    API endpoint for pickup/dropoff autocomplete. Returns the known places
+    whose name (or any word of it) starts with ?q=, most used in rides first.
+    """
+    permission_classes = [AllowAny]
+    
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {"error": "Query parameter 'q' is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         try:
-            response = requests.get(url, params=params, headers=headers, timeout=5)
-            response.raise_for_status()
-            data = response.json()
-            
-            if data:
-                # Cache the entire response for 24 hours
-                cache.set(cache_key, data, timeout=86400)  # 24 hours
-                print(f"Cached response for: {query}")
-                return Response(data, status=status.HTTP_200_OK)
-            else:
-                # Check if the query matches any of our default cities
-                query_lower = normalized_query.lower()
-                for city, coords in default_coordinates.items():
-                    if city in query_lower:
-                        print(f"Using default coordinates for {city}")
-                        default_data = [coords]
-                        # Cache the default response
-                        cache.set(cache_key, default_data, timeout=86400)
-                        return Response(default_data, status=status.HTTP_200_OK)
-                
-                # Cache empty results for 1 hour to avoid repeated API calls
-                cache.set(cache_key, [], timeout=3600)
-                return Response(
-                    {"error": "Location not found"},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-                
-        except requests.RequestException as e:
-            # If external API fails, try to use default coordinates
-            query_lower = normalized_query.lower()
-            for city, coords in default_coordinates.items():
-                if city in query_lower:
-                    print(f"API failed, using default coordinates for {city}")
-                    default_data = [coords]
-                    # Cache the default response
-                    cache.set(cache_key, default_data, timeout=86400)
-                    return Response(default_data, status=status.HTTP_200_OK)
-            
-            # Cache errors for 5 minutes to avoid hammering the API
-            cache.set(cache_key, {'error': str(e)}, timeout=300)
+            limit = int(request.query_params['limit']) if 'limit' in request.query_params else None
+        except ValueError:
+            limit = 0
+        if limit is not None and limit <= 0:
             return Response(
-                {"error": "External API request failed", "details": str(e)},
-                status=status.HTTP_503_SERVICE_UNAVAILABLE
+                {"error": "'limit' must be a positive integer"},
+                status=status.HTTP_400_BAD_REQUEST
             )
+        
+        results = []
+        for place, rides in get_autocomplete_index().complete(query, limit):
+            result = to_result(place)
+            result.update({'name': place.name, 'city': place.city, 'rides': rides})
+            results.append(result)
+        return Response({'query': query, 'results': results}, status=status.HTTP_200_OK)
 
 # ------------------- CACHE STATS VIEW -------------------
 class CacheStatsView(APIView):
+    """
+    API endpoint with this worker's cache effectiveness: per-namespace hits,
+    misses, sets, evictions, bytes and latency from the instrumented cache
+    backend, plus geocoding counters.
+    """
     permission_classes = [AllowAny]
     
     def get(self, request):
-        from django.core.cache import cache
-        
-        # Get some basic cache stats (implementation depends on your cache backend)
-        try:
-            # For LocMemCache
-            if hasattr(cache, '_cache'):
-                geocode_keys = len([k for k in cache._cache.keys() if k.startswith('geocode')])
-                total_keys = len(cache._cache.keys())
-            else:
-                geocode_keys = "N/A"
-                total_keys = "N/A"
-                
-            stats = {
-                'backend': str(cache.__class__),
-                'geocode_cache_entries': geocode_keys,
-                'total_cache_entries': total_keys,
-                'cache_config': {
-                    'timeout_default': settings.CACHES.get('default', {}).get('TIMEOUT', 'N/A'),
-                    'backend': settings.CACHES.get('default', {}).get('BACKEND', 'N/A')
-                }
+        cache_config = settings.CACHES.get('default', {})
+        stats = {
+            'backend': cache_config.get('BACKEND', 'N/A'),
+            'wrapped_backend': cache_config.get('OPTIONS', {}).get('BACKEND'),
+            'namespaces': cache_stats(),
+            'geocode_requests': geocode_stats(),
+            'cache_config': {
+                'timeout_default': cache_config.get('TIMEOUT', 'N/A'),
+                'backend': cache_config.get('BACKEND', 'N/A')
             }
-        except Exception as e:
-            stats = {
-                'error': str(e),
-                'backend': str(cache.__class__)
-            }
-        
+        }
         return Response(stats, status=200)
 
+# ------------------- METRICS VIEW -------------------
+class MetricsView(APIView):
+    """
+    Cache counters of this worker in the Prometheus text format, for scraping.
+    """
+    permission_classes = [AllowAny]
+    
+    def get(self, request):
+        return HttpResponse(prometheus_text(), content_type=METRICS_CONTENT_TYPE)
+
 # ------------------- RESET PASSWORD VIEW -------------------
 class ResetPasswordView(APIView):
     permission_classes = [IsAuthenticated]